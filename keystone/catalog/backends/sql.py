@@ -15,6 +15,8 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import time
+
 import sqlalchemy.exc
 import webob.exc
 
@@ -26,6 +28,7 @@ from keystone.common.sql import migration
 
 
 CONF = config.CONF
+config.register_int('cache_time', group='catalog', default=60)
 
 
 class Service(sql.ModelBase, sql.DictBase):
@@ -36,6 +39,7 @@ class Service(sql.ModelBase, sql.DictBase):
 
     @classmethod
     def from_dict(cls, service_dict):
+        service_dict = service_dict.copy()
         extra = {}
         for k, v in service_dict.copy().iteritems():
             if k not in ['id', 'type', 'extra']:
@@ -62,6 +66,7 @@ class Endpoint(sql.ModelBase, sql.DictBase):
 
     @classmethod
     def from_dict(cls, endpoint_dict):
+        endpoint_dict = endpoint_dict.copy()
         extra = {}
         for k, v in endpoint_dict.copy().iteritems():
             if k not in ['id', 'region', 'service_id', 'extra']:
@@ -78,6 +83,11 @@ class Endpoint(sql.ModelBase, sql.DictBase):
 
 
 class Catalog(sql.Base, catalog.Driver):
+    # the compiled catalog is shared by every instance in the process, so
+    # that changes made through any of them are seen by all
+    _compiled_catalog = None
+    _compiled_at = 0
+
     def db_sync(self):
         migration.db_sync()
 
@@ -102,6 +112,7 @@ class Catalog(sql.Base, catalog.Driver):
         with session.begin():
             session.delete(service_ref)
             session.flush()
+        self._invalidate_catalog()
 
     def create_service(self, service_id, service_ref):
         session = self.get_session()
@@ -109,6 +120,7 @@ class Catalog(sql.Base, catalog.Driver):
             service = Service.from_dict(service_ref)
             session.add(service)
             session.flush()
+        self._invalidate_catalog()
         return service.to_dict()
 
     # Endpoints
@@ -118,6 +130,7 @@ class Catalog(sql.Base, catalog.Driver):
         with session.begin():
             session.add(new_endpoint)
             session.flush()
+        self._invalidate_catalog()
         return new_endpoint.to_dict()
 
     def delete_endpoint(self, endpoint_id):
@@ -129,6 +142,7 @@ class Catalog(sql.Base, catalog.Driver):
         with session.begin():
             session.delete(endpoint_ref)
             session.flush()
+        self._invalidate_catalog()
 
     def get_endpoint(self, endpoint_id):
         session = self.get_session()
@@ -142,30 +156,38 @@ class Catalog(sql.Base, catalog.Driver):
         return [e['id'] for e in list(endpoints)]
 
     def get_catalog(self, user_id, tenant_id, metadata=None):
-        d = dict(CONF.iteritems())
-        d.update({'tenant_id': tenant_id,
-                  'user_id': user_id})
-        catalog = {}
-
-        endpoints = [self.get_endpoint(e)
-                     for e in self.list_endpoints()]
-        for ep in endpoints:
-            service = self.get_service(ep['service_id'])
-            srv_type = service['type']
-            srv_name = service['name']
-            region = ep['region']
-
-            if region not in catalog:
-                catalog[region] = {}
-
-            catalog[region][srv_type] = {}
-
-            internal_url = ep['internalurl'].replace('$(', '%(')
-            public_url = ep['publicurl'].replace('$(', '%(')
-            admin_url = ep['adminurl'].replace('$(', '%(')
-            catalog[region][srv_type]['name'] = srv_name
-            catalog[region][srv_type]['publicURL'] = public_url % d
-            catalog[region][srv_type]['adminURL'] = admin_url % d
-            catalog[region][srv_type]['internalURL'] = internal_url % d
-
-        return catalog
+        compiled_catalog = Catalog._compiled_catalog
+        age = time.time() - Catalog._compiled_at
+        if (compiled_catalog is None
+                or age > CONF.catalog.cache_time
+                or not compiled_catalog.is_current()):
+            compiled_catalog = self._compile_catalog()
+        return compiled_catalog.render(user_id, tenant_id)
+
+    def _compile_catalog(self):
+        """Build the catalog from a single query of endpoints and services."""
+        session = self.get_session()
+        endpoint_refs = session.query(Endpoint, Service)\
+                               .filter(Endpoint.service_id == Service.id)\
+                               .all()
+        catalog_ref = {}
+        for endpoint_ref, service_ref in endpoint_refs:
+            ep = endpoint_ref.to_dict()
+            service = service_ref.to_dict()
+            region_ref = catalog_ref.setdefault(ep['region'], {})
+            region_ref[service['type']] = {
+                'name': service['name'],
+                'publicURL': ep['publicurl'],
+                'adminURL': ep['adminurl'],
+                'internalURL': ep['internalurl'],
+            }
+
+        compiled_catalog = catalog.CompiledCatalog(
+                catalog_ref,
+                template_keys=('publicURL', 'adminURL', 'internalURL'))
+        Catalog._compiled_catalog = compiled_catalog
+        Catalog._compiled_at = time.time()
+        return compiled_catalog
+
+    def _invalidate_catalog(self):
+        Catalog._compiled_catalog = None
@@ -15,9 +15,12 @@
 # under the License.
 
 import os.path
+import time
 
+from keystone import catalog
 from keystone import config
 from keystone.common import logging
+from keystone.common import utils
 from keystone.catalog.backends import kvs
 
 
@@ -27,6 +30,7 @@ CONF = config.CONF
 config.register_str('template_file',
                     default='default_catalog.templates',
                     group='catalog')
+config.register_int('template_check_interval', default=1, group='catalog')
 
 
 def parse_templates(template_lines):
@@ -89,9 +93,17 @@ class TemplatedCatalog(kvs.Catalog):
 
       internalURL - the url of the internal endpoint
 
+    The templates are compiled when loaded so that only tenant_id and user_id
+    are filled in per request, and the template file is re-read whenever its
+    modification time changes, checked at most every
+    ``[catalog] template_check_interval`` seconds.
+
     """
 
     def __init__(self, templates=None):
+        self.template_file = None
+        self._template_cache = {}
+        self._compiled_catalog = None
         if templates:
             self.templates = templates
         else:
@@ -103,23 +115,45 @@ class TemplatedCatalog(kvs.Catalog):
 
     def _load_templates(self, template_file):
         try:
-            self.templates = parse_templates(open(template_file))
-        except IOError:
+            utils.read_cached_file(template_file,
+                                   self._template_cache,
+                                   reload_func=self._parse_templates)
+        except (IOError, OSError):
             LOG.critical('Unable to open template file %s' % template_file)
             raise
+        self.template_file = template_file
+        self._template_cache['checked_at'] = time.time()
+
+    def _parse_templates(self, data):
+        self.templates = parse_templates(data.splitlines())
+        self._compiled_catalog = None
+
+    def _reload_templates(self):
+        """Re-reads the template file if it has changed on disk."""
+        # stat'ing the template file on every request adds up, so only look
+        # for changes every template_check_interval seconds
+        now = time.time()
+        if now < (self._template_cache['checked_at']
+                  + CONF.catalog.template_check_interval):
+            return
+        self._template_cache['checked_at'] = now
+        try:
+            utils.read_cached_file(self.template_file,
+                                   self._template_cache,
+                                   reload_func=self._parse_templates)
+        except (IOError, OSError):
+            # keep serving the last good catalog rather than failing every
+            # request while the file is being replaced
+            LOG.exception('Unable to reload template file %s' %
+                          self.template_file)
 
     def get_catalog(self, user_id, tenant_id, metadata=None):
-        d = dict(CONF.iteritems())
-        d.update({'tenant_id': tenant_id,
-                  'user_id': user_id})
-
-        o = {}
-        for region, region_ref in self.templates.iteritems():
-            o[region] = {}
-            for service, service_ref in region_ref.iteritems():
-                o[region][service] = {}
-                for k, v in service_ref.iteritems():
-                    v = v.replace('$(', '%(')
-                    o[region][service][k] = v % d
-
-        return o
+        if self.template_file is not None:
+            self._reload_templates()
+
+        compiled = self._compiled_catalog
+        if compiled is None or not compiled.is_current():
+            compiled = catalog.CompiledCatalog(self.templates)
+            self._compiled_catalog = compiled
+
+        return compiled.render(user_id, tenant_id)
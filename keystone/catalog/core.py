@@ -17,6 +17,7 @@
 
 """Main entry point into the Catalog service."""
 
+import re
 import uuid
 
 from keystone import config
@@ -30,6 +31,87 @@ from keystone.common import wsgi
 
 CONF = config.CONF
 
+# matches a "$(key)s" style substitution in a catalog template
+_TEMPLATE_RE = re.compile(r'\$\((\w+)\)'
+                          r'([#0 +-]*\d*(?:\.\d+)?[diouxXeEfFgGcrs])')
+
+# values that differ on every request and so can't be filled in ahead of time
+REQUEST_KEYS = ('tenant_id', 'user_id')
+
+
+class CompiledCatalog(object):
+    """A service catalog with its templates parsed ahead of time.
+
+    Catalog values may contain substitutions of the form ``$(key)s``, where
+    key is a config option or one of ``tenant_id`` and ``user_id``. Config
+    options are substituted once, when the catalog is compiled, leaving only
+    the per-request values to fill in by :meth:`render`.
+
+    :param catalog_ref: a nested dict of region -> service -> key -> value
+    :param template_keys: the keys whose values are templates, or None if
+                          every value is a template
+
+    """
+
+    def __init__(self, catalog_ref, template_keys=None):
+        conf_values = dict(CONF.iteritems())
+        self._conf_values = {}
+        self._regions = []
+        for region, region_ref in catalog_ref.iteritems():
+            services = []
+            for service, service_ref in region_ref.iteritems():
+                static = {}
+                dynamic = []
+                for k, v in service_ref.iteritems():
+                    if template_keys is not None and k not in template_keys:
+                        static[k] = v
+                        continue
+                    fmt, request_keys = self._compile(v, conf_values)
+                    if request_keys:
+                        dynamic.append((k, fmt))
+                    else:
+                        static[k] = fmt % {}
+                services.append((service, static, dynamic))
+            self._regions.append((region, services))
+
+    def _compile(self, template, conf_values):
+        """Returns a format string needing only per-request values."""
+        parts = []
+        request_keys = False
+        pos = 0
+        for match in _TEMPLATE_RE.finditer(template):
+            parts.append(template[pos:match.start()].replace('%', '%%'))
+            key, spec = match.groups()
+            if key in REQUEST_KEYS:
+                parts.append('%%(%s)%s' % (key, spec))
+                request_keys = True
+            else:
+                self._conf_values[key] = conf_values[key]
+                value = ('%%(%s)%s' % (key, spec)) % conf_values
+                parts.append(value.replace('%', '%%'))
+            pos = match.end()
+        parts.append(template[pos:].replace('%', '%%'))
+        return ''.join(parts), request_keys
+
+    def is_current(self):
+        """Whether the config values substituted are still current."""
+        for k, v in self._conf_values.iteritems():
+            if CONF[k] != v:
+                return False
+        return True
+
+    def render(self, user_id, tenant_id):
+        """Returns the catalog for the given user and tenant."""
+        values = {'tenant_id': tenant_id, 'user_id': user_id}
+        o = {}
+        for region, services in self._regions:
+            region_ref = o[region] = {}
+            for service, static, dynamic in services:
+                service_ref = region_ref[service] = static.copy()
+                for k, fmt in dynamic:
+                    service_ref[k] = fmt % values
+        return o
+
 
 class Manager(manager.Manager):
     """Default pivot point for the Catalog backend.
@@ -19,8 +19,11 @@ from __future__ import absolute_import
 import json
 import sys
 import textwrap
+import time
 
 from keystone import config
+from keystone import exception
+from keystone.common import kvs
 from keystone.common import utils
 
 
@@ -108,10 +111,35 @@ class ImportNovaAuth(BaseApp):
         nova.import_auth(dump_data)
 
 
+class TokenFlush(BaseApp):
+    """Purge expired tokens from a persistent token backend, such as sql.
+
+    The kvs backend keeps tokens in the memory of each keystone process,
+    out of reach of this command, and purges them itself.
+
+    """
+
+    name = 'token_flush'
+
+    def main(self):
+        driver = utils.import_object(CONF.token.driver)
+        if isinstance(driver, kvs.Base) and driver.db is kvs.INMEMDB:
+            sys.exit('%s keeps tokens in the memory of each keystone process,'
+                     ' which purge them themselves' % CONF.token.driver)
+        start = time.time()
+        try:
+            count = driver.flush_expired_tokens()
+        except exception.NotImplemented:
+            sys.exit('%s does not support flushing tokens' % CONF.token.driver)
+        print 'Removed %d expired tokens in %.2f seconds' % (
+                count, time.time() - start)
+
+
 CMDS = {'db_sync': DbSync,
         'import_legacy': ImportLegacy,
         'export_legacy_catalog': ExportLegacyCatalog,
         'import_nova_auth': ImportNovaAuth,
+        'token_flush': TokenFlush,
         }
 
 
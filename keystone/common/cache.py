@@ -0,0 +1,141 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Small in-process caches."""
+
+import time
+
+
+# indexes into the linked list entries used by LRUCache
+_PREV, _NEXT, _KEY, _VALUE, _EXPIRES = range(5)
+
+
+class LRUCache(object):
+    """A bounded mapping that evicts the least recently used entries.
+
+    Entries may also be given a lifetime in seconds, after which they are
+    treated as missing. A ``max_size`` of 0 disables the cache entirely.
+
+    """
+
+    def __init__(self, max_size=1000, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._map = {}
+        # circular doubly linked list, most recently used at the end
+        self._root = root = [None, None, None, None, None]
+        root[_PREV] = root[_NEXT] = root
+
+    def __len__(self):
+        return len(self._map)
+
+    def __contains__(self, key):
+        link = self._map.get(key)
+        return link is not None and not self._expired(link)
+
+    def get(self, key, default=None):
+        """Return the value for key, or default if missing or expired."""
+        link = self._map.get(key)
+        if link is None:
+            self.misses += 1
+            return default
+        if self._expired(link):
+            self._unlink(link)
+            self.misses += 1
+            return default
+
+        self._move_to_end(link)
+        self.hits += 1
+        return link[_VALUE]
+
+    def peek(self, key, default=None):
+        """Like get, but without counting a hit or miss or reordering."""
+        link = self._map.get(key)
+        if link is None or self._expired(link):
+            return default
+        return link[_VALUE]
+
+    def set(self, key, value, ttl=None):
+        """Store value for key.
+
+        :param ttl: seconds the entry stays valid, capped by the cache's ttl.
+
+        """
+        if not self.max_size:
+            return
+        if self.ttl is not None:
+            ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl is not None and ttl <= 0:
+            self.delete(key)
+            return
+        expires = ttl is not None and time.time() + ttl or None
+
+        link = self._map.get(key)
+        if link is not None:
+            link[_VALUE] = value
+            link[_EXPIRES] = expires
+            self._move_to_end(link)
+            return
+
+        root = self._root
+        last = root[_PREV]
+        link = [last, root, key, value, expires]
+        last[_NEXT] = root[_PREV] = self._map[key] = link
+
+        while len(self._map) > self.max_size:
+            self._unlink(root[_NEXT])
+            self.evictions += 1
+
+    def delete(self, key):
+        """Remove key if present."""
+        link = self._map.get(key)
+        if link is not None:
+            self._unlink(link)
+
+    def clear(self):
+        self._map.clear()
+        root = self._root
+        root[_PREV] = root[_NEXT] = root
+
+    def stats(self):
+        """Return counters describing how effective the cache has been."""
+        return {'size': len(self._map),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions}
+
+    def _expired(self, link):
+        return link[_EXPIRES] is not None and link[_EXPIRES] <= time.time()
+
+    def _unlink(self, link):
+        link_prev, link_next = link[_PREV], link[_NEXT]
+        link_prev[_NEXT] = link_next
+        link_next[_PREV] = link_prev
+        del self._map[link[_KEY]]
+
+    def _move_to_end(self, link):
+        root = self._root
+        link_prev, link_next = link[_PREV], link[_NEXT]
+        link_prev[_NEXT] = link_next
+        link_next[_PREV] = link_prev
+        last = root[_PREV]
+        link[_PREV] = last
+        link[_NEXT] = root
+        last[_NEXT] = root[_PREV] = link
@@ -19,12 +19,31 @@ class DictKvs(dict):
     def set(self, key, value):
         if type(value) is type({}):
             self[key] = value.copy()
-        else:
+        elif type(value) is type([]):
             self[key] = value[:]
+        else:
+            # immutable values, such as frozen token records, can be shared
+            self[key] = value
 
     def delete(self, key):
         del self[key]
 
+    # Sets of keys kept alongside the data, so that listing a subset of the
+    # store doesn't require scanning every key in it
+    def get_set(self, key):
+        """Returns a copy of the set stored at key."""
+        return set(self.get(key, ()))
+
+    def add_to_set(self, key, member):
+        self.setdefault(key, set()).add(member)
+
+    def remove_from_set(self, key, member):
+        members = self.get(key)
+        if members is not None:
+            members.discard(member)
+            if not members:
+                del self[key]
+
 
 INMEMDB = DictKvs()
 
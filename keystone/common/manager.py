@@ -15,8 +15,10 @@
 # under the License.
 
 import functools
+import time
 
 from keystone import config
+from keystone.common import metrics
 from keystone.common import utils
 
 
@@ -42,9 +44,14 @@ class Manager(object):
         #               that for now, in the future we'll probably do some
         #               logging and whatnot in this class
         f = getattr(self.driver, name)
+        metric = 'driver.%s.%s' % (self.driver.__class__.__name__, name)
 
         @functools.wraps(f)
         def _wrapper(context, *args, **kw):
-            return f(*args, **kw)
+            start = time.time()
+            try:
+                return f(*args, **kw)
+            finally:
+                metrics.timing(metric, start)
         setattr(self, name, _wrapper)
         return _wrapper
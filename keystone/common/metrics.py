@@ -0,0 +1,227 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Request, driver and database timings for the process.
+
+Timings and counters are kept in memory, where the admin API reports them,
+and passed on to any emitters, such as statsd. Other parts of keystone add
+sources with register_source() for stats they keep themselves, like caches.
+
+Every process keeps its own metrics, so with several workers use statsd to
+see them all together.
+
+"""
+
+import bisect
+import socket
+import time
+
+from eventlet import corolocal
+
+from keystone import config
+from keystone.common import logging
+from keystone.common import utils
+
+
+CONF = config.CONF
+config.register_bool('enabled', group='metrics', default=True)
+config.register_str('emitters', group='metrics', default='')
+config.register_str('statsd_host', group='metrics', default='localhost')
+config.register_int('statsd_port', group='metrics', default=8125)
+config.register_str('statsd_prefix', group='metrics', default='keystone')
+
+LOG = logging.getLogger(__name__)
+
+# upper bounds of the histogram buckets, in milliseconds for timings
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+
+class Histogram(object):
+    """Counts values into BUCKETS, with their total and maximum."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        self.buckets[bisect.bisect_left(BUCKETS, value)] += 1
+
+    def to_dict(self):
+        buckets = dict((str(bound), count)
+                       for bound, count in zip(BUCKETS, self.buckets))
+        buckets['inf'] = self.buckets[-1]
+        return {'count': self.count,
+                'total': self.total,
+                'mean': self.count and self.total / float(self.count),
+                'max': self.max,
+                'buckets': buckets}
+
+
+class Metrics(object):
+    """Collects histograms and counters and passes them on to emitters."""
+
+    def __init__(self, emitters=None):
+        self.emitters = emitters or []
+        self.histograms = {}
+        self.counters = {}
+
+    def timing(self, name, ms):
+        self._histogram(name).add(ms)
+        for emitter in self.emitters:
+            emitter.timing(name, ms)
+
+    def histogram(self, name, value):
+        self._histogram(name).add(value)
+        for emitter in self.emitters:
+            emitter.histogram(name, value)
+
+    def incr(self, name, count=1):
+        self.counters[name] = self.counters.get(name, 0) + count
+        for emitter in self.emitters:
+            emitter.incr(name, count)
+
+    def report(self):
+        return {'histograms': dict((name, histogram.to_dict())
+                                   for name, histogram
+                                   in self.histograms.iteritems()),
+                'counters': self.counters.copy()}
+
+    def _histogram(self, name):
+        try:
+            return self.histograms[name]
+        except KeyError:
+            histogram = self.histograms[name] = Histogram()
+            return histogram
+
+
+class StatsdEmitter(object):
+    """Sends metrics to statsd over UDP, dropping them if that fails."""
+
+    def __init__(self, host=None, port=None, prefix=None):
+        self.address = (host or CONF.metrics.statsd_host,
+                        port or CONF.metrics.statsd_port)
+        self.prefix = prefix or CONF.metrics.statsd_prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def timing(self, name, ms):
+        self._send(name, '%d|ms' % ms)
+
+    def histogram(self, name, value):
+        self._send(name, '%d|h' % value)
+
+    def incr(self, name, count):
+        self._send(name, '%d|c' % count)
+
+    def _send(self, name, value):
+        try:
+            self.socket.sendto('%s.%s:%s' % (self.prefix, name, value),
+                               self.address)
+        except socket.error, e:
+            LOG.debug('Could not send metrics to statsd: %s', e)
+
+
+# short names for the emitters option
+EMITTERS = {'statsd': 'keystone.common.metrics.StatsdEmitter'}
+
+_metrics = None
+_sources = {}
+# per request counts, such as database queries, in the current greenthread
+_request = corolocal.local()
+
+
+def get_metrics():
+    """Return the process' Metrics, or None if metrics are disabled."""
+    global _metrics
+    if _metrics is None and CONF.metrics.enabled:
+        emitters = [utils.import_object(EMITTERS.get(name, name))
+                    for name in CONF.metrics.emitters.split(',')
+                    if name.strip()]
+        _metrics = Metrics(emitters)
+    return _metrics
+
+
+def reset():
+    """Discard the metrics collected, to start again with the current
+    configuration."""
+    global _metrics
+    _metrics = None
+
+
+def timing(name, start):
+    """Record the milliseconds that have passed since start."""
+    metrics = get_metrics()
+    if metrics is not None:
+        metrics.timing(name, (time.time() - start) * 1000)
+
+
+def histogram(name, value):
+    metrics = get_metrics()
+    if metrics is not None:
+        metrics.histogram(name, value)
+
+
+def incr(name, count=1):
+    metrics = get_metrics()
+    if metrics is not None:
+        metrics.incr(name, count)
+
+
+def register_source(name, func):
+    """Report the dict of stats returned by func along with the metrics.
+
+    Stats with hits and misses also get their hit_rate reported.
+
+    """
+    _sources[name] = func
+
+
+def report():
+    """Return the metrics collected and the stats of every source."""
+    metrics = get_metrics()
+    report_ref = metrics and metrics.report() or {}
+    sources = report_ref['sources'] = {}
+    for name, func in _sources.iteritems():
+        try:
+            stats = func()
+        except Exception:
+            LOG.exception('Could not get %s stats', name)
+            continue
+        if 'hits' in stats and 'misses' in stats:
+            lookups = stats['hits'] + stats['misses']
+            stats['hit_rate'] = lookups and stats['hits'] / float(lookups)
+        sources[name] = stats
+    return report_ref
+
+
+def start_request():
+    _request.db_queries = 0
+
+
+def finish_request():
+    """Return the number of database queries made since start_request."""
+    db_queries = getattr(_request, 'db_queries', 0)
+    _request.db_queries = 0
+    return db_queries
+
+
+def count_db_query():
+    _request.db_queries = getattr(_request, 'db_queries', 0) + 1
@@ -187,7 +187,224 @@ class Brain(object):
         return False
 
 
-class HttpBrain(Brain):
+class _TrueCheck(object):
+    def __call__(self, target_dict, cred_dict):
+        return True
+
+
+class _FalseCheck(object):
+    def __call__(self, target_dict, cred_dict):
+        return False
+
+
+_TRUE = _TrueCheck()
+_FALSE = _FalseCheck()
+
+
+class _OrCheck(object):
+    def __init__(self, checks):
+        self.checks = checks
+
+    def __call__(self, target_dict, cred_dict):
+        for check in self.checks:
+            if check(target_dict, cred_dict):
+                return True
+        return False
+
+
+class _AndCheck(object):
+    def __init__(self, checks):
+        self.checks = checks
+
+    def __call__(self, target_dict, cred_dict):
+        for check in self.checks:
+            if not check(target_dict, cred_dict):
+                return False
+        return True
+
+
+class _RuleCheck(object):
+    """A reference to a named rule, linked once all rules are compiled."""
+    def __init__(self, name):
+        self.name = name
+        self.rule = _FALSE
+
+    def __call__(self, target_dict, cred_dict):
+        return self.rule(target_dict, cred_dict)
+
+
+class _RoleCheck(object):
+    """Matches if the credentials hold any of a set of roles."""
+    def __init__(self, roles):
+        self.roles = frozenset(role.lower() for role in roles)
+
+    def __call__(self, target_dict, cred_dict):
+        roles = self.roles
+        for role in cred_dict['roles']:
+            if role.lower() in roles:
+                return True
+        return False
+
+
+class _GenericCheck(object):
+    """Matches a credential against a value built from the target."""
+    def __init__(self, key, value):
+        self.key = key
+        self.value = value
+        self.is_template = '%' in value
+
+    def __call__(self, target_dict, cred_dict):
+        value = self.value
+        if self.is_template:
+            value = value % target_dict
+        key = self.key
+        if key in cred_dict:
+            return value == cred_dict[key]
+        return False
+
+
+class _TemplatedGenericCheck(object):
+    """A generic check whose key is itself built from the target."""
+    def __init__(self, match):
+        self.match = match
+
+    def __call__(self, target_dict, cred_dict):
+        key, value = (self.match % target_dict).split(':', 1)
+        if key in cred_dict:
+            return value == cred_dict[key]
+        return False
+
+
+class _MethodCheck(object):
+    """A check handled by a brain's ``_check_<kind>`` method."""
+    def __init__(self, method, match):
+        self.method = method
+        self.match = match
+
+    def __call__(self, target_dict, cred_dict):
+        return self.method(self.match, target_dict, cred_dict)
+
+
+class CompiledBrain(Brain):
+    """A Brain that compiles its rules into a tree of check objects.
+
+    Rule strings are parsed once rather than on every check: role names are
+    lowered and merged into sets, rule references are linked to the rules
+    they name and generic checks are split ahead of time. The result of
+    checking is the same as for :class:`Brain`, except that a match without
+    a ``kind:`` prefix always fails instead of raising ValueError.
+
+    Rules must be changed through :meth:`add_rule` for the change to be
+    picked up.
+
+    """
+
+    def __init__(self, rules=None, default_rule=None):
+        super(CompiledBrain, self).__init__(rules, default_rule)
+        self._compiled_rules = None
+        self._compiled_matches = {}
+
+    def add_rule(self, key, match):
+        super(CompiledBrain, self).add_rule(key, match)
+        self._compiled_rules = None
+        self._compiled_matches = {}
+
+    def check(self, match_list, target_dict, cred_dict):
+        """Checks authorization of some rules against credentials.
+
+        See :meth:`Brain.check`.
+
+        """
+        try:
+            check = self._compiled_matches.get(match_list)
+        except TypeError:
+            # unhashable, e.g. a list, so it can't be remembered
+            return self.compile(match_list)(target_dict, cred_dict)
+
+        if check is None:
+            check = self.compile(match_list)
+            self._compiled_matches[match_list] = check
+        return check(target_dict, cred_dict)
+
+    def compile(self, match_list):
+        """Returns a callable taking (target_dict, cred_dict) for match_list.
+        """
+        if self._compiled_rules is None:
+            self._compile_rules()
+        rule_checks = []
+        check = self._compile_match_list(match_list, rule_checks)
+        self._link(rule_checks)
+        return check
+
+    def _compile_rules(self):
+        rule_checks = []
+        self._compiled_rules = {}
+        for key, match_list in self.rules.iteritems():
+            self._compiled_rules[key] = self._compile_match_list(match_list,
+                                                                 rule_checks)
+        self._link(rule_checks)
+
+    def _link(self, rule_checks):
+        compiled_rules = self._compiled_rules
+        for rule_check in rule_checks:
+            name = rule_check.name
+            if name in compiled_rules:
+                rule_check.rule = compiled_rules[name]
+            elif self.default_rule and name != self.default_rule:
+                rule_check.rule = compiled_rules.get(self.default_rule,
+                                                     _FALSE)
+            else:
+                rule_check.rule = _FALSE
+
+    def _compile_match_list(self, match_list, rule_checks):
+        if not match_list:
+            return _TRUE
+
+        or_checks = []
+        roles = []
+        for and_list in match_list:
+            if isinstance(and_list, basestring):
+                and_list = (and_list,)
+            and_checks = [self._compile_match(match, rule_checks)
+                          for match in and_list]
+            if not and_checks:
+                return _TRUE
+            if len(and_checks) > 1:
+                or_checks.append(_AndCheck(and_checks))
+            elif isinstance(and_checks[0], _RoleCheck):
+                # alternative roles are checked in a single pass
+                if not roles:
+                    or_checks.append(None)
+                roles.extend(and_checks[0].roles)
+            else:
+                or_checks.append(and_checks[0])
+
+        if roles:
+            or_checks[or_checks.index(None)] = _RoleCheck(roles)
+        if len(or_checks) == 1:
+            return or_checks[0]
+        return _OrCheck(or_checks)
+
+    def _compile_match(self, match, rule_checks):
+        if ':' not in match:
+            return _FALSE
+        kind, value = match.split(':', 1)
+        if kind == 'rule':
+            rule_check = _RuleCheck(value)
+            rule_checks.append(rule_check)
+            return rule_check
+        if kind == 'role':
+            return _RoleCheck([value])
+
+        method = getattr(self, '_check_%s' % kind, None)
+        if method is not None:
+            return _MethodCheck(method, value)
+        if '%' in kind:
+            return _TemplatedGenericCheck(match)
+        return _GenericCheck(kind, value)
+
+
+class HttpBrain(CompiledBrain):
     """A brain that can check external urls for policy.
 
     Posts json blobs for target and credentials.
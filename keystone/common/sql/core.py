@@ -27,9 +27,11 @@ from sqlalchemy.ext import declarative
 import sqlalchemy.orm
 import sqlalchemy.pool
 import sqlalchemy.engine.url
+import sqlalchemy.event
 
 from keystone import config
 from keystone.common import logging
+from keystone.common import metrics
 
 
 CONF = config.CONF
@@ -41,6 +43,7 @@ ModelBase = declarative.declarative_base()
 # For exporting to other modules
 Column = sql.Column
 String = sql.String
+Integer = sql.Integer
 ForeignKey = sql.ForeignKey
 DateTime = sql.DateTime
 IntegrityError = sql.exc.IntegrityError
@@ -129,39 +132,151 @@ class MySQLPingListener(object):
                 raise
 
 
+class PoolStatsListener(object):
+    """Counts connection pool activity for a single engine."""
+
+    def __init__(self):
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+
+    def connect(self, dbapi_con, con_record):
+        self.connects += 1
+
+    def checkout(self, dbapi_con, con_record, con_proxy):
+        self.checkouts += 1
+
+    def checkin(self, dbapi_con, con_record):
+        self.checkins += 1
+
+
+# Engines are shared by every driver in the process, keyed by connection URL
+_ENGINES = {}
+_POOL_STATS = {}
+
+
+def get_engine(connection=None):
+    """Return the process-wide SQLAlchemy engine for a connection URL.
+
+    Every sql backend in the process shares a single engine (and therefore a
+    single connection pool) per URL, rather than one per driver instance.
+
+    """
+    connection = connection or CONF.sql.connection
+    engine = _ENGINES.get(connection)
+    if engine is None:
+        engine = _create_engine(connection)
+        stats = PoolStatsListener()
+        for name in ('connect', 'checkout', 'checkin'):
+            sqlalchemy.event.listen(engine, name, getattr(stats, name))
+        sqlalchemy.event.listen(engine, 'after_cursor_execute',
+                                _count_query)
+        _ENGINES[connection] = engine
+        _POOL_STATS[connection] = stats
+    return engine
+
+
+def _count_query(conn, cursor, statement, parameters, context,
+                 executemany):
+    metrics.count_db_query()
+
+
+def _create_engine(connection):
+    connection_dict = sql.engine.url.make_url(connection)
+
+    engine_args = {'pool_recycle': CONF.sql.idle_timeout,
+                   'echo': False,
+                   'convert_unicode': True,
+                   }
+
+    if 'sqlite' in connection_dict.drivername:
+        # the sqlite file may be replaced underneath us (as the tests do),
+        # so don't hold on to connections
+        engine_args['poolclass'] = sqlalchemy.pool.NullPool
+    else:
+        engine_args['pool_size'] = CONF.sql.pool_size
+        engine_args['max_overflow'] = CONF.sql.max_overflow
+        engine_args['pool_timeout'] = CONF.sql.pool_timeout
+
+    engine = sql.create_engine(connection, **engine_args)
+    if 'mysql' in connection_dict.drivername:
+        sqlalchemy.event.listen(engine, 'checkout',
+                                MySQLPingListener().checkout)
+    return engine
+
+
+def _describe_url(url):
+    """Returns a connection URL as a string without its password."""
+    o = '%s://' % url.drivername
+    if url.username is not None:
+        o += '%s@' % url.username
+    if url.host is not None:
+        o += url.host
+        if url.port is not None:
+            o += ':%s' % url.port
+    if url.database is not None:
+        o += '/%s' % url.database
+    return o
+
+
+def get_pool_stats():
+    """Return connection pool statistics for every engine in the process.
+
+    Returns a dict keyed by connection URL, without any password.
+
+    """
+    o = {}
+    for connection, engine in _ENGINES.iteritems():
+        stats = _POOL_STATS[connection]
+        pool = engine.pool
+        pool_ref = {'class': pool.__class__.__name__,
+                    'connects': stats.connects,
+                    'checkouts': stats.checkouts,
+                    'checkins': stats.checkins,
+                    }
+        if isinstance(pool, sqlalchemy.pool.QueuePool):
+            pool_ref['size'] = pool.size()
+            pool_ref['checked_in'] = pool.checkedin()
+            pool_ref['checked_out'] = pool.checkedout()
+            pool_ref['overflow'] = pool.overflow()
+        o[_describe_url(engine.url)] = pool_ref
+    return o
+
+
+metrics.register_source('sql_pools', get_pool_stats)
+
+
+def cleanup():
+    """Dispose of every shared engine, closing their pooled connections."""
+    for engine in _ENGINES.itervalues():
+        engine.dispose()
+    _ENGINES.clear()
+    _POOL_STATS.clear()
+
+
 # Backends
 class Base(object):
 
     _MAKER = None
-    _ENGINE = None
+    _MAKER_ENGINE = None
 
     def get_session(self, autocommit=True, expire_on_commit=False):
         """Return a SQLAlchemy session."""
-        if self._MAKER is None or self._ENGINE is None:
-            self._ENGINE = self.get_engine()
-            self._MAKER = self.get_maker(self._ENGINE,
+        # looked up every time, so that sessions use the shared engine that
+        # replaced any disposed of by cleanup()
+        engine = self.get_engine()
+        if self._MAKER is None or self._MAKER_ENGINE is not engine:
+            self._MAKER = self.get_maker(engine,
                                          autocommit,
                                          expire_on_commit)
+            self._MAKER_ENGINE = engine
 
         session = self._MAKER()
         return session
 
     def get_engine(self):
-        """Return a SQLAlchemy engine."""
-        connection_dict = sql.engine.url.make_url(CONF.sql.connection)
-
-        engine_args = {'pool_recycle': CONF.sql.idle_timeout,
-                       'echo': False,
-                       'convert_unicode': True
-                       }
-
-        if 'sqlite' in connection_dict.drivername:
-            engine_args['poolclass'] = sqlalchemy.pool.NullPool
-
-        if 'mysql' in connection_dict.drivername:
-            engine_args['listeners'] = [MySQLPingListener()]
-
-        return sql.create_engine(CONF.sql.connection, **engine_args)
+        """Return the shared SQLAlchemy engine."""
+        return get_engine()
 
     def get_maker(self, engine, autocommit=True, expire_on_commit=False):
         """Return a SQLAlchemy sessionmaker using the given engine."""
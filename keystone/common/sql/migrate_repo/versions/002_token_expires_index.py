@@ -0,0 +1,45 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from sqlalchemy import *
+from sqlalchemy.engine import reflection
+from migrate import *
+
+
+INDEX_NAME = 'ix_token_expires'
+
+
+def _index_exists(migrate_engine):
+    inspector = reflection.Inspector.from_engine(migrate_engine)
+    return INDEX_NAME in [x['name'] for x in inspector.get_indexes('token')]
+
+
+def upgrade(migrate_engine):
+    # 001 creates tables from the current models, so databases created after
+    # the index was added to the model will already have it
+    if _index_exists(migrate_engine):
+        return
+    meta = MetaData(bind=migrate_engine)
+    token = Table('token', meta, autoload=True)
+    Index(INDEX_NAME, token.c.expires).create(migrate_engine)
+
+
+def downgrade(migrate_engine):
+    if not _index_exists(migrate_engine):
+        return
+    meta = MetaData(bind=migrate_engine)
+    token = Table('token', meta, autoload=True)
+    Index(INDEX_NAME, token.c.expires).drop(migrate_engine)
@@ -0,0 +1,99 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import datetime
+import json
+
+from sqlalchemy import *
+from sqlalchemy.engine import reflection
+from migrate import *
+
+
+COLUMNS = ('user_id', 'tenant_id')
+# number of tokens backfilled per transaction
+BATCH_SIZE = 1000
+
+
+def _column_exists(migrate_engine, name):
+    inspector = reflection.Inspector.from_engine(migrate_engine)
+    return name in [x['name'] for x in inspector.get_columns('token')]
+
+
+def _backfill(migrate_engine, token):
+    """Copy the user and tenant ids of existing tokens out of extra.
+
+    Expired tokens are deleted rather than copied, and the rest are updated
+    BATCH_SIZE at a time, paging by id, so the table is never read into
+    memory at once and each batch is committed as it goes.
+
+    """
+    migrate_engine.execute(token.delete()
+                                .where(token.c.expires
+                                       < datetime.datetime.utcnow()))
+
+    update = (token.update()
+                   .where(token.c.id == bindparam('token_id'))
+                   .values(user_id=bindparam('user_id'),
+                           tenant_id=bindparam('tenant_id')))
+    last_id = None
+    while True:
+        query = select([token.c.id, token.c.extra])
+        if last_id is not None:
+            query = query.where(token.c.id > last_id)
+        rows = migrate_engine.execute(query.order_by(token.c.id)
+                                           .limit(BATCH_SIZE)).fetchall()
+        if not rows:
+            break
+        values = []
+        for token_id, extra in rows:
+            extra = json.loads(extra) if extra else {}
+            values.append({
+                    'token_id': token_id,
+                    'user_id': (extra.get('user') or {}).get('id'),
+                    'tenant_id': (extra.get('tenant') or {}).get('id')})
+        connection = migrate_engine.connect()
+        try:
+            with connection.begin():
+                connection.execute(update, values)
+        finally:
+            connection.close()
+        if len(rows) < BATCH_SIZE:
+            break
+        last_id = rows[-1][0]
+
+
+def upgrade(migrate_engine):
+    # 001 creates tables from the current models, so databases created after
+    # the columns were added to the model will already have them
+    meta = MetaData(bind=migrate_engine)
+    token = Table('token', meta, autoload=True)
+    for name in COLUMNS:
+        if _column_exists(migrate_engine, name):
+            continue
+        column = Column(name, String(64))
+        column.create(token)
+        Index('ix_token_%s' % name, column).create(migrate_engine)
+    _backfill(migrate_engine, token)
+
+
+def downgrade(migrate_engine):
+    meta = MetaData(bind=migrate_engine)
+    token = Table('token', meta, autoload=True)
+    for name in COLUMNS:
+        if not _column_exists(migrate_engine, name):
+            continue
+        Index('ix_token_%s' % name, token.c[name]).drop(migrate_engine)
+        token.c[name].drop()
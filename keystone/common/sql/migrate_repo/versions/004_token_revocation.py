@@ -0,0 +1,36 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from sqlalchemy import *
+from migrate import *
+
+
+def upgrade(migrate_engine):
+    meta = MetaData(bind=migrate_engine)
+    # 001 creates tables from the current models, so databases created after
+    # the table was added to the model will already have it
+    token_revocation = Table(
+            'token_revocation', meta,
+            Column('id', Integer, primary_key=True),
+            Column('token_id', String(64), nullable=False),
+            Column('revoked', DateTime(), nullable=False, index=True))
+    token_revocation.create(checkfirst=True)
+
+
+def downgrade(migrate_engine):
+    meta = MetaData(bind=migrate_engine)
+    token_revocation = Table('token_revocation', meta, autoload=True)
+    token_revocation.drop()
@@ -22,20 +22,26 @@ import base64
 import hashlib
 import hmac
 import json
+import multiprocessing
 import os
 import subprocess
 import sys
 import time
 import urllib
 
+from eventlet import tpool
 import passlib.hash
 
 from keystone import config
+from keystone.common import cache
 from keystone.common import logging
 
 
 CONF = config.CONF
 config.register_int('crypt_strength', default=40000)
+config.register_int('password_cache_size', default=0)
+config.register_int('password_cache_time', default=60)
+config.register_int('password_hash_workers', default=0)
 
 LOG = logging.getLogger(__name__)
 
@@ -177,13 +183,56 @@ def trunc_password(password):
         return password
 
 
+# worker processes that hash passwords, see _run_password_hash
+_password_hash_pool = None
+_password_hash_pool_size = 0
+
+
+def _get_password_hash_pool():
+    global _password_hash_pool, _password_hash_pool_size
+    workers = CONF.password_hash_workers
+    if workers != _password_hash_pool_size:
+        if _password_hash_pool is not None:
+            _password_hash_pool.terminate()
+            _password_hash_pool = None
+        if workers > 0:
+            # started on first use, so each forked server gets its own
+            _password_hash_pool = multiprocessing.Pool(workers)
+        _password_hash_pool_size = workers
+    return _password_hash_pool
+
+
+def _run_password_hash(func, *args):
+    """Run a password hashing function, in a worker process if configured.
+
+    Hashing is pure CPU for tens of milliseconds and the crypt module holds
+    the GIL while it runs, so doing it in this process stalls every other
+    greenthread. With password_hash_workers set it runs in a pool of that
+    many processes instead, and the wait for the result happens in a native
+    thread so that the hub keeps serving other requests meanwhile.
+
+    """
+    pool = _get_password_hash_pool()
+    if pool is None:
+        return func(*args)
+    return tpool.execute(pool.apply, func, args)
+
+
+def _sha512_crypt_encrypt(password_utf8, rounds):
+    return passlib.hash.sha512_crypt.encrypt(password_utf8, rounds=rounds)
+
+
+def _sha512_crypt_verify(password_utf8, hashed):
+    return passlib.hash.sha512_crypt.verify(password_utf8, hashed)
+
+
 def hash_password(password):
     """Hash a password. Hard."""
     password_utf8 = trunc_password(password).encode('utf-8')
     if passlib.hash.sha512_crypt.identify(password_utf8):
         return password_utf8
-    h = passlib.hash.sha512_crypt.encrypt(password_utf8,
-                                          rounds=CONF.crypt_strength)
+    h = _run_password_hash(_sha512_crypt_encrypt, password_utf8,
+                           CONF.crypt_strength)
     return h
 
 
@@ -202,17 +251,67 @@ def ldap_check_password(password, hashed):
     return passlib.hash.ldap_salted_sha1.verify(password_utf8, hashed)
 
 
-def check_password(password, hashed):
+# successful password checks, keyed by an HMAC of what was checked
+_password_cache = None
+# never leaves the process, so cache keys can't be used to guess passwords
+_password_cache_key = os.urandom(32)
+
+
+def _get_password_cache():
+    global _password_cache
+    if (_password_cache is None
+        or _password_cache.max_size != CONF.password_cache_size
+        or _password_cache.ttl != CONF.password_cache_time):
+        _password_cache = cache.LRUCache(max_size=CONF.password_cache_size,
+                                         ttl=CONF.password_cache_time)
+    return _password_cache
+
+
+def _password_cache_entry(user_id, password_utf8, hashed):
+    parts = []
+    for part in (user_id or '', hashed):
+        if isinstance(part, unicode):
+            part = part.encode('utf-8')
+        parts.append(part)
+    parts.append(password_utf8)
+    return hmac.new(_password_cache_key, '\0'.join(parts),
+                    hashlib.sha256).digest()
+
+
+def password_cache_stats():
+    """Return counters for the cache of successful password checks."""
+    stats = _get_password_cache().stats()
+    stats['hashes_avoided'] = stats['hits']
+    return stats
+
+
+def check_password(password, hashed, user_id=None):
     """Check that a plaintext password matches hashed.
 
     hashpw returns the salt value concatenated with the actual hash value.
     It extracts the actual salt if this value is then passed as the salt.
 
+    If password_cache_size is set, successful checks are remembered for
+    password_cache_time seconds so they don't have to be hashed again.
+    Entries are keyed by the user, password and hash, so changing the
+    password makes any cached check for the old one unreachable.
+
     """
     if password is None:
         return False
     password_utf8 = trunc_password(password).encode('utf-8')
-    return passlib.hash.sha512_crypt.verify(password_utf8, hashed)
+
+    password_cache = _get_password_cache()
+    if not password_cache.max_size or not hashed:
+        return _run_password_hash(_sha512_crypt_verify, password_utf8, hashed)
+
+    entry = _password_cache_entry(user_id, password_utf8, hashed)
+    if password_cache.get(entry):
+        return True
+    if not _run_password_hash(_sha512_crypt_verify, password_utf8, hashed):
+        return False
+    password_cache.set(entry, True)
+    return True
 
 
 # From python 2.7
@@ -20,25 +20,39 @@
 
 """Utility methods for working with WSGI servers."""
 
+import errno
 import json
+import os
+import signal
 import sys
+import time
 
 import eventlet
+import eventlet.hubs
 import eventlet.wsgi
 eventlet.patcher.monkey_patch(all=False, socket=True, time=True)
+import greenlet
 import routes
 import routes.middleware
 import webob
 import webob.dec
 import webob.exc
 
+from keystone import config
 from keystone import exception
 from keystone.common import logging
+from keystone.common import metrics
 from keystone.common import utils
 
 
+CONF = config.CONF
+config.register_int('graceful_shutdown_timeout', default=60)
+
 LOG = logging.getLogger(__name__)
 
+# blocks the whole process, unlike the monkey patched time.sleep
+_original_sleep = eventlet.patcher.original('time').sleep
+
 
 class WritableLogger(object):
     """A thin wrapper that responds to `write` and logs."""
@@ -51,16 +65,53 @@ class WritableLogger(object):
         self.logger.log(self.level, msg)
 
 
+class HttpProtocol(eventlet.wsgi.HttpProtocol):
+    """Marks connections as busy while they are handling a request.
+
+    When eventlet.wsgi.server is stopped it closes idle connections and lets
+    busy ones finish their request first, but this version of eventlet never
+    marks a connection as busy, so every request in progress is cut off.
+
+    """
+
+    def handle_one_response(self):
+        self.conn_state[2] = eventlet.wsgi.STATE_REQUEST
+        try:
+            return eventlet.wsgi.HttpProtocol.handle_one_response(self)
+        finally:
+            if self.conn_state[2] == eventlet.wsgi.STATE_REQUEST:
+                self.conn_state[2] = eventlet.wsgi.STATE_IDLE
+
+
 class Server(object):
-    """Server class to manage multiple WSGI sockets and applications."""
+    """Server class to manage multiple WSGI sockets and applications.
 
-    def __init__(self, application, host=None, port=None, threads=1000):
+    Instead of an application, an ``app_factory`` may be given that builds
+    it on start. That way, when servers are run in forked worker processes,
+    each worker loads the application itself after the fork, and reload()
+    can build it again.
+
+    """
+
+    def __init__(self, application=None, host=None, port=None, threads=1000,
+                 app_factory=None):
         self.application = application
+        self.app_factory = app_factory
         self.host = host or '0.0.0.0'
         self.port = port or 0
+        self.threads = threads
         self.pool = eventlet.GreenPool(threads)
+        self.socket = None
         self.socket_info = {}
         self.greenthread = None
+        self._abort_timer = None
+
+    def listen(self, backlog=128):
+        """Open the listening socket, unless it is already open."""
+        if self.socket is None:
+            self.socket = eventlet.listen((self.host, self.port),
+                                          backlog=backlog)
+        return self.socket
 
     def start(self, key=None, backlog=128):
         """Run a WSGI server with the given application."""
@@ -68,29 +119,280 @@ class Server(object):
                       {'arg0': sys.argv[0],
                        'host': self.host,
                        'port': self.port})
-        socket = eventlet.listen((self.host, self.port), backlog=backlog)
-        self.greenthread = self.pool.spawn(self._run, self.application, socket)
+        socket = self.listen(backlog)
+        if self.application is None:
+            self.application = self.app_factory()
+        # not spawned in self.pool, which it waits on when stopped
+        self.greenthread = eventlet.spawn(self._run, self._call_application,
+                                          socket)
         if key:
             self.socket_info[key] = socket.getsockname()
 
+    def reload(self):
+        """Build the application again with app_factory.
+
+        New requests are handled by the new application, while requests in
+        progress finish on the old one.
+
+        """
+        self.application = self.app_factory()
+
+    def stop(self, timeout=None):
+        """Stop accepting connections and let in-flight requests finish.
+
+        Requests still running after timeout seconds are aborted. Use wait()
+        to wait for them to finish.
+
+        """
+        if self.greenthread:
+            self.greenthread.kill()
+        if timeout is not None:
+            self._abort_timer = eventlet.spawn_after(timeout,
+                                                     self._abort_requests)
+
     def kill(self):
+        """Stop the server, aborting any in-flight requests."""
+        self._abort_requests()
         if self.greenthread:
             self.greenthread.kill()
 
     def wait(self):
         """Wait until all servers have completed running."""
         try:
+            if self.greenthread:
+                self.greenthread.wait()
             self.pool.waitall()
+        except greenlet.GreenletExit:
+            pass
         except KeyboardInterrupt:
             pass
+        if self._abort_timer:
+            self._abort_timer.cancel()
+            self._abort_timer = None
+
+    def _abort_requests(self):
+        requests = list(self.pool.coroutines_running)
+        if requests:
+            LOG.warning('Aborting %d requests on %s:%s',
+                        len(requests), self.host, self.port)
+        for request in requests:
+            request.kill()
+
+    def _call_application(self, environ, start_response):
+        # looked up per request, so that reload() takes effect
+        return self.application(environ, start_response)
 
     def _run(self, application, socket):
         """Start a WSGI server in a new green thread."""
         log = logging.getLogger('eventlet.wsgi.server')
         eventlet.wsgi.server(socket, application, custom_pool=self.pool,
+                             protocol=HttpProtocol,
                              log=WritableLogger(log))
 
 
+def run_servers(servers, reload_config=None,
+                stop_signals=(signal.SIGTERM, signal.SIGINT)):
+    """Run servers until one of stop_signals is received.
+
+    The servers then stop accepting connections and this returns once their
+    in-flight requests have finished, or graceful_shutdown_timeout seconds
+    have passed.
+
+    If reload_config is given, SIGHUP calls it and then rebuilds the servers'
+    applications, so that configuration changes are picked up without
+    dropping any requests.
+
+    """
+    stopping = []
+    reloading = []
+    for signum in stop_signals:
+        signal.signal(signum, lambda signum, frame: stopping.append(signum))
+    if reload_config is not None:
+        signal.signal(signal.SIGHUP,
+                      lambda signum, frame: reloading.append(signum))
+
+    for server in servers:
+        server.start()
+    # signal handlers can't safely switch greenthreads, so poll the flags
+    while not stopping:
+        eventlet.sleep(0.5)
+        if reloading:
+            del reloading[:]
+            LOG.info('Reloading configuration')
+            try:
+                reload_config()
+                for server in servers:
+                    server.reload()
+            except (Exception, SystemExit):
+                LOG.exception('Failed to reload, carrying on as before')
+
+    for server in servers:
+        server.stop(CONF.graceful_shutdown_timeout)
+    for server in servers:
+        server.wait()
+
+
+class WorkerSupervisor(object):
+    """Run servers in forked worker processes and keep them running.
+
+    The listening sockets are opened before forking, so every worker
+    accepts connections on the same sockets. Workers that die are replaced.
+
+    On SIGTERM or SIGINT the workers are told to stop and the supervisor
+    exits once they have finished their in-flight requests. On SIGHUP
+    reload_config is called, if given, and the workers are replaced: new
+    ones are started while the old ones finish their in-flight requests and
+    exit.
+
+    """
+
+    # workers exiting sooner than this after starting are assumed to be
+    # failing to start, and are respawned no more often than this
+    restart_delay = 1.0
+    # how often workers check that the supervisor is still running
+    supervisor_check_interval = 1.0
+    # how often the supervisor checks for signals and exited workers
+    child_check_interval = 0.1
+
+    def __init__(self, servers, workers, reload_config=None):
+        self.servers = servers
+        self.workers = workers
+        self.reload_config = reload_config
+        self.children = {}
+        self.retiring = set()
+        self._stopping = False
+        self._restarting = False
+        self._pid = None
+
+    def run(self):
+        """Run the workers until signalled to stop."""
+        for server in self.servers:
+            server.listen()
+
+        self._pid = os.getpid()
+
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        signal.signal(signal.SIGHUP, self._handle_restart)
+
+        while not self._stopping:
+            if self._restarting:
+                self._restarting = False
+                self._restart()
+            while len(self.children) < self.workers:
+                self._start_worker()
+            self._wait_for_child()
+
+        LOG.info('Stopping %d workers', len(self.children))
+        self._retire(self.children.keys())
+        while self.retiring:
+            self._wait_for_child()
+
+    def _handle_stop(self, signum, frame):
+        if os.getpid() != self._pid:
+            # a worker forked moments ago, still with the supervisor's
+            # handlers; it hasn't accepted any connections yet
+            os._exit(0)
+        self._stopping = True
+
+    def _handle_restart(self, signum, frame):
+        if os.getpid() != self._pid:
+            return
+        self._restarting = True
+
+    def _restart(self):
+        if self.reload_config is not None:
+            LOG.info('Reloading configuration')
+            try:
+                self.reload_config()
+            except (Exception, SystemExit):
+                LOG.exception('Failed to reload, keeping the current workers')
+                return
+        LOG.info('Restarting %d workers', len(self.children))
+        self._retire(self.children.keys())
+
+    def _retire(self, pids):
+        for pid in pids:
+            del self.children[pid]
+            self.retiring.add(pid)
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError, e:
+                if e.errno != errno.ESRCH:
+                    raise
+
+    def _wait_for_child(self):
+        """Reaps a worker that has exited, or waits a moment for one.
+
+        Blocking in os.wait() instead would miss a signal arriving just
+        before it, leaving the supervisor waiting on workers that only
+        exit once they are told to.
+
+        """
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except OSError, e:
+            # interrupted by a signal, or there are no children left
+            if e.errno not in (errno.EINTR, errno.ECHILD):
+                raise
+            if e.errno == errno.ECHILD:
+                self.retiring.clear()
+            return
+
+        if not pid:
+            _original_sleep(self.child_check_interval)
+            return
+        if pid in self.retiring:
+            self.retiring.discard(pid)
+            return
+        started = self.children.pop(pid, None)
+        if started is None:
+            return
+        LOG.error('Worker %d exited with status %d', pid, status)
+        if time.time() - started < self.restart_delay:
+            _original_sleep(self.restart_delay)
+
+    def _start_worker(self):
+        supervisor_pid = os.getpid()
+        pid = os.fork()
+        if pid:
+            LOG.debug('Started worker %d', pid)
+            self.children[pid] = time.time()
+            return
+
+        # drop the supervisor's handlers; SIGTERM stops the worker outright
+        # until run_servers installs its own handler, and the supervisor
+        # decides what happens on the others
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        status = 0
+        try:
+            self._run_worker(supervisor_pid)
+        except BaseException:
+            LOG.exception('Worker %d failed', os.getpid())
+            status = 1
+        os._exit(status)
+
+    def _run_worker(self, supervisor_pid):
+        # the hub was created in the supervisor and must not be shared
+        eventlet.hubs.use_hub()
+        eventlet.spawn(self._watch_supervisor, supervisor_pid)
+        run_servers(self.servers, stop_signals=(signal.SIGTERM,))
+
+    def _watch_supervisor(self, supervisor_pid):
+        """Stop the worker once its supervisor has gone away.
+
+        Otherwise a worker orphaned by the supervisor being killed would
+        carry on accepting connections, running the old code, forever.
+
+        """
+        while os.getppid() == supervisor_pid:
+            eventlet.sleep(self.supervisor_check_interval)
+        LOG.warning('Supervisor %d has gone away, stopping', supervisor_pid)
+        os.kill(os.getpid(), signal.SIGTERM)
+
+
 class Request(webob.Request):
     pass
 
@@ -180,6 +482,9 @@ class Application(BaseApplication):
         # NOTE(vish): make sure we have no unicode keys for py2.6.
         params = self._normalize_dict(params)
 
+        route = 'route.%s.%s' % (self.__class__.__name__, action)
+        start = time.time()
+        metrics.start_request()
         try:
             result = method(context, **params)
         except exception.Error as e:
@@ -188,6 +493,10 @@ class Application(BaseApplication):
         except Exception as e:
             logging.exception(e)
             return render_exception(exception.UnexpectedError(exception=e))
+        finally:
+            metrics.timing(route, start)
+            metrics.histogram('%s.db_queries' % route,
+                              metrics.finish_request())
 
         if result is None:
             return render_response(status=(204, 'No Content'))
@@ -228,9 +537,9 @@ class Application(BaseApplication):
                 logging.debug('Invalid tenant')
                 raise exception.Unauthorized()
 
-            # NOTE(vish): this is pretty inefficient
-            creds['roles'] = [self.identity_api.get_role(context, role)['name']
-                              for role in creds.get('roles', [])]
+            creds['roles'] = [role_ref['name'] for role_ref in
+                              self.identity_api.get_roles(
+                                      context, creds.get('roles', []))]
             # Accept either is_admin or the admin role
             self.policy_api.enforce(context, creds, 'admin_required', {})
 
@@ -293,11 +602,19 @@ class Middleware(Application):
 
     @webob.dec.wsgify(RequestClass=Request)
     def __call__(self, request):
+        # time spent in this middleware, not in the application it wraps
+        metric = 'middleware.%s' % self.__class__.__name__
+        start = time.time()
         response = self.process_request(request)
         if response:
+            metrics.timing(metric, start)
             return response
+        elapsed = time.time() - start
         response = request.get_response(self.application)
-        return self.process_response(request, response)
+        start = time.time()
+        response = self.process_response(request, response)
+        metrics.timing(metric, start - elapsed)
+        return response
 
 
 class Debug(Middleware):
@@ -32,6 +32,25 @@ class ConfigMixin(object):
         kw.setdefault('args', [])
         return super(ConfigMixin, self).__call__(*args, **kw)
 
+    def reload(self, config_files=None, *args, **kw):
+        """Parses the configuration again, like calling the object.
+
+        Calling the object drops the current values before parsing, so if
+        the files can't be parsed the current values are put back, leaving
+        the object as it was, before the error is raised.
+
+        """
+        config_file_opt = self._opts['config_file']['opt']
+        saved = (config_file_opt.default,
+                 self._args, self._cli_values, self._cparser)
+        try:
+            return self(config_files, *args, **kw)
+        except BaseException:
+            self.reset()
+            (config_file_opt.default,
+             self._args, self._cli_values, self._cparser) = saved
+            raise
+
     def set_usage(self, usage):
         self.usage = usage
         self._oparser.usage = usage
@@ -128,6 +147,12 @@ def register_cli_int(*args, **kw):
     return conf.register_cli_opt(cfg.IntOpt(*args, **kw), group=group)
 
 
+def register_float(*args, **kw):
+    conf = kw.pop('conf', CONF)
+    group = _ensure_group(kw, conf)
+    return conf.register_opt(cfg.FloatOpt(*args, **kw), group=group)
+
+
 def _ensure_group(kw, conf):
     group = kw.pop('group', None)
     if group:
@@ -143,11 +168,15 @@ register_str('bind_host', default='0.0.0.0')
 register_str('compute_port', default=8774)
 register_str('admin_port', default=35357)
 register_str('public_port', default=5000)
+register_int('workers', default=0)
 
 
 # sql options
 register_str('connection', group='sql', default='sqlite:///keystone.db')
 register_int('idle_timeout', group='sql', default=200)
+register_int('pool_size', group='sql', default=5)
+register_int('max_overflow', group='sql', default=10)
+register_int('pool_timeout', group='sql', default=30)
 
 
 register_str('driver', group='catalog',
@@ -176,12 +176,9 @@ class Ec2Controller(wsgi.Application):
                                         tenant=tenant_ref,
                                         metadata=metadata_ref))
 
-        # TODO(termie): optimize this call at some point and put it into the
-        #               the return for metadata
         # fill out the roles in the metadata
-        roles_ref = []
-        for role_id in metadata_ref.get('roles', []):
-            roles_ref.append(self.identity_api.get_role(context, role_id))
+        roles_ref = self.identity_api.get_roles(
+                context, metadata_ref.get('roles', []))
 
         # TODO(termie): make this a util function or something
         # TODO(termie): i don't think the ec2 middleware currently expects a
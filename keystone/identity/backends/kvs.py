@@ -48,7 +48,8 @@ class Identity(kvs.Base, identity.Driver):
         tenant_ref = None
         metadata_ref = None
         if (not user_ref
-            or not utils.check_password(password, user_ref.get('password'))):
+            or not utils.check_password(password, user_ref.get('password'),
+                                         user_id)):
             raise AssertionError('Invalid user / password')
 
         tenants = self.get_tenants_for_user(user_id)
@@ -67,17 +68,16 @@ class Identity(kvs.Base, identity.Driver):
         return tenant_ref
 
     def get_tenants(self):
-        tenant_keys = filter(lambda x: x.startswith("tenant-"), self.db.keys())
-        return [self.db.get(key) for key in tenant_keys]
+        tenant_ids = self.db.get_set('tenant_set')
+        return [self.db.get('tenant-%s' % x) for x in tenant_ids]
 
     def get_tenant_by_name(self, tenant_name):
         tenant_ref = self.db.get('tenant_name-%s' % tenant_name)
         return tenant_ref
 
     def get_tenant_users(self, tenant_id):
-        user_keys = filter(lambda x: x.startswith("user-"), self.db.keys())
-        user_refs = [self.db.get(key) for key in user_keys]
-        return filter(lambda x: tenant_id in x['tenants'], user_refs)
+        user_ids = self.db.get_set('tenant_users-%s' % tenant_id)
+        return [self.db.get('user-%s' % x) for x in user_ids]
 
     def _get_user(self, user_id):
         user_ref = self.db.get('user-%s' % user_id)
@@ -99,6 +99,10 @@ class Identity(kvs.Base, identity.Driver):
     def get_role(self, role_id):
         return self.db.get('role-%s' % role_id)
 
+    def get_roles(self, role_ids):
+        role_refs = [self.db.get('role-%s' % x) for x in role_ids]
+        return [x for x in role_refs if x]
+
     def list_users(self):
         user_ids = self.db.get('user_list', [])
         return [self.get_user(x) for x in user_ids]
@@ -166,6 +170,7 @@ class Identity(kvs.Base, identity.Driver):
         user_list = set(self.db.get('user_list', []))
         user_list.add(user_id)
         self.db.set('user_list', list(user_list))
+        self._index_user_tenants(user_id, [], user.get('tenants', []))
         return user
 
     def update_user(self, user_id, user):
@@ -183,6 +188,9 @@ class Identity(kvs.Base, identity.Driver):
         self.db.delete('user_name-%s' % old_user['name'])
         self.db.set('user-%s' % user_id, new_user)
         self.db.set('user_name-%s' % new_user['name'], new_user)
+        self._index_user_tenants(user_id,
+                                 old_user.get('tenants', []),
+                                 new_user.get('tenants', []))
         return new_user
 
     def delete_user(self, user_id):
@@ -192,8 +200,18 @@ class Identity(kvs.Base, identity.Driver):
         user_list = set(self.db.get('user_list', []))
         user_list.remove(user_id)
         self.db.set('user_list', list(user_list))
+        self._index_user_tenants(user_id, old_user.get('tenants', []), [])
         return None
 
+    def _index_user_tenants(self, user_id, old_tenants, new_tenants):
+        """Keeps the tenant_users-$tenant_id sets in line with a user."""
+        old_tenants = set(old_tenants)
+        new_tenants = set(new_tenants)
+        for tenant_id in old_tenants - new_tenants:
+            self.db.remove_from_set('tenant_users-%s' % tenant_id, user_id)
+        for tenant_id in new_tenants - old_tenants:
+            self.db.add_to_set('tenant_users-%s' % tenant_id, user_id)
+
     def create_tenant(self, tenant_id, tenant):
         if self.get_tenant(tenant_id):
             msg = 'Duplicate ID, %s.' % tenant_id
@@ -203,6 +221,7 @@ class Identity(kvs.Base, identity.Driver):
             raise exception.Conflict(type='tenant', details=msg)
         self.db.set('tenant-%s' % tenant_id, tenant)
         self.db.set('tenant_name-%s' % tenant['name'], tenant)
+        self.db.add_to_set('tenant_set', tenant_id)
         return tenant
 
     def update_tenant(self, tenant_id, tenant):
@@ -225,6 +244,7 @@ class Identity(kvs.Base, identity.Driver):
         old_tenant = self.db.get('tenant-%s' % tenant_id)
         self.db.delete('tenant_name-%s' % old_tenant['name'])
         self.db.delete('tenant-%s' % tenant_id)
+        self.db.remove_from_set('tenant_set', tenant_id)
         return None
 
     def create_metadata(self, user_id, tenant_id, metadata):
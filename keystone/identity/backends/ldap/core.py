@@ -137,6 +137,14 @@ class Identity(identity.Driver):
     def get_role(self, role_id):
         return self.role.get(role_id)
 
+    def get_roles(self, role_ids):
+        # role ids live in the DN rather than an attribute we can filter on,
+        # so fetch the roles subtree in a single search instead
+        if not role_ids:
+            return []
+        roles_by_id = dict((x['id'], x) for x in self.role.get_all())
+        return [roles_by_id[x] for x in role_ids if x in roles_by_id]
+
     # These should probably be part of the high-level API
     def add_user_to_tenant(self, tenant_id, user_id):
         return self.tenant.add_user(tenant_id, user_id)
@@ -361,7 +369,7 @@ class UserApi(common_ldap.BaseLdap, ApiShimMixin):
 
     def check_password(self, user_id, password):
         user = self.get(user_id)
-        return utils.check_password(password, user.password)
+        return utils.check_password(password, user.password, user_id)
 
 
 # TODO(termie): turn this into a data object and move logic to driver
@@ -144,7 +144,8 @@ class Identity(sql.Base, identity.Driver):
         """
         user_ref = self._get_user(user_id)
         if (not user_ref
-            or not utils.check_password(password, user_ref.get('password'))):
+            or not utils.check_password(password, user_ref.get('password'),
+                                         user_id)):
             raise AssertionError('Invalid user / password')
 
         tenants = self.get_tenants_for_user(user_id)
@@ -158,6 +159,68 @@ class Identity(sql.Base, identity.Driver):
             metadata_ref = {}
         return (_filter_user(user_ref), tenant_ref, metadata_ref)
 
+    def authenticate_by_name(self, user_name=None, user_id=None,
+                             tenant_name=None, tenant_id=None,
+                             password=None):
+        """Authenticate with one query for the user, tenant and metadata.
+
+        Roles are then fetched with a second query, unless the user has
+        none on the tenant.
+
+        """
+        session = self.get_session()
+        row = None
+        if user_name:
+            row = self._authenticate_query(session, User.name == user_name,
+                                           tenant_name, tenant_id).first()
+        if row is None and user_id:
+            row = self._authenticate_query(session, User.id == user_id,
+                                           tenant_name, tenant_id).first()
+        if row is None:
+            raise AssertionError('Invalid user / password')
+
+        user_ref, tenant_ref, member_tenant_id, metadata = row
+        if tenant_name and tenant_ref is None:
+            # there is no tenant by that name, so fall back to tenant_id
+            row = self._authenticate_query(session, User.id == user_ref.id,
+                                           None, tenant_id).first()
+            user_ref, tenant_ref, member_tenant_id, metadata = row
+
+        user_ref = user_ref.to_dict()
+        if not utils.check_password(password, user_ref.get('password'),
+                                    user_ref['id']):
+            raise AssertionError('Invalid user / password')
+        if tenant_id or tenant_ref is not None:
+            if member_tenant_id is None:
+                raise AssertionError('Invalid tenant')
+
+        if tenant_ref is None:
+            return (_filter_user(user_ref), None, {}, [])
+        metadata_ref = getattr(metadata, 'data', None) or {}
+        roles_ref = self.get_roles(metadata_ref.get('roles', []))
+        return (_filter_user(user_ref), tenant_ref.to_dict(), metadata_ref,
+                roles_ref)
+
+    def _authenticate_query(self, session, user_filter, tenant_name,
+                            tenant_id):
+        """Selects a user along with the tenant, their membership of it
+        and their metadata on it, which are None if not found."""
+        if tenant_name:
+            tenant_filter = Tenant.name == tenant_name
+        else:
+            tenant_filter = Tenant.id == tenant_id
+        membership_filter = ((UserTenantMembership.user_id == User.id)
+                             & (UserTenantMembership.tenant_id == Tenant.id))
+        metadata_filter = ((Metadata.user_id == User.id)
+                           & (Metadata.tenant_id == Tenant.id))
+        return session.query(User, Tenant,
+                             UserTenantMembership.tenant_id,
+                             Metadata)\
+                      .outerjoin((Tenant, tenant_filter))\
+                      .outerjoin((UserTenantMembership, membership_filter))\
+                      .outerjoin((Metadata, metadata_filter))\
+                      .filter(user_filter)
+
     def get_tenant(self, tenant_id):
         session = self.get_session()
         tenant_ref = session.query(Tenant).filter_by(id=tenant_id).first()
@@ -212,6 +275,14 @@ class Identity(sql.Base, identity.Driver):
         session = self.get_session()
         return session.query(Role).filter_by(id=role_id).first()
 
+    def get_roles(self, role_ids):
+        if not role_ids:
+            return []
+        session = self.get_session()
+        role_refs = session.query(Role).filter(Role.id.in_(role_ids)).all()
+        roles_by_id = dict((x.id, x) for x in role_refs)
+        return [roles_by_id[x] for x in role_ids if x in roles_by_id]
+
     def list_users(self):
         session = self.get_session()
         user_refs = session.query(User)
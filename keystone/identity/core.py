@@ -25,10 +25,13 @@ from keystone import exception
 from keystone import policy
 from keystone import token
 from keystone.common import manager
+from keystone.common import metrics
+from keystone.common import utils
 from keystone.common import wsgi
 
 
 CONF = config.CONF
+metrics.register_source('password_cache', utils.password_cache_stats)
 
 
 class Manager(manager.Manager):
@@ -54,6 +57,33 @@ class Driver(object):
         """
         raise exception.NotImplemented()
 
+    def authenticate_by_name(self, user_name=None, user_id=None,
+                             tenant_name=None, tenant_id=None,
+                             password=None):
+        """Authenticate a user and tenant given by name or id.
+
+        Names take precedence over ids, which are used if there is no user
+        or tenant with the name given. Backends should override this to
+        look up the user, tenant, metadata and roles in fewer queries than
+        the separate calls the default makes.
+
+        Returns: (user, tenant, metadata, roles).
+
+        """
+        if user_name:
+            user_ref = self.get_user_by_name(user_name)
+            if user_ref:
+                user_id = user_ref['id']
+        if tenant_name:
+            tenant_ref = self.get_tenant_by_name(tenant_name)
+            if tenant_ref:
+                tenant_id = tenant_ref['id']
+
+        user_ref, tenant_ref, metadata_ref = self.authenticate(
+                user_id=user_id, tenant_id=tenant_id, password=password)
+        roles_ref = self.get_roles(metadata_ref.get('roles', []))
+        return user_ref, tenant_ref, metadata_ref, roles_ref
+
     def get_tenant(self, tenant_id):
         """Get a tenant by id.
 
@@ -94,6 +124,19 @@ class Driver(object):
         """
         raise exception.NotImplemented()
 
+    def get_roles(self, role_ids):
+        """Get several roles by id at once.
+
+        Backends should override this to fetch the roles in a single
+        query; the default falls back to calling get_role for each id.
+
+        Returns: a list of role_refs, in the order requested, omitting any
+                 that do not exist.
+
+        """
+        role_refs = [self.get_role(role_id) for role_id in role_ids]
+        return [role_ref for role_ref in role_refs if role_ref]
+
     def list_users(self):
         """List all users in the system.
 
@@ -309,6 +352,8 @@ class TenantController(wsgi.Application):
 
         tenant_ref = self.identity_api.update_tenant(
                 context, tenant_id, tenant)
+        if not tenant_ref.get('enabled', True):
+            self.token_api.delete_tokens(context, tenant_id=tenant_id)
         return {'tenant': tenant_ref}
 
     def delete_tenant(self, context, tenant_id, **kw):
@@ -317,6 +362,7 @@ class TenantController(wsgi.Application):
             raise exception.TenantNotFound(tenant_id=tenant_id)
 
         self.identity_api.delete_tenant(context, tenant_id)
+        self.token_api.delete_tokens(context, tenant_id=tenant_id)
 
     def get_tenant_users(self, context, tenant_id, **kw):
         self.assert_admin(context)
@@ -405,6 +451,8 @@ class UserController(wsgi.Application):
             raise exception.UserNotFound(user_id=user_id)
 
         user_ref = self.identity_api.update_user(context, user_id, user)
+        if not user_ref.get('enabled', True):
+            self.token_api.delete_tokens(context, user_id=user_id)
         return {'user': user_ref}
 
     def delete_user(self, context, user_id):
@@ -413,6 +461,7 @@ class UserController(wsgi.Application):
             raise exception.UserNotFound(user_id=user_id)
 
         self.identity_api.delete_user(context, user_id)
+        self.token_api.delete_tokens(context, user_id=user_id)
 
     def set_user_enabled(self, context, user_id, user):
         return self.update_user(context, user_id, user)
@@ -456,8 +505,7 @@ class RoleController(wsgi.Application):
 
         roles = self.identity_api.get_roles_for_user_and_tenant(
                 context, user_id, tenant_id)
-        return {'roles': [self.identity_api.get_role(context, x)
-                          for x in roles]}
+        return {'roles': self.identity_api.get_roles(context, roles)}
 
     # CRUD extension
     def get_role(self, context, role_id):
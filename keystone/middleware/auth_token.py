@@ -90,9 +90,13 @@ HTTP_X_ROLE
 
 """
 
+import collections
 import httplib
 import json
 import logging
+import socket
+import sys
+import threading
 import time
 
 import webob
@@ -110,6 +114,293 @@ class ServiceError(Exception):
     pass
 
 
+class _BatchNotSupported(Exception):
+    pass
+
+
+# indexes into the linked list entries used by _LRUCache
+_PREV, _NEXT, _KEY, _VALUE, _EXPIRES = range(5)
+
+
+class _LRUCache(object):
+    """A bounded mapping that evicts the least recently used entries.
+
+    Entries expire after at most ``ttl`` seconds. This middleware is run by
+    other services, so it keeps its own cache rather than needing keystone
+    itself installed.
+
+    """
+
+    def __init__(self, max_size, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._map = {}
+        # circular doubly linked list, most recently used at the end
+        self._root = root = [None, None, None, None, None]
+        root[_PREV] = root[_NEXT] = root
+
+    def __len__(self):
+        return len(self._map)
+
+    def __contains__(self, key):
+        link = self._map.get(key)
+        return link is not None and (link[_EXPIRES] is None or
+                                     link[_EXPIRES] > time.time())
+
+    def get(self, key, default=None):
+        """Return the value for key, or default if missing or expired."""
+        link = self._map.get(key)
+        if link is None:
+            return default
+        if link[_EXPIRES] is not None and link[_EXPIRES] <= time.time():
+            self._unlink(link)
+            return default
+        self._unlink(link)
+        self._append(link)
+        return link[_VALUE]
+
+    def set(self, key, value, ttl=None):
+        """Store value for key, for at most ttl seconds."""
+        if self.ttl is not None:
+            ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        self.delete(key)
+        if ttl is not None and ttl <= 0:
+            return
+        expires = ttl is not None and time.time() + ttl or None
+        self._append([None, None, key, value, expires])
+        while len(self._map) > self.max_size:
+            self._unlink(self._root[_NEXT])
+
+    def delete(self, key):
+        """Remove key if present."""
+        link = self._map.get(key)
+        if link is not None:
+            self._unlink(link)
+
+    def _append(self, link):
+        root = self._root
+        last = root[_PREV]
+        link[_PREV] = last
+        link[_NEXT] = root
+        last[_NEXT] = root[_PREV] = self._map[link[_KEY]] = link
+
+    def _unlink(self, link):
+        link_prev, link_next = link[_PREV], link[_NEXT]
+        link_prev[_NEXT] = link_next
+        link_next[_PREV] = link_prev
+        del self._map[link[_KEY]]
+
+
+class HTTPConnectionPool(object):
+    """Keeps idle keep-alive connections to keystone for reuse.
+
+    Connections are handed out to one caller at a time, so the pool is safe
+    to share between greenthreads. At most ``max_size`` idle connections are
+    kept, and connections idle for longer than ``idle_timeout`` seconds are
+    closed rather than reused. A ``max_size`` of 0 disables pooling.
+
+    """
+
+    def __init__(self, factory, max_size=10, idle_timeout=60):
+        self.factory = factory
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.created = 0
+        self.reused = 0
+        self._idle = collections.deque()
+
+    def get(self):
+        """Returns a (connection, reused) tuple."""
+        now = time.time()
+        while self._idle:
+            # most recently used first, it is the least likely to be stale
+            conn, last_used = self._idle.pop()
+            if now - last_used <= self.idle_timeout:
+                self.reused += 1
+                return conn, True
+            conn.close()
+        return self.create(), False
+
+    def create(self):
+        self.created += 1
+        return self.factory()
+
+    def put(self, conn):
+        """Returns a connection whose response has been fully read."""
+        if len(self._idle) < self.max_size:
+            self._idle.append((conn, time.time()))
+        else:
+            conn.close()
+
+    def clear(self):
+        while self._idle:
+            conn, _last_used = self._idle.pop()
+            conn.close()
+
+    def stats(self):
+        return {'created': self.created,
+                'reused': self.reused,
+                'idle': len(self._idle)}
+
+
+class _Flight(object):
+    """A call in progress whose outcome other callers are waiting for."""
+
+    def __init__(self):
+        self._event = self._new_event()
+        self._result = None
+        self._exc_info = None
+
+    @staticmethod
+    def _new_event():
+        # under eventlet without a patched thread module a native
+        # threading.Event would block the whole hub, so wait on a green
+        # event instead
+        eventlet = sys.modules.get('eventlet')
+        if eventlet is not None:
+            import eventlet.event
+            import eventlet.patcher
+            if not eventlet.patcher.is_monkey_patched('thread'):
+                return _GreenEvent(eventlet.event.Event())
+        return threading.Event()
+
+    def set_result(self, result):
+        self._result = result
+        self._event.set()
+
+    def set_exception(self, exc_info):
+        self._exc_info = exc_info
+        self._event.set()
+
+    def wait(self):
+        self._event.wait()
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+
+class _GreenEvent(object):
+    """Gives an eventlet event the set()/wait() interface of threading."""
+
+    def __init__(self, event):
+        self.event = event
+
+    def set(self):
+        self.event.send()
+
+    def wait(self, timeout=None):
+        if timeout is None:
+            self.event.wait()
+            return
+        import eventlet
+        with eventlet.Timeout(timeout, False):
+            self.event.wait()
+
+
+class RequestCoalescer(object):
+    """Shares one in-flight call between concurrent callers.
+
+    While a call for a key is in progress, further calls for the same key
+    wait for it and get its result (or exception) instead of making their
+    own request.
+
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._flights = {}
+
+    def call(self, key, func, *args, **kwargs):
+        flight = _Flight()
+        # setdefault is atomic, so only one caller becomes the leader
+        current = self._flights.setdefault(key, flight)
+        if current is not flight:
+            self.coalesced += 1
+            return current.wait()
+
+        self.calls += 1
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            flight.set_exception(sys.exc_info())
+            raise
+        else:
+            flight.set_result(result)
+            return result
+        finally:
+            del self._flights[key]
+
+    def stats(self):
+        return {'calls': self.calls,
+                'coalesced': self.coalesced,
+                'in_flight': len(self._flights)}
+
+
+class RequestBatcher(object):
+    """Combines concurrent calls for distinct keys into one call.
+
+    The first caller waits up to delay seconds for others to join its
+    batch, then calls func with the list of keys; func returns a dict of
+    results by key. Callers get the result for their key, or None if it is
+    missing, or the exception func raised. A batch is sent as soon as it
+    reaches max_size keys.
+
+    """
+
+    def __init__(self, func, max_size=10, delay=0.01):
+        self.func = func
+        self.max_size = max_size
+        self.delay = delay
+        self.calls = 0
+        self.batched = 0
+        self._lock = threading.Lock()
+        self._pending = None
+
+    def call(self, key):
+        with self._lock:
+            batch = self._pending
+            leader = batch is None
+            if leader:
+                batch = self._pending = _Batch()
+            flight = batch.flights.get(key)
+            if flight is None:
+                flight = batch.flights[key] = _Flight()
+            if len(batch.flights) >= self.max_size:
+                self._pending = None
+                batch.full.set()
+        if not leader:
+            self.batched += 1
+            return flight.wait()
+
+        batch.full.wait(self.delay)
+        with self._lock:
+            if self._pending is batch:
+                self._pending = None
+        self.calls += 1
+        try:
+            results = self.func(batch.flights.keys())
+        except Exception:
+            exc_info = sys.exc_info()
+            for batch_flight in batch.flights.itervalues():
+                batch_flight.set_exception(exc_info)
+        else:
+            for batch_key, batch_flight in batch.flights.iteritems():
+                batch_flight.set_result(results.get(batch_key))
+        return flight.wait()
+
+    def stats(self):
+        return {'calls': self.calls, 'batched': self.batched}
+
+
+class _Batch(object):
+    """Keys waiting to be sent together by a RequestBatcher."""
+
+    def __init__(self):
+        self.flights = {}
+        self.full = _Flight._new_event()
+
+
 class AuthProtocol(object):
     """Auth Middleware that handles authenticating client calls."""
 
@@ -136,6 +427,25 @@ class AuthProtocol(object):
                                            self.auth_port)
         self.auth_uri = conf.get('auth_uri', default_auth_uri)
 
+        # Concurrent identical requests to the auth service share one call
+        self.coalescer = RequestCoalescer()
+
+        # Optionally, concurrent validations of different tokens are sent to
+        # the auth service together
+        self.token_batcher = None
+        validation_batch_size = int(conf.get('validation_batch_size', 0))
+        if validation_batch_size > 1:
+            self.token_batcher = RequestBatcher(
+                    self._validate_token_batch,
+                    max_size=validation_batch_size,
+                    delay=float(conf.get('validation_batch_delay', 0.01)))
+
+        # Keep-alive connections to the auth service, reused across requests
+        self.http_pool = HTTPConnectionPool(
+                self._get_http_connection,
+                max_size=int(conf.get('http_pool_size', 10)),
+                idle_timeout=int(conf.get('http_pool_idle_timeout', 60)))
+
         # Credentials used to verify this component with the Auth service since
         # validating tokens is a privileged call
         self.admin_token = conf.get('admin_token')
@@ -159,6 +469,29 @@ class AuthProtocol(object):
             except NameError as e:
                 LOG.warn('disabled caching due to missing libraries %s', e)
 
+        # Optional in-process tier in front of memcache, so hot tokens can be
+        # validated without any network round trip
+        self._memory_cache = None
+        memory_cache_size = int(conf.get('memory_cache_size', 0))
+        if memory_cache_size:
+            try:
+                import iso8601
+                LOG.info('Using in-process cache for caching token')
+                memory_cache_time = int(conf.get('memory_cache_time',
+                                                 self.token_cache_time))
+                self._memory_cache = _LRUCache(memory_cache_size,
+                                               ttl=memory_cache_time)
+                self._iso8601 = iso8601
+            except ImportError as e:
+                LOG.warn('disabled caching due to missing libraries %s', e)
+
+        # Poll keystone for deleted tokens and evict them from the caches,
+        # so they aren't accepted until their cache entries time out
+        self.revocation_poll_interval = float(
+                conf.get('revocation_poll_interval', 0))
+        self._revocation_cursor = None
+        self._revocations_checked_at = 0
+
     def __call__(self, env, start_response):
         """Handle incoming request.
 
@@ -247,7 +580,8 @@ class AuthProtocol(object):
 
         """
         if not self.admin_token:
-            self.admin_token = self._request_admin_token()
+            self.admin_token = self.coalescer.call('admin_token',
+                                                   self._request_admin_token)
 
         return self.admin_token
 
@@ -266,8 +600,6 @@ class AuthProtocol(object):
         :raise ServerError when unable to communicate with keystone
 
         """
-        conn = self._get_http_connection()
-
         kwargs = {
             'headers': {
                 'Content-type': 'application/json',
@@ -281,15 +613,30 @@ class AuthProtocol(object):
         if body:
             kwargs['body'] = json.dumps(body)
 
+        conn, reused = self.http_pool.get()
         try:
-            conn.request(method, path, **kwargs)
-            response = conn.getresponse()
-            body = response.read()
+            try:
+                response, body = self._http_request(conn, method, path,
+                                                    kwargs)
+            except (httplib.HTTPException, socket.error):
+                if not reused:
+                    raise
+                # keystone may have closed the idle connection, try again
+                # with a fresh one
+                LOG.debug('Pooled connection failed, reconnecting')
+                conn.close()
+                conn = self.http_pool.create()
+                response, body = self._http_request(conn, method, path,
+                                                    kwargs)
         except Exception, e:
+            conn.close()
             LOG.error('HTTP connection exception: %s' % e)
             raise ServiceError('Unable to communicate with keystone')
-        finally:
+
+        if getattr(response, 'will_close', False):
             conn.close()
+        else:
+            self.http_pool.put(conn)
 
         try:
             data = json.loads(body)
@@ -299,6 +646,11 @@ class AuthProtocol(object):
 
         return response, data
 
+    def _http_request(self, conn, method, path, kwargs):
+        conn.request(method, path, **kwargs)
+        response = conn.getresponse()
+        return response, response.read()
+
     def _request_admin_token(self):
         """Retrieve new token as admin user from keystone.
 
@@ -340,10 +692,31 @@ class AuthProtocol(object):
         :raise ServiceError if unable to authenticate token
 
         """
+        self._check_revocations()
         cached = self._cache_get(user_token)
         if cached:
             return cached
 
+        return self.coalescer.call('tokens/%s' % user_token,
+                                   self._fetch_user_token,
+                                   user_token,
+                                   retry)
+
+    def _fetch_user_token(self, user_token, retry=True):
+        """Validate user token with keystone, bypassing the cache."""
+        if self.token_batcher is not None:
+            try:
+                data = self.token_batcher.call(user_token)
+            except _BatchNotSupported:
+                pass
+            else:
+                if data is None:
+                    self._cache_store_invalid(user_token)
+                    LOG.warn("Authorization failed for token %s", user_token)
+                    raise InvalidUserToken('Token authorization failed')
+                self._cache_put(user_token, data)
+                return data
+
         headers = {'X-Auth-Token': self.get_admin_token()}
         response, data = self._json_request('GET',
                                             '/v2.0/tokens/%s' % user_token,
@@ -366,13 +739,83 @@ class AuthProtocol(object):
                          response.status)
         if retry:
             LOG.info('Retrying validation')
-            return self._validate_user_token(user_token, False)
+            return self._fetch_user_token(user_token, False)
         else:
             LOG.warn("Invalid user token: %s. Keystone response: %s.",
                      user_token, data)
 
             raise InvalidUserToken()
 
+    def _validate_token_batch(self, token_ids, retry=True):
+        """Validate several user tokens with one request to keystone.
+
+        :return dict of token data by token id, None for invalid tokens
+        :raise _BatchNotSupported if keystone can't validate tokens in bulk
+
+        """
+        headers = {'X-Auth-Token': self.get_admin_token()}
+        response, data = self._json_request('POST',
+                                            '/v2.0/tokens/validate',
+                                            body={'tokens': token_ids},
+                                            additional_headers=headers)
+
+        if response.status == 200:
+            return data.get('tokens', {})
+        if response.status == 404:
+            LOG.warn('Keystone does not validate tokens in bulk, validating'
+                     ' them one at a time')
+            self.token_batcher = None
+            raise _BatchNotSupported()
+        if response.status == 401:
+            LOG.info('Keystone rejected admin token %s, resetting', headers)
+            self.admin_token = None
+        else:
+            LOG.error('Bad response code while validating tokens: %s' %
+                      response.status)
+        if retry:
+            LOG.info('Retrying validation')
+            return self._validate_token_batch(token_ids, False)
+        raise ServiceError('Unable to validate tokens')
+
+    def _check_revocations(self):
+        """Evict revoked tokens if revocation_poll_interval has passed."""
+        if (self.revocation_poll_interval <= 0
+                or (self._cache is None and self._memory_cache is None)):
+            return
+        now = time.time()
+        if now - self._revocations_checked_at < self.revocation_poll_interval:
+            return
+        self._revocations_checked_at = now
+        try:
+            self.coalescer.call('revocations', self._poll_revocations)
+        except ServiceError, e:
+            # cached tokens are still evicted once token_cache_time passes
+            LOG.warn('Unable to fetch revoked tokens: %s', e)
+
+    def _poll_revocations(self):
+        """Fetch tokens revoked since the last poll and evict them."""
+        path = '/v2.0/tokens/revoked'
+        if self._revocation_cursor is not None:
+            path += '?since=%s' % self._revocation_cursor
+        headers = {'X-Auth-Token': self.get_admin_token()}
+        response, data = self._json_request('GET', path,
+                                            additional_headers=headers)
+
+        if response.status == 200:
+            for revocation in data.get('revoked', []):
+                self._cache_delete(revocation['id'])
+            self._revocation_cursor = data.get('cursor')
+            return
+        if response.status == 404:
+            LOG.warn('Keystone does not list revoked tokens, not polling')
+            self.revocation_poll_interval = 0
+            return
+        if response.status == 401:
+            LOG.info('Keystone rejected admin token %s, resetting', headers)
+            self.admin_token = None
+        raise ServiceError('Bad response code while fetching revoked'
+                           ' tokens: %s' % response.status)
+
     def _build_user_headers(self, token_info):
         """Convert token object into headers.
 
@@ -472,19 +915,30 @@ class AuthProtocol(object):
         If token is invalid raise InvalidUserToken
         return token only if fresh (not expired).
         """
-        if self._cache and token:
-            key = 'tokens/%s' % token
+        if not token:
+            return
+
+        key = 'tokens/%s' % token
+        cached = None
+        if self._memory_cache is not None:
+            cached = self._memory_cache.get(key)
+        if cached is None and self._cache:
             cached = self._cache.get(key)
-            if cached == 'invalid':
-                LOG.debug('Cached Token %s is marked unauthorized', token)
-                raise InvalidUserToken('Token authorization failed')
-            if cached:
-                data, expires = cached
-                if time.time() < float(expires):
-                    LOG.debug('Returning cached token %s', token)
-                    return data
-                else:
-                    LOG.debug('Cached Token %s seems expired', token)
+            if cached and self._memory_cache is not None:
+                self._memory_cache_put(key, cached)
+
+        if cached == 'invalid':
+            LOG.debug('Cached Token %s is marked unauthorized', token)
+            raise InvalidUserToken('Token authorization failed')
+        if cached:
+            data, expires = cached
+            if time.time() < float(expires):
+                LOG.debug('Returning cached token %s', token)
+                return data
+            else:
+                LOG.debug('Cached Token %s seems expired', token)
+                if self._memory_cache is not None:
+                    self._memory_cache.delete(key)
 
     def _cache_put(self, token, data):
         """Put token data into the cache.
@@ -492,7 +946,7 @@ class AuthProtocol(object):
         Stores the parsed expire date in cache allowing
         quick check of token freshness on retrieval.
         """
-        if self._cache and data:
+        if (self._cache or self._memory_cache is not None) and data:
             key = 'tokens/%s' % token
             if 'token' in data.get('access', {}):
                 timestamp = data['access']['token']['expires']
@@ -500,20 +954,44 @@ class AuthProtocol(object):
             else:
                 LOG.error('invalid token format')
                 return
-            LOG.debug('Storing %s token in memcache', token)
-            self._cache.set(key,
-                            (data, expires),
-                            time=self.token_cache_time)
+            if self._memory_cache is not None:
+                self._memory_cache_put(key, (data, expires))
+            if self._cache:
+                LOG.debug('Storing %s token in memcache', token)
+                self._cache.set(key,
+                                (data, expires),
+                                time=self.token_cache_time)
 
     def _cache_store_invalid(self, token):
         """Store invalid token in cache."""
+        key = 'tokens/%s' % token
+        if self._memory_cache is not None:
+            self._memory_cache_put(key, 'invalid')
         if self._cache:
-            key = 'tokens/%s' % token
             LOG.debug('Marking token %s as unauthorized in memcache', token)
             self._cache.set(key,
                             'invalid',
                             time=self.token_cache_time)
 
+    def _cache_delete(self, token):
+        """Remove a token from the caches."""
+        key = 'tokens/%s' % token
+        if self._memory_cache is not None:
+            self._memory_cache.delete(key)
+        if self._cache:
+            LOG.debug('Removing revoked token %s from memcache', token)
+            self._cache.delete(key)
+
+    def _memory_cache_put(self, key, value):
+        """Put a memcache style entry into the in-process cache.
+
+        Entries for valid tokens are kept no longer than the token is valid.
+        """
+        ttl = None
+        if value != 'invalid':
+            ttl = float(value[1]) - time.time()
+        self._memory_cache.set(key, value, ttl=ttl)
+
 
 def filter_factory(global_conf, **local_conf):
     """Returns a WSGI filter app for use with paste.deploy."""
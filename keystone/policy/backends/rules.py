@@ -18,6 +18,7 @@
 """Rules-based Policy Engine."""
 
 import os.path
+import time
 
 from keystone import config
 from keystone import exception
@@ -35,6 +36,10 @@ policy_opts = [
     cfg.StrOpt('policy_default_rule',
                default='default',
                help=_('Rule checked when requested rule is not found')),
+    cfg.IntOpt('policy_check_interval',
+               default=1,
+               help=_('Minimum seconds between checks of the policy file '
+                      'for changes')),
     ]
 
 
@@ -64,9 +69,16 @@ def init():
         _POLICY_PATH = CONF.policy_file
         if not os.path.exists(_POLICY_PATH):
             _POLICY_PATH = CONF.find_file(_POLICY_PATH)
+
+    # stat'ing the policy file on every request adds up, so only look for
+    # changes every policy_check_interval seconds
+    now = time.time()
+    if now < _POLICY_CACHE.get('checked_at', 0) + CONF.policy_check_interval:
+        return
     utils.read_cached_file(_POLICY_PATH,
                            _POLICY_CACHE,
                            reload_func=_set_brain)
+    _POLICY_CACHE['checked_at'] = now
 
 
 def _set_brain(data):
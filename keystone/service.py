@@ -14,20 +14,26 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import datetime
 import uuid
 
 import routes
 
 from keystone import catalog
+from keystone import config
 from keystone import exception
 from keystone import identity
 from keystone import policy
 from keystone import token
 from keystone.common import logging
+from keystone.common import metrics
 from keystone.common import utils
 from keystone.common import wsgi
 
 
+CONF = config.CONF
+
+
 class AdminRouter(wsgi.ComposingRouter):
     def __init__(self):
         mapper = routes.Mapper()
@@ -43,6 +49,16 @@ class AdminRouter(wsgi.ComposingRouter):
                        controller=auth_controller,
                        action='authenticate',
                        conditions=dict(method=['POST']))
+        # must be connected before /tokens/{token_id} so it isn't taken for
+        # a token id
+        mapper.connect('/tokens/revoked',
+                       controller=auth_controller,
+                       action='get_revoked_tokens',
+                       conditions=dict(method=['GET']))
+        mapper.connect('/tokens/validate',
+                       controller=auth_controller,
+                       action='validate_tokens',
+                       conditions=dict(method=['POST']))
         mapper.connect('/tokens/{token_id}',
                        controller=auth_controller,
                        action='validate_token',
@@ -70,6 +86,12 @@ class AdminRouter(wsgi.ComposingRouter):
                        controller=extensions_controller,
                        action='get_extension_info',
                        conditions=dict(method=['GET']))
+        metrics_controller = MetricsController()
+        mapper.connect('/metrics',
+                       controller=metrics_controller,
+                       action='get_metrics',
+                       conditions=dict(method=['GET']))
+
         identity_router = identity.AdminRouter()
         routers = [identity_router]
         super(AdminRouter, self).__init__(mapper, routers)
@@ -215,6 +237,23 @@ class NoopController(wsgi.Application):
         return {}
 
 
+class MetricsController(wsgi.Application):
+    def __init__(self):
+        self.identity_api = identity.Manager()
+        self.token_api = token.Manager()
+        self.policy_api = policy.Manager()
+        super(MetricsController, self).__init__()
+
+    def get_metrics(self, context):
+        """Report request and driver timings and cache stats.
+
+        These are for the process that served the request only.
+
+        """
+        self.assert_admin(context)
+        return {'metrics': metrics.report()}
+
+
 class TokenController(wsgi.Application):
     def __init__(self):
         self.catalog_api = catalog.Manager()
@@ -252,26 +291,19 @@ class TokenController(wsgi.Application):
             tenant_name = auth.get('tenantName', None)
 
             user_id = auth['passwordCredentials'].get('userId', None)
-            if username:
-                user_ref = self.identity_api.get_user_by_name(
-                        context=context, user_name=username)
-                if user_ref:
-                    user_id = user_ref['id']
 
             # more compat
             tenant_id = auth.get('tenantId', None)
-            if tenant_name:
-                tenant_ref = self.identity_api.get_tenant_by_name(
-                        context=context, tenant_name=tenant_name)
-                if tenant_ref:
-                    tenant_id = tenant_ref['id']
 
             try:
-                auth_info = self.identity_api.authenticate(context=context,
-                                                           user_id=user_id,
-                                                           password=password,
-                                                           tenant_id=tenant_id)
-                (user_ref, tenant_ref, metadata_ref) = auth_info
+                auth_info = self.identity_api.authenticate_by_name(
+                        context=context,
+                        user_name=username,
+                        user_id=user_id,
+                        tenant_name=tenant_name,
+                        tenant_id=tenant_id,
+                        password=password)
+                (user_ref, tenant_ref, metadata_ref, roles_ref) = auth_info
 
                 # If the user is disabled don't allow them to authenticate
                 if not user_ref.get('enabled', True):
@@ -341,12 +373,10 @@ class TokenController(wsgi.Application):
                                             tenant=tenant_ref,
                                             metadata=metadata_ref))
 
-        # TODO(termie): optimize this call at some point and put it into the
-        #               the return for metadata
-        # fill out the roles in the metadata
-        roles_ref = []
-        for role_id in metadata_ref.get('roles', []):
-            roles_ref.append(self.identity_api.get_role(context, role_id))
+            # fill out the roles in the metadata
+            roles_ref = self.identity_api.get_roles(
+                    context, metadata_ref.get('roles', []))
+
         logging.debug('TOKEN_REF %s', token_ref)
         return self._format_authenticate(token_ref, roles_ref, catalog_ref)
 
@@ -367,6 +397,23 @@ class TokenController(wsgi.Application):
 
         return token_ref
 
+    def _get_cached_validation(self, token_id, belongs_to):
+        token_data = self.token_api.validation_cache.get(token_id)
+        if token_data is not None:
+            return token_data.get(belongs_to)
+
+    def _set_cached_validation(self, token_ref, belongs_to, token_data):
+        """Cache a formatted validation response until the token expires."""
+        ttl = None
+        if token_ref['expires'] is not None:
+            delta = token_ref['expires'] - datetime.datetime.utcnow()
+            ttl = delta.days * 86400 + delta.seconds
+
+        validation_cache = self.token_api.validation_cache
+        cached_data = validation_cache.peek(token_ref['id']) or {}
+        cached_data[belongs_to] = token_data
+        validation_cache.set(token_ref['id'], cached_data, ttl=ttl)
+
     # admin only
     def validate_token_head(self, context, token_id):
         """Check that a token is valid.
@@ -377,6 +424,9 @@ class TokenController(wsgi.Application):
 
         """
         belongs_to = context['query_string'].get("belongsTo")
+        if self._get_cached_validation(token_id, belongs_to) is not None:
+            self.assert_admin(context)
+            return
         assert self._get_token_ref(context, token_id, belongs_to)
 
     # admin only
@@ -387,17 +437,68 @@ class TokenController(wsgi.Application):
 
         Returns metadata about the token along any associated roles.
 
+        Responses are cached in-process until the token expires (or
+        ``[token] validation_cache_time`` passes) or the token is deleted.
+
         """
         belongs_to = context['query_string'].get("belongsTo")
+        token_data = self._get_cached_validation(token_id, belongs_to)
+        if token_data is not None:
+            self.assert_admin(context)
+            return token_data
+
         token_ref = self._get_token_ref(context, token_id, belongs_to)
+        return self._validate_token_ref(context, token_ref, belongs_to)
+
+    # admin only
+    def validate_tokens(self, context, tokens=None):
+        """Check that several tokens are valid at once.
+
+        Accepts a list of token ids, fetched from the token backend together,
+        and returns a dict of the ``validate_token`` response for each one,
+        or None for tokens that aren't valid (or not owned by ``belongsTo``).
+
+        """
+        self.assert_admin(context)
+        if (not isinstance(tokens, list) or
+                not all(isinstance(t, basestring) for t in tokens)):
+            raise exception.ValidationError(attribute='tokens',
+                                            target='request body')
+        if len(tokens) > CONF.token.max_bulk_validation:
+            msg = 'At most %d tokens can be validated at once' % (
+                    CONF.token.max_bulk_validation)
+            raise exception.ValidationError(message=msg)
 
-        # TODO(termie): optimize this call at some point and put it into the
-        #               the return for metadata
+        belongs_to = context['query_string'].get("belongsTo")
+        results = {}
+        uncached = []
+        for token_id in tokens:
+            token_data = self._get_cached_validation(token_id, belongs_to)
+            if token_data is None:
+                uncached.append(token_id)
+            else:
+                results[token_id] = token_data
+
+        token_refs = self.token_api.get_tokens(context, uncached)
+        for token_id in uncached:
+            token_ref = token_refs.get(token_id)
+            if token_ref is not None and belongs_to:
+                tenant_ref = token_ref.get('tenant') or {}
+                if tenant_ref.get('id') != belongs_to:
+                    token_ref = None
+            if token_ref is None:
+                results[token_id] = None
+            else:
+                results[token_id] = self._validate_token_ref(
+                        context, token_ref, belongs_to)
+        return {'tokens': results}
+
+    def _validate_token_ref(self, context, token_ref, belongs_to):
+        """Formats and caches the validation response for a token."""
         # fill out the roles in the metadata
         metadata_ref = token_ref['metadata']
-        roles_ref = []
-        for role_id in metadata_ref.get('roles', []):
-            roles_ref.append(self.identity_api.get_role(context, role_id))
+        roles_ref = self.identity_api.get_roles(
+                context, metadata_ref.get('roles', []))
 
         # Get a service catalog if belongs_to is not none
         # This is needed for on-behalf-of requests
@@ -408,7 +509,9 @@ class TokenController(wsgi.Application):
                 user_id=token_ref['user']['id'],
                 tenant_id=token_ref['tenant']['id'],
                 metadata=metadata_ref)
-        return self._format_token(token_ref, roles_ref, catalog_ref)
+        token_data = self._format_token(token_ref, roles_ref, catalog_ref)
+        self._set_cached_validation(token_ref, belongs_to, token_data)
+        return token_data
 
     def delete_token(self, context, token_id):
         """Delete a token, effectively invalidating it for authz."""
@@ -417,6 +520,31 @@ class TokenController(wsgi.Application):
 
         self.token_api.delete_token(context=context, token_id=token_id)
 
+    # admin only
+    def get_revoked_tokens(self, context):
+        """List the tokens deleted before they expired.
+
+        Accepts the ``cursor`` returned by an earlier call as ``since``, in
+        which case only tokens revoked after that call are listed, so that
+        services caching validated tokens can poll for ones to evict.
+
+        """
+        self.assert_admin(context)
+        since = context['query_string'].get('since')
+        if since is not None:
+            try:
+                since = int(since)
+            except ValueError:
+                msg = 'Invalid since value'
+                raise exception.ValidationError(message=msg)
+
+        cursor, revocations = self.token_api.list_revocations(
+                context, since=since)
+        return {'revoked': [{'id': x['id'],
+                             'revoked': utils.isotime(x['revoked'])}
+                            for x in revocations],
+                'cursor': cursor}
+
     def endpoints(self, context, token_id):
         """Return a list of endpoints available to the token."""
         raise exception.NotImplemented()
@@ -445,8 +573,9 @@ class TokenController(wsgi.Application):
                         }
              }
         if 'tenant' in token_ref and token_ref['tenant']:
-            token_ref['tenant']['enabled'] = True
-            o['access']['token']['tenant'] = token_ref['tenant']
+            tenant_ref = dict(token_ref['tenant'])
+            tenant_ref['enabled'] = True
+            o['access']['token']['tenant'] = tenant_ref
         if catalog_ref is not None:
             o['access']['serviceCatalog'] = self._format_catalog(catalog_ref)
         return o
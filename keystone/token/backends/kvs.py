@@ -14,15 +14,54 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
-import copy
+import bisect
 import datetime
+import heapq
+import time
+import weakref
 
+import eventlet
+
+from keystone import config
 from keystone.common import kvs
+from keystone.common import logging
 from keystone import exception
 from keystone import token
 
 
+CONF = config.CONF
+config.register_int('kvs_max_tokens', group='token', default=0)
+config.register_float('kvs_reap_interval', group='token', default=60)
+
+LOG = logging.getLogger(__name__)
+
+
+def _reap_periodically(db_ref, interval):
+    """Removes expired tokens every interval seconds while the db exists."""
+    while True:
+        eventlet.sleep(interval)
+        db = db_ref()
+        if db is None:
+            return
+        try:
+            Token(db=db).flush_expired_tokens(batch_delay=0)
+        except Exception:
+            LOG.exception('Unable to remove expired tokens')
+        del db
+
+
 class Token(kvs.Base, token.Driver):
+    """Keeps tokens in the in-memory kvs.
+
+    Tokens are indexed by expiry in a heap kept in the store, so expired
+    tokens can be removed without scanning the store, and by user and
+    tenant, so their tokens can be revoked without one either. Once a token
+    has been created, a greenthread removes expired tokens every
+    kvs_reap_interval seconds, and if kvs_max_tokens is set the tokens
+    closest to expiry are evicted to stay under it.
+
+    """
+
     # Public interface
     def get_token(self, token_id):
         token = self.db.get('token-%s' % token_id)
@@ -32,15 +71,174 @@ class Token(kvs.Base, token.Driver):
         else:
             raise exception.TokenNotFound(token_id=token_id)
 
+    def get_tokens(self, token_ids):
+        now = datetime.datetime.utcnow()
+        token_refs = {}
+        for token_id in token_ids:
+            token = self.db.get('token-%s' % token_id)
+            if token and (token['expires'] is None or token['expires'] > now):
+                token_refs[token_id] = token
+        return token_refs
+
     def create_token(self, token_id, data):
-        data_copy = copy.deepcopy(data)
+        data_copy = dict(data)
         if 'expires' not in data:
             data_copy['expires'] = self._get_default_expire_time()
-        self.db.set('token-%s' % token_id, data_copy)
-        return copy.deepcopy(data_copy)
+        # the frozen record is shared by the store and every reader
+        data_copy = token.freeze(data_copy)
+
+        key = 'token-%s' % token_id
+        stats = self._stats()
+        old_ref = self.db.get(key)
+        if old_ref is None:
+            stats['tokens'] += 1
+        else:
+            self._unindex_token(token_id, old_ref)
+        self.db.set(key, data_copy)
+        self._index_token(token_id, data_copy)
+        if data_copy['expires'] is not None:
+            heapq.heappush(self._expiry_heap(),
+                           (data_copy['expires'], token_id))
+
+        max_tokens = CONF.token.kvs_max_tokens
+        if max_tokens and stats['tokens'] > max_tokens:
+            self._remove_tokens(stats['tokens'] - max_tokens)
+        self._start_reaper()
+        return data_copy
 
     def delete_token(self, token_id):
-        try:
-            return self.db.delete('token-%s' % token_id)
-        except KeyError:
+        key = 'token-%s' % token_id
+        token_ref = self.db.get(key)
+        if token_ref is None:
             raise exception.TokenNotFound(token_id=token_id)
+        self.db.delete(key)
+        self._unindex_token(token_id, token_ref)
+        self._stats()['tokens'] -= 1
+
+    def delete_tokens(self, user_id=None, tenant_id=None):
+        if user_id is None and tenant_id is None:
+            raise ValueError('A user_id or tenant_id is required')
+        token_ids = None
+        if user_id is not None:
+            token_ids = self.db.get_set('user_tokens-%s' % user_id)
+        if tenant_id is not None:
+            tenant_tokens = self.db.get_set('tenant_tokens-%s' % tenant_id)
+            if token_ids is None:
+                token_ids = tenant_tokens
+            else:
+                token_ids &= tenant_tokens
+
+        for token_id in token_ids:
+            self.delete_token(token_id)
+        return list(token_ids)
+
+    def add_revocations(self, token_ids):
+        now = datetime.datetime.utcnow()
+        revocations = self._revocations()
+        for token_id in token_ids:
+            self.db['token_revocation_seq'] = (
+                    self.db.get('token_revocation_seq', 0) + 1)
+            revocations.append((self.db['token_revocation_seq'],
+                                token_id, now))
+
+    def list_revocations(self, since=None):
+        revocations = self._revocations()
+        start = 0
+        if since is not None:
+            # revocations are appended in sequence order
+            start = bisect.bisect_left(revocations, (since + 1,))
+        cursor = self.db.get('token_revocation_seq', 0)
+        return cursor, [{'id': token_id, 'revoked': revoked}
+                        for seq, token_id, revoked in revocations[start:]]
+
+    def flush_expired_tokens(self, batch_size=None, batch_delay=None):
+        batch_size, batch_delay = self._get_flush_options(batch_size,
+                                                          batch_delay)
+        now = datetime.datetime.utcnow()
+        revocations = self._revocations()
+        cutoff = self._get_revocation_cutoff()
+        expired = 0
+        while (expired < len(revocations)
+               and revocations[expired][2] < cutoff):
+            expired += 1
+        del revocations[:expired]
+
+        total = 0
+        while True:
+            removed = self._remove_tokens(batch_size, expired_before=now)
+            total += removed
+            if removed < batch_size:
+                return total
+            if batch_delay:
+                time.sleep(batch_delay)
+            else:
+                eventlet.sleep(0)
+
+    def get_stats(self):
+        """Returns the token count and how many were expired or evicted."""
+        return self._stats().copy()
+
+    # Internal helpers
+    def _expiry_heap(self):
+        return self.db.setdefault('token_expiry_heap', [])
+
+    def _revocations(self):
+        """Returns the (seq, token_id, revoked) revocations, oldest first."""
+        return self.db.setdefault('token_revocations', [])
+
+    def _stats(self):
+        return self.db.setdefault('token_stats',
+                                  {'tokens': 0, 'expired': 0, 'evicted': 0})
+
+    def _index_token(self, token_id, token_ref):
+        user_id, tenant_id = self._get_token_owners(token_ref)
+        if user_id is not None:
+            self.db.add_to_set('user_tokens-%s' % user_id, token_id)
+        if tenant_id is not None:
+            self.db.add_to_set('tenant_tokens-%s' % tenant_id, token_id)
+
+    def _unindex_token(self, token_id, token_ref):
+        user_id, tenant_id = self._get_token_owners(token_ref)
+        if user_id is not None:
+            self.db.remove_from_set('user_tokens-%s' % user_id, token_id)
+        if tenant_id is not None:
+            self.db.remove_from_set('tenant_tokens-%s' % tenant_id, token_id)
+
+    def _remove_tokens(self, limit, expired_before=None):
+        """Removes up to limit tokens in order of expiry.
+
+        :param expired_before: if given, only remove tokens expiring before
+                               this time.
+        :returns: the number of tokens removed
+
+        """
+        heap = self._expiry_heap()
+        stats = self._stats()
+        now = datetime.datetime.utcnow()
+        removed = 0
+        while heap and removed < limit:
+            expires, token_id = heap[0]
+            if expired_before is not None and expires > expired_before:
+                break
+            heapq.heappop(heap)
+            key = 'token-%s' % token_id
+            token_ref = self.db.get(key)
+            # the token may have been deleted, or recreated with a new expiry
+            if token_ref is None or token_ref['expires'] != expires:
+                continue
+            self.db.delete(key)
+            self._unindex_token(token_id, token_ref)
+            stats['tokens'] -= 1
+            if expires <= now:
+                stats['expired'] += 1
+            else:
+                stats['evicted'] += 1
+            removed += 1
+        return removed
+
+    def _start_reaper(self):
+        interval = CONF.token.kvs_reap_interval
+        if interval <= 0 or self.db.get('token_reaper'):
+            return
+        self.db['token_reaper'] = True
+        eventlet.spawn_n(_reap_periodically, weakref.ref(self.db), interval)
@@ -15,23 +15,312 @@
 # under the License.
 
 from __future__ import absolute_import
-import copy
+
+import bisect
+import datetime
+import hashlib
+import json
+import socket
+import struct
+import zlib
 
 import memcache
 
 from keystone import config
 from keystone import exception
 from keystone import token
+from keystone.common import logging
 from keystone.common import utils
 
 
 CONF = config.CONF
 config.register_str('servers', group='memcache', default='localhost:11211')
+config.register_str('token_format', group='memcache', default='pickle')
+config.register_str('hashing', group='memcache', default='modulo')
+config.register_int('replicas', group='memcache', default=1)
+config.register_int('dead_retry', group='memcache', default=30)
+config.register_float('socket_timeout', group='memcache', default=3)
+
+LOG = logging.getLogger(__name__)
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+class PickleFormat(object):
+    """Hands the token to python-memcache, which pickles it.
+
+    This is how tokens were stored before formats were introduced, and the
+    default, since older keystone servers sharing the same memcache can't
+    read any other format.
+
+    """
+
+    def encode(self, data):
+        return data
+
+    def decode(self, value):
+        return value
+
+
+class CompactFormat(object):
+    """A fixed-size header followed by the token as compact json.
+
+    The header holds the format version, flags and the expiry time in
+    microseconds since the epoch; the rest of the token is json, compressed
+    when it is large. Tokens holding values json can't represent are stored
+    with :class:`PickleFormat` instead.
+
+    """
+
+    version = 1
+
+    _header = struct.Struct('!BBq')
+    _NO_EXPIRY = 0x01
+    _COMPRESSED = 0x02
+    _COMPRESS_MIN_SIZE = 2048
+
+    def encode(self, data):
+        body = dict(data)
+        expires = body.pop('expires', None)
+        flags = 0
+        if expires is None:
+            flags |= self._NO_EXPIRY
+            timestamp = 0
+        else:
+            delta = expires - _EPOCH
+            timestamp = ((delta.days * 86400 + delta.seconds) * 1000000
+                         + delta.microseconds)
+
+        try:
+            payload = json.dumps(body, separators=(',', ':'))
+        except TypeError:
+            return PickleFormat().encode(data)
+        if len(payload) >= self._COMPRESS_MIN_SIZE:
+            payload = zlib.compress(payload, 1)
+            flags |= self._COMPRESSED
+        return self._header.pack(self.version, flags, timestamp) + payload
+
+    def decode(self, value):
+        version, flags, timestamp = self._header.unpack_from(value)
+        payload = value[self._header.size:]
+        if flags & self._COMPRESSED:
+            payload = zlib.decompress(payload)
+        data = json.loads(payload)
+        if flags & self._NO_EXPIRY:
+            data['expires'] = None
+        else:
+            data['expires'] = _EPOCH + datetime.timedelta(
+                    microseconds=timestamp)
+        return data
+
+
+FORMATS = {
+    'pickle': PickleFormat,
+    'compact': CompactFormat,
+}
+
+# serialized formats by the version number in their first byte
+_VERSIONS = {
+    CompactFormat.version: CompactFormat(),
+}
+
+
+def decode_token(value):
+    """Returns the token stored as value, in whichever format it is."""
+    if isinstance(value, dict):
+        # unpickled by python-memcache, see PickleFormat
+        return value
+    return _VERSIONS[ord(value[0])].decode(value)
+
+
+class Client(memcache.Client):
+    """python-memcache's client, with a delete that reports missing keys.
+
+    The stock delete succeeds whether or not the key existed, so telling
+    the two apart would take another round trip to get the key first.
+
+    """
+
+    def delete(self, key, time=0):
+        """Deletes a key.
+
+        :returns: True if the key was deleted, False if it didn't exist or
+                  its server couldn't be reached.
+
+        """
+        self.check_key(key)
+        server, key = self._get_server(key)
+        if not server:
+            return False
+        try:
+            server.send_cmd('delete %s' % key)
+            line = server.readline()
+        except socket.error, e:
+            server.mark_dead(e)
+            return False
+        return (line or '').strip() == 'DELETED'
+
+
+def _ketama_points(value):
+    """The four 32 bit points libketama derives from a value's md5."""
+    digest = [ord(x) for x in hashlib.md5(value).digest()]
+    return [(digest[3 + i * 4] << 24 | digest[2 + i * 4] << 16
+             | digest[1 + i * 4] << 8 | digest[i * 4]) for i in range(4)]
+
+
+class RingClient(object):
+    """Spreads keys over memcached servers with ketama consistent hashing.
+
+    Each server owns many points on a ring and a key is stored on the
+    servers owning the first points at or after its hash, so adding or
+    removing a server only moves the keys next to its points. The points
+    are placed the way libketama places them, so other ketama clients
+    agree on where keys live.
+
+    A server that fails is skipped, in favour of the next one on the ring,
+    until dead_retry seconds have passed. With replicas above 1 each key is
+    written to that many servers and read from the first that has it, so
+    tokens survive losing a server.
+
+    Offers the subset of python-memcache's interface the token driver uses.
+
+    """
+
+    # points per server, as in libketama
+    points_per_server = 160
+
+    def __init__(self, servers, replicas=1, dead_retry=30, socket_timeout=3,
+                 client_factory=None):
+        if client_factory is None:
+            client_factory = lambda server: Client(
+                    [server], dead_retry=dead_retry,
+                    socket_timeout=socket_timeout)
+        self.replicas = replicas
+        self.clients = [client_factory(server) for server in servers]
+        self._ring = []
+        for index, server in enumerate(servers):
+            for i in range(self.points_per_server / 4):
+                for point in _ketama_points('%s-%d' % (server, i)):
+                    self._ring.append((point, index))
+        self._ring.sort()
+        self._points = [point for point, index in self._ring]
+
+    def _is_live(self, client):
+        # the host reports it can't connect until its dead_retry has passed
+        return client.servers[0].connect()
+
+    def _get_clients(self, key):
+        """Returns the clients for the live servers that hold key."""
+        clients = []
+        tried = set()
+        start = bisect.bisect_left(self._points, _ketama_points(key)[0])
+        for i in xrange(len(self._ring)):
+            index = self._ring[(start + i) % len(self._ring)][1]
+            if index in tried:
+                continue
+            tried.add(index)
+            client = self.clients[index]
+            if self._is_live(client):
+                clients.append(client)
+                if len(clients) == self.replicas:
+                    break
+            if len(tried) == len(self.clients):
+                break
+        return clients
+
+    def _group_keys(self, keys, replica):
+        """Groups keys by the client holding their given replica."""
+        groups = {}
+        for key in keys:
+            clients = self._get_clients(key)
+            if replica < len(clients):
+                groups.setdefault(clients[replica], []).append(key)
+        return groups
+
+    def get(self, key):
+        for client in self._get_clients(key):
+            value = client.get(key)
+            if value is not None:
+                return value
+
+    def get_multi(self, keys):
+        values = {}
+        missing = list(keys)
+        for replica in range(self.replicas):
+            for client, client_keys in self._group_keys(missing,
+                                                        replica).iteritems():
+                values.update(client.get_multi(client_keys))
+            missing = [key for key in missing if key not in values]
+            if not missing:
+                break
+        return values
+
+    def set(self, key, value, time=0):
+        results = [client.set(key, value, time=time)
+                   for client in self._get_clients(key)]
+        return any(results)
+
+    def set_multi(self, mapping, time=0):
+        stored = set()
+        for replica in range(self.replicas):
+            for client, client_keys in self._group_keys(mapping,
+                                                        replica).iteritems():
+                failed = client.set_multi(
+                        dict((key, mapping[key]) for key in client_keys),
+                        time=time)
+                stored.update(set(client_keys) - set(failed))
+        # like python-memcache, returns the keys that couldn't be stored
+        return list(set(mapping) - stored)
+
+    def delete(self, key, time=0):
+        results = [client.delete(key) for client in self._get_clients(key)]
+        return any(results)
+
+    def delete_multi(self, keys):
+        result = True
+        for replica in range(self.replicas):
+            for client, client_keys in self._group_keys(keys,
+                                                        replica).iteritems():
+                result = client.delete_multi(client_keys) and result
+        return result
+
+    def _first_result(self, method, key, *args, **kwargs):
+        """Applies a method to every replica, returning the first result."""
+        results = [getattr(client, method)(key, *args, **kwargs)
+                   for client in self._get_clients(key)]
+        if results:
+            return results[0]
+
+    def add(self, key, value, time=0):
+        return self._first_result('add', key, value, time=time)
+
+    def append(self, key, value):
+        return self._first_result('append', key, value)
+
+    def touch(self, key, time=0):
+        results = [client.touch(key, time)
+                   for client in self._get_clients(key)]
+        return any(results)
+
+    def incr(self, key, delta=1):
+        # replicas are incremented separately, and may drift apart if one
+        # was unreachable for a while
+        return self._first_result('incr', key, delta)
 
 
 class Token(token.Driver):
+    # how far back list_revocations looks, so that a cursor that is far
+    # behind (or none at all) doesn't fetch every revocation ever recorded
+    revocation_lookback = 1000
+
     def __init__(self, client=None):
         self._memcache_client = client
+        try:
+            self.format = FORMATS[CONF.memcache.token_format]()
+        except KeyError:
+            raise ValueError('Unknown memcache token_format %s, expected one'
+                             ' of: %s' % (CONF.memcache.token_format,
+                                         ', '.join(sorted(FORMATS))))
 
     @property
     def client(self):
@@ -39,34 +328,206 @@ class Token(token.Driver):
 
     def _get_memcache_client(self):
         memcache_servers = CONF.memcache.servers.split(',')
-        self._memcache_client = memcache.Client(memcache_servers, debug=0)
+        if CONF.memcache.hashing == 'ketama':
+            self._memcache_client = RingClient(
+                    memcache_servers,
+                    replicas=CONF.memcache.replicas,
+                    dead_retry=CONF.memcache.dead_retry,
+                    socket_timeout=CONF.memcache.socket_timeout)
+        elif CONF.memcache.hashing == 'modulo':
+            self._memcache_client = Client(
+                    memcache_servers, debug=0,
+                    dead_retry=CONF.memcache.dead_retry,
+                    socket_timeout=CONF.memcache.socket_timeout)
+        else:
+            raise ValueError('Unknown memcache hashing %s, expected ketama'
+                             ' or modulo' % CONF.memcache.hashing)
         return self._memcache_client
 
     def _prefix_token_id(self, token_id):
         return 'token-%s' % token_id.encode('utf-8')
 
+    def _prefix_index(self, prefix, owner_id):
+        return '%s-%s' % (prefix, owner_id.encode('utf-8'))
+
+    def _get_index_time(self, token_refs):
+        """Returns the expiry time for an index of token_refs.
+
+        That is when the last of them, or a token issued now, expires, as a
+        unix timestamp; 0 (never) if any of them never expires.
+
+        """
+        latest = self._get_default_expire_time()
+        for token_ref in token_refs:
+            if token_ref['expires'] is None:
+                return 0
+            latest = max(latest, token_ref['expires'])
+        return int(utils.unixtime(latest))
+
+    def _index_token(self, token_id, token_ref):
+        """Appends the token id to its user's and tenant's token lists.
+
+        The lists are comma separated strings so they can be extended with
+        memcached's append, without reading them back first, and expire
+        along with the tokens in them. Once a list is too big to append to,
+        it is rewritten without the ids of tokens that have expired.
+
+        A token missing from its lists isn't revoked by delete_tokens, so
+        failing to index one is logged.
+
+        """
+        member = ',%s' % token_id.encode('utf-8')
+        index_time = self._get_index_time([token_ref])
+        user_id, tenant_id = self._get_token_owners(token_ref)
+        for prefix, owner_id in (('user_tokens', user_id),
+                                 ('tenant_tokens', tenant_id)):
+            if owner_id is None:
+                continue
+            key = self._prefix_index(prefix, owner_id)
+            if self.client.append(key, member):
+                # append keeps the list's expiry time, so push it back
+                self.client.touch(key, index_time)
+                continue
+            if self.client.add(key, member, time=index_time):
+                continue
+            # another request created the list first, or it is full
+            token_refs = self._read_index(key)
+            token_refs[token_id] = token_ref
+            if not self._rewrite_index(key, token_refs):
+                LOG.error('Unable to add token %s to %s, it will not be'
+                          ' revoked along with the other tokens there',
+                          token_id, key)
+
+    def _read_index(self, key):
+        """Returns the tokens in an index that still exist, by id."""
+        index = self.client.get(key)
+        if not index:
+            return {}
+        token_ids = set(index.decode('utf-8').split(','))
+        token_ids.discard('')
+        return self.get_tokens(token_ids)
+
+    def _rewrite_index(self, key, token_refs):
+        """Replaces an index with the ids of token_refs.
+
+        Ids appended by a concurrent create_token may be lost here, but
+        such a token could just as well have been issued before the index
+        was read.
+
+        :returns: whether the index could be stored.
+
+        """
+        value = ','.join(token_refs).encode('utf-8')
+        return self.client.set(key, value,
+                               time=self._get_index_time(token_refs.values()))
+
     def get_token(self, token_id):
         ptk = self._prefix_token_id(token_id)
-        token = self.client.get(ptk)
-        if token is None:
+        value = self.client.get(ptk)
+        if value is None:
             raise exception.TokenNotFound(token_id=token_id)
 
-        return token
+        try:
+            return decode_token(value)
+        except Exception:
+            LOG.exception('Unable to decode token %s' % token_id)
+            raise exception.TokenNotFound(token_id=token_id)
+
+    def get_tokens(self, token_ids):
+        keys = dict((self._prefix_token_id(x), x) for x in token_ids)
+        values = self.client.get_multi(keys.keys()) if keys else {}
+        token_refs = {}
+        for key, value in values.iteritems():
+            try:
+                token_refs[keys[key]] = decode_token(value)
+            except Exception:
+                LOG.exception('Unable to decode token %s' % keys[key])
+        return token_refs
 
     def create_token(self, token_id, data):
-        data_copy = copy.deepcopy(data)
+        data_copy = dict(data)
         ptk = self._prefix_token_id(token_id)
         if 'expires' not in data_copy:
             data_copy['expires'] = self._get_default_expire_time()
+        data_copy = token.freeze(data_copy)
         kwargs = {}
         if data_copy['expires'] is not None:
             expires_ts = utils.unixtime(data_copy['expires'])
             kwargs['time'] = expires_ts
-        self.client.set(ptk, data_copy, **kwargs)
-        return copy.deepcopy(data_copy)
+        self.client.set(ptk, self.format.encode(data_copy), **kwargs)
+        self._index_token(token_id, data_copy)
+        return data_copy
 
     def delete_token(self, token_id):
-        # Test for existence
-        self.get_token(token_id)
         ptk = self._prefix_token_id(token_id)
-        return self.client.delete(ptk)
+        if not self.client.delete(ptk):
+            raise exception.TokenNotFound(token_id=token_id)
+
+    def delete_tokens(self, user_id=None, tenant_id=None):
+        if user_id is not None:
+            index_key = self._prefix_index('user_tokens', user_id)
+        elif tenant_id is not None:
+            index_key = self._prefix_index('tenant_tokens', tenant_id)
+        else:
+            raise ValueError('A user_id or tenant_id is required')
+
+        # tokens that have expired or been deleted drop out of the index
+        token_refs = self._read_index(index_key)
+        deleted = []
+        remaining = {}
+        for token_id, token_ref in token_refs.iteritems():
+            owners = self._get_token_owners(token_ref)
+            if tenant_id is not None and owners[1] != tenant_id:
+                remaining[token_id] = token_ref
+            else:
+                deleted.append(token_id)
+        if deleted:
+            self.client.delete_multi([self._prefix_token_id(x)
+                                      for x in deleted])
+
+        if not remaining:
+            self.client.delete(index_key)
+        elif not self._rewrite_index(index_key, remaining):
+            LOG.error('Unable to rewrite %s', index_key)
+        return deleted
+
+    def add_revocations(self, token_ids):
+        now = datetime.datetime.utcnow()
+        keep_delta = datetime.timedelta(seconds=CONF.token.expiration)
+        expires_ts = utils.unixtime(now + keep_delta)
+        # reserve a sequence number for each revocation in one round trip
+        last_seq = self.client.incr('token_revocation_seq', len(token_ids))
+        if last_seq is None:
+            self.client.add('token_revocation_seq', '0')
+            last_seq = self.client.incr('token_revocation_seq',
+                                        len(token_ids))
+        if last_seq is None:
+            # the tokens are deleted all the same; services caching them
+            # will only drop them once their cache time passes
+            LOG.error('Unable to record the revocation of %d tokens, the'
+                      ' revocation counter could not be updated',
+                      len(token_ids))
+            return
+        first_seq = last_seq - len(token_ids) + 1
+        self.client.set_multi(
+                dict(('token_revocation-%d' % seq,
+                      {'id': token_id, 'revoked': now})
+                     for seq, token_id in enumerate(token_ids, first_seq)),
+                time=expires_ts)
+
+    def list_revocations(self, since=None):
+        cursor = int(self.client.get('token_revocation_seq') or 0)
+        start = 1
+        # the counter starts again if memcached loses it
+        if since is not None and since <= cursor:
+            start = since + 1
+        start = max(start, cursor - self.revocation_lookback + 1)
+        keys = ['token_revocation-%d' % seq
+                for seq in xrange(start, cursor + 1)]
+        revocation_refs = self.client.get_multi(keys) if keys else {}
+        return cursor, [revocation_refs[key] for key in keys
+                        if key in revocation_refs]
+
+    def flush_expired_tokens(self, batch_size=None, batch_delay=None):
+        # memcached evicts tokens itself once their expiry time passes
+        return 0
@@ -14,38 +14,72 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
-import copy
 import datetime
+import time
 
 from keystone.common import sql
 from keystone import exception
 from keystone import token
 
 
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def _to_cursor(dt_obj):
+    """Microseconds since the epoch, the form revocation cursors take."""
+    delta = dt_obj - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
 class TokenModel(sql.ModelBase, sql.DictBase):
     __tablename__ = 'token'
     id = sql.Column(sql.String(64), primary_key=True)
-    expires = sql.Column(sql.DateTime(), default=None)
+    expires = sql.Column(sql.DateTime(), default=None, index=True)
     extra = sql.Column(sql.JsonBlob())
+    # copied out of extra so that a user's or tenant's tokens can be found
+    user_id = sql.Column(sql.String(64), index=True)
+    tenant_id = sql.Column(sql.String(64), index=True)
 
     @classmethod
     def from_dict(cls, token_dict):
         # shove any non-indexed properties into extra
-        extra = copy.deepcopy(token_dict)
+        extra = dict(token_dict)
         data = {}
         for k in ('id', 'expires'):
             data[k] = extra.pop(k, None)
         data['extra'] = extra
+        data['user_id'] = (extra.get('user') or {}).get('id')
+        data['tenant_id'] = (extra.get('tenant') or {}).get('id')
         return cls(**data)
 
     def to_dict(self):
-        out = copy.deepcopy(self.extra)
+        # extra is decoded afresh from json on every load, so it doesn't
+        # need to be copied deeply
+        out = dict(self.extra)
         out['id'] = self.id
         out['expires'] = self.expires
         return out
 
 
+class RevocationModel(sql.ModelBase, sql.DictBase):
+    __tablename__ = 'token_revocation'
+    id = sql.Column(sql.Integer, primary_key=True)
+    token_id = sql.Column(sql.String(64), nullable=False)
+    revoked = sql.Column(sql.DateTime(), nullable=False, index=True)
+
+    def to_dict(self):
+        return {'id': self.token_id, 'revoked': self.revoked}
+
+
 class Token(sql.Base, token.Driver):
+    # seconds before a list_revocations cursor that are listed again, for
+    # revocations committed after a later one was listed, and clock skew
+    # between keystone servers
+    revocation_overlap = 60
+    # tokens deleted per statement by delete_tokens, keeping within the
+    # number of parameters SQLite allows and the time locks are held
+    delete_batch_size = 500
+
     # Public interface
     def get_token(self, token_id):
         session = self.get_session()
@@ -56,8 +90,18 @@ class Token(sql.Base, token.Driver):
         else:
             raise exception.TokenNotFound(token_id=token_id)
 
+    def get_tokens(self, token_ids):
+        if not token_ids:
+            return {}
+        session = self.get_session()
+        query = session.query(TokenModel)\
+                       .filter(TokenModel.id.in_(token_ids))
+        now = datetime.datetime.utcnow()
+        return dict((x.id, x.to_dict()) for x in query
+                    if not x.expires or now < x.expires)
+
     def create_token(self, token_id, data):
-        data_copy = copy.deepcopy(data)
+        data_copy = dict(data)
         if 'expires' not in data_copy:
             data_copy['expires'] = self._get_default_expire_time()
 
@@ -81,3 +125,88 @@ class Token(sql.Base, token.Driver):
         with session.begin():
             session.delete(token_ref)
             session.flush()
+
+    def delete_tokens(self, user_id=None, tenant_id=None):
+        if user_id is None and tenant_id is None:
+            raise ValueError('A user_id or tenant_id is required')
+        session = self.get_session()
+        query = session.query(TokenModel.id)
+        if user_id is not None:
+            query = query.filter_by(user_id=user_id)
+        if tenant_id is not None:
+            query = query.filter_by(tenant_id=tenant_id)
+        deleted = []
+        while True:
+            token_ids = [x.id for x in query.limit(self.delete_batch_size)]
+            if not token_ids:
+                break
+
+            with session.begin():
+                session.query(TokenModel)\
+                       .filter(TokenModel.id.in_(token_ids))\
+                       .delete(synchronize_session=False)
+            deleted.extend(token_ids)
+
+            if len(token_ids) < self.delete_batch_size:
+                break
+        return deleted
+
+    def add_revocations(self, token_ids):
+        now = datetime.datetime.utcnow()
+        session = self.get_session()
+        with session.begin():
+            for token_id in token_ids:
+                session.add(RevocationModel(token_id=token_id, revoked=now))
+            session.flush()
+
+    def list_revocations(self, since=None):
+        """Lists revocations by when they were recorded.
+
+        The cursor is the time of the listing, rather than an id, since ids
+        can start again once the table is emptied and aren't committed in
+        order. Revocations within revocation_overlap seconds before the
+        cursor are listed again by the next call.
+
+        """
+        now = datetime.datetime.utcnow()
+        session = self.get_session()
+        query = session.query(RevocationModel)
+        if since is not None:
+            start = (_EPOCH + datetime.timedelta(microseconds=since)
+                     - datetime.timedelta(seconds=self.revocation_overlap))
+            query = query.filter(RevocationModel.revoked > start)
+        revocation_refs = query.order_by(RevocationModel.revoked,
+                                         RevocationModel.id).all()
+        cursor = max(_to_cursor(now), since or 0)
+        return cursor, [x.to_dict() for x in revocation_refs]
+
+    def flush_expired_tokens(self, batch_size=None, batch_delay=None):
+        batch_size, batch_delay = self._get_flush_options(batch_size,
+                                                          batch_delay)
+        now = datetime.datetime.utcnow()
+        session = self.get_session()
+        with session.begin():
+            session.query(RevocationModel)\
+                   .filter(RevocationModel.revoked <
+                           self._get_revocation_cutoff())\
+                   .delete(synchronize_session=False)
+
+        count = 0
+        while True:
+            token_ids = [x.id for x in session.query(TokenModel.id)
+                                              .filter(TokenModel.expires < now)
+                                              .limit(batch_size)]
+            if not token_ids:
+                break
+
+            with session.begin():
+                session.query(TokenModel)\
+                       .filter(TokenModel.id.in_(token_ids))\
+                       .delete(synchronize_session=False)
+            count += len(token_ids)
+
+            if len(token_ids) < batch_size:
+                break
+            if batch_delay:
+                time.sleep(batch_delay)
+        return count
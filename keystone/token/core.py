@@ -20,11 +20,68 @@ import datetime
 
 from keystone import config
 from keystone import exception
+from keystone.common import cache
 from keystone.common import manager
+from keystone.common import metrics
 
 
 CONF = config.CONF
 config.register_int('expiration', group='token', default=86400)
+config.register_int('flush_batch_size', group='token', default=1000)
+config.register_float('flush_batch_delay', group='token', default=0.1)
+config.register_int('validation_cache_size', group='token', default=0)
+config.register_int('validation_cache_time', group='token', default=300)
+config.register_int('max_bulk_validation', group='token', default=100)
+
+
+def _immutable(self, *args, **kwargs):
+    raise TypeError('%s is read-only' % type(self).__name__)
+
+
+class FrozenDict(dict):
+    """A dict that can't be changed once built.
+
+    Copies made with ``dict()``, ``copy.copy`` or ``copy.deepcopy``, and
+    pickles, are ordinary mutable dicts and lists.
+
+    """
+    __slots__ = ()
+    __setitem__ = __delitem__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+
+    def __reduce__(self):
+        return (dict, (dict(self),))
+
+
+class FrozenList(list):
+    """A list that can't be changed once built."""
+    __slots__ = ()
+    __setitem__ = __delitem__ = __setslice__ = __delslice__ = _immutable
+    __iadd__ = __imul__ = _immutable
+    append = extend = insert = pop = remove = reverse = sort = _immutable
+
+    def __reduce__(self):
+        return (list, (list(self),))
+
+
+def freeze(value):
+    """Returns a read-only copy of value, made of FrozenDicts and Lists.
+
+    Token records are frozen when they are created so that drivers can hand
+    out the same record to every caller instead of copying it.
+
+    """
+    if isinstance(value, dict):
+        if type(value) is FrozenDict:
+            return value
+        return FrozenDict((k, freeze(v)) for k, v in value.iteritems())
+    if isinstance(value, list):
+        if type(value) is FrozenList:
+            return value
+        return FrozenList(freeze(v) for v in value)
+    if isinstance(value, tuple):
+        return tuple(freeze(v) for v in value)
+    return value
 
 
 class Manager(manager.Manager):
@@ -35,9 +92,57 @@ class Manager(manager.Manager):
 
     """
 
+    # shared by every token manager in the process, so that deleting a token
+    # through any of them invalidates it everywhere
+    _validation_cache = None
+
     def __init__(self):
         super(Manager, self).__init__(CONF.token.driver)
 
+    @property
+    def validation_cache(self):
+        """Cache of formatted token validation responses, by token id.
+
+        Only tokens deleted through this process are dropped from it; other
+        processes and keystone servers keep serving their cached responses
+        for revoked tokens for up to ``[token] validation_cache_time``.
+
+        """
+        validation_cache = Manager._validation_cache
+        if (validation_cache is None
+            or validation_cache.max_size != CONF.token.validation_cache_size
+            or validation_cache.ttl != CONF.token.validation_cache_time):
+            validation_cache = Manager._validation_cache = cache.LRUCache(
+                    max_size=CONF.token.validation_cache_size,
+                    ttl=CONF.token.validation_cache_time)
+        return validation_cache
+
+    @staticmethod
+    def validation_cache_stats():
+        if Manager._validation_cache is None:
+            return {}
+        return Manager._validation_cache.stats()
+
+    def delete_token(self, context, token_id):
+        self.driver.delete_token(token_id)
+        self.driver.add_revocations([token_id])
+        self.validation_cache.delete(token_id)
+
+    def delete_tokens(self, context, user_id=None, tenant_id=None):
+        if user_id is None and tenant_id is None:
+            raise ValueError('A user_id or tenant_id is required')
+        token_ids = self.driver.delete_tokens(user_id=user_id,
+                                              tenant_id=tenant_id)
+        if token_ids:
+            self.driver.add_revocations(token_ids)
+        for token_id in token_ids:
+            self.validation_cache.delete(token_id)
+        return token_ids
+
+
+metrics.register_source('token_validation_cache',
+                        Manager.validation_cache_stats)
+
 
 class Driver(object):
     """Interface description for a Token driver."""
@@ -53,6 +158,26 @@ class Driver(object):
         """
         raise exception.NotImplemented()
 
+    def get_tokens(self, token_ids):
+        """Get several tokens by id at once.
+
+        Drivers should override this to fetch the tokens in fewer round
+        trips than one get_token call each.
+
+        :param token_ids: identities of the tokens
+        :type token_ids: list
+        :returns: dict of token_ref by token id, leaving out tokens that
+                  don't exist or have expired.
+
+        """
+        token_refs = {}
+        for token_id in token_ids:
+            try:
+                token_refs[token_id] = self.get_token(token_id)
+            except exception.TokenNotFound:
+                pass
+        return token_refs
+
     def create_token(self, token_id, data):
         """Create a token by id and data.
 
@@ -87,6 +212,83 @@ class Driver(object):
         """
         raise exception.NotImplemented()
 
+    def delete_tokens(self, user_id=None, tenant_id=None):
+        """Deletes all tokens for a user, a tenant, or a user on a tenant.
+
+        :param user_id: only delete tokens issued to this user
+        :type user_id: string
+        :param tenant_id: only delete tokens scoped to this tenant
+        :type tenant_id: string
+        :returns: the ids of the tokens deleted.
+        :raises: ValueError if neither user_id nor tenant_id is given.
+
+        """
+        raise exception.NotImplemented()
+
+    def add_revocations(self, token_ids):
+        """Records that tokens were deleted before they expired.
+
+        Revocations are kept for CONF.token.expiration seconds, after which
+        tokens issued at the time of the revocation have expired anyway.
+
+        :param token_ids: identities of the deleted tokens
+        :type token_ids: list
+        :returns: None.
+
+        """
+        raise exception.NotImplemented()
+
+    def list_revocations(self, since=None):
+        """Lists the tokens revoked since a cursor, oldest first.
+
+        :param since: a cursor returned by an earlier call, or None to list
+                      every revocation still recorded
+        :type since: int
+        :returns: (cursor, revocations) where revocations is a list of
+                  dicts with the token ``id`` and when it was ``revoked``,
+                  and cursor can be passed as since to list the
+                  revocations that follow; recent revocations may be
+                  listed again.
+
+        """
+        raise exception.NotImplemented()
+
+    def flush_expired_tokens(self, batch_size=None, batch_delay=None):
+        """Permanently remove tokens that have expired.
+
+        Tokens are removed in batches, pausing between each one so that a
+        large purge doesn't hold locks on the backend for long periods.
+        Revocations older than CONF.token.expiration are discarded too.
+
+        :param batch_size: maximum number of tokens to remove at once,
+                           defaults to CONF.token.flush_batch_size
+        :type batch_size: int
+        :param batch_delay: seconds to pause between batches, defaults to
+                            CONF.token.flush_batch_delay
+        :type batch_delay: float
+        :returns: the number of tokens removed.
+
+        """
+        raise exception.NotImplemented()
+
+    def _get_flush_options(self, batch_size=None, batch_delay=None):
+        if batch_size is None:
+            batch_size = CONF.token.flush_batch_size
+        if batch_delay is None:
+            batch_delay = CONF.token.flush_batch_delay
+        return batch_size, batch_delay
+
+    def _get_revocation_cutoff(self):
+        """Revocations recorded before this time may be discarded."""
+        keep_delta = datetime.timedelta(seconds=CONF.token.expiration)
+        return datetime.datetime.utcnow() - keep_delta
+
+    def _get_token_owners(self, data):
+        """Returns the (user_id, tenant_id) a token was issued for."""
+        user_ref = data.get('user') or {}
+        tenant_ref = data.get('tenant') or {}
+        return user_ref.get('id'), tenant_ref.get('id')
+
     def _get_default_expire_time(self):
         """Determine when a token should expire based on the config.
 
@@ -14,8 +14,11 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import copy
 import json
+import socket
 
+import eventlet
 import webob
 import datetime
 import iso8601
@@ -96,6 +99,10 @@ TOKEN_RESPONSES = {
 }
 
 
+# Token IDs listed by the revocation list, in the order they were revoked
+REVOKED_TOKENS = []
+
+
 class FakeMemcache(object):
     def __init__(self):
         self.set_key = None
@@ -144,7 +151,15 @@ class FakeHTTPConnection(object):
         a 404, indicating an unknown (therefore unauthorized) token.
 
         """
-        if method == 'POST':
+        if method == 'POST' and path == '/v2.0/tokens/validate':
+            token_ids = json.loads(kwargs['body'])['tokens']
+            status = 200
+            body = json.dumps({
+                'tokens': dict((token_id, TOKEN_RESPONSES.get(token_id))
+                               for token_id in token_ids),
+            })
+
+        elif method == 'POST':
             status = 200
             body = json.dumps({
                 'access': {
@@ -152,6 +167,17 @@ class FakeHTTPConnection(object):
                 },
             })
 
+        elif path.startswith('/v2.0/tokens/revoked'):
+            since = 0
+            if '?since=' in path:
+                since = int(path.split('?since=', 1)[1])
+            status = 200
+            body = json.dumps({
+                'revoked': [{'id': token_id, 'revoked': '2012-01-01T00:00Z'}
+                            for token_id in REVOKED_TOKENS[since:]],
+                'cursor': len(REVOKED_TOKENS),
+            })
+
         else:
             token_id = path.rsplit('/', 1)[1]
             if token_id in TOKEN_RESPONSES.keys():
@@ -313,6 +339,319 @@ class AuthTokenMiddlewareTest(BaseAuthTokenMiddlewareTest):
         self.middleware(req.environ, self.start_fake_response)
         self.assertEqual(len(self.middleware._cache.set_value), 2)
 
+    def test_connections_are_reused(self):
+        for i in range(3):
+            req = webob.Request.blank('/')
+            req.headers['X-Auth-Token'] = 'valid-token'
+            self.middleware(req.environ, self.start_fake_response)
+            self.assertEqual(self.response_status, 200)
+        self.assertEqual(self.middleware.http_pool.stats(),
+                         {'created': 1, 'reused': 2, 'idle': 1})
+
+    def test_stale_connection_is_replaced(self):
+        req = webob.Request.blank('/')
+        req.headers['X-Auth-Token'] = 'valid-token'
+        self.middleware(req.environ, self.start_fake_response)
+
+        stale_conn, _last_used = self.middleware.http_pool._idle[0]
+
+        def request(*args, **kwargs):
+            raise socket.error('connection reset by peer')
+        stale_conn.request = request
+
+        req = webob.Request.blank('/')
+        req.headers['X-Auth-Token'] = 'valid-token'
+        self.middleware(req.environ, self.start_fake_response)
+        self.assertEqual(self.response_status, 200)
+        self.assertEqual(self.middleware.http_pool.stats(),
+                         {'created': 2, 'reused': 1, 'idle': 1})
+        self.assertFalse(stale_conn in
+                         [c for c, _t in self.middleware.http_pool._idle])
+
+
+class LRUCacheTest(test.TestCase):
+    def test_evicts_least_recently_used(self):
+        lru = auth_token._LRUCache(2)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        self.assertEqual(lru.get('a'), 1)
+        lru.set('c', 3)
+        self.assertFalse('b' in lru)
+        self.assertEqual(lru.get('a'), 1)
+        self.assertEqual(lru.get('c'), 3)
+        self.assertEqual(len(lru), 2)
+
+    def test_entries_expire(self):
+        lru = auth_token._LRUCache(10, ttl=60)
+        lru.set('a', 1, ttl=-1)
+        lru.set('b', 2, ttl=120)
+        self.assertEqual(lru.get('a'), None)
+        self.assertTrue('b' in lru)
+        lru.delete('b')
+        self.assertEqual(lru.get('b', 'missing'), 'missing')
+
+
+class CachingMiddlewareTest(BaseAuthTokenMiddlewareTest):
+    def setUp(self):
+        super(CachingMiddlewareTest, self).setUp()
+        self.middleware._memory_cache = auth_token._LRUCache(10, ttl=300)
+        self.set_token('cached-token', datetime.timedelta(hours=1))
+
+    def tearDown(self):
+        TOKEN_RESPONSES.pop('cached-token', None)
+        super(CachingMiddlewareTest, self).tearDown()
+
+    def set_token(self, token_id, valid_for):
+        token = copy.deepcopy(TOKEN_RESPONSES['valid-token'])
+        token['access']['token']['id'] = token_id
+        expires = datetime.datetime.now() + valid_for
+        token['access']['token']['expires'] = expires.isoformat()
+        TOKEN_RESPONSES[token_id] = token
+
+    def request(self, token_id):
+        req = webob.Request.blank('/')
+        req.headers['X-Auth-Token'] = token_id
+        self.middleware(req.environ, self.start_fake_response)
+
+    def http_requests(self):
+        stats = self.middleware.http_pool.stats()
+        return stats['created'] + stats['reused']
+
+
+class MemoryCacheTest(CachingMiddlewareTest):
+    def test_valid_token_is_cached(self):
+        self.request('cached-token')
+        self.request('cached-token')
+        self.assertEqual(self.response_status, 200)
+        self.assertEqual(self.http_requests(), 1)
+
+    def test_invalid_token_is_cached(self):
+        self.request('invalid-token')
+        self.request('invalid-token')
+        self.assertEqual(self.response_status, 401)
+        self.assertEqual(self.http_requests(), 1)
+
+    def test_expired_token_is_not_cached(self):
+        self.set_token('cached-token', datetime.timedelta(hours=-1))
+        self.request('cached-token')
+        self.assertFalse('tokens/cached-token' in
+                         self.middleware._memory_cache)
+
+    def test_memcache_hit_is_cached(self):
+        self.middleware._cache = FakeMemcache()
+        self.request('valid-token')
+        self.middleware._cache = None
+        self.request('valid-token')
+        self.assertEqual(self.response_status, 200)
+        self.assertEqual(self.http_requests(), 0)
+
+
+class RevocationPollingTest(CachingMiddlewareTest):
+    def setUp(self):
+        super(RevocationPollingTest, self).setUp()
+        SlowHTTPConnection.requests = []
+        self.middleware.http_client_class = SlowHTTPConnection
+        self.middleware.revocation_poll_interval = 60
+
+    def tearDown(self):
+        del REVOKED_TOKENS[:]
+        super(RevocationPollingTest, self).tearDown()
+
+    def revoke(self, token_id):
+        TOKEN_RESPONSES.pop(token_id)
+        REVOKED_TOKENS.append(token_id)
+        # pretend the poll interval has passed
+        self.middleware._revocations_checked_at = 0
+
+    def test_revoked_token_is_evicted(self):
+        self.request('cached-token')
+        self.assertEqual(self.response_status, 200)
+        self.revoke('cached-token')
+        self.request('cached-token')
+        self.assertEqual(self.response_status, 401)
+
+    def test_polls_incrementally(self):
+        self.request('cached-token')
+        self.request('cached-token')
+        self.revoke('cached-token')
+        self.request('cached-token')
+        self.assertEqual(SlowHTTPConnection.requests,
+                         [('GET', '/v2.0/tokens/revoked'),
+                          ('GET', '/v2.0/tokens/cached-token'),
+                          ('GET', '/v2.0/tokens/revoked?since=0'),
+                          ('GET', '/v2.0/tokens/cached-token')])
+
+    def test_not_supported_stops_polling(self):
+        def request(conn, method, path, **kwargs):
+            conn.requests.append((method, path))
+            conn.resp = FakeHTTPResponse(404, '')
+
+        self.middleware.http_client_class = type(
+                'NoRevocationsConnection', (SlowHTTPConnection,),
+                {'request': request})
+        self.middleware._check_revocations()
+        self.assertEqual(self.middleware.revocation_poll_interval, 0)
+
+
+class SlowHTTPConnection(FakeHTTPConnection):
+    requests = []
+
+    def request(self, method, path, **kwargs):
+        self.requests.append((method, path))
+        # give other greenthreads the chance to make the same request
+        eventlet.sleep(0.01)
+        super(SlowHTTPConnection, self).request(method, path, **kwargs)
+
+
+class CoalescingTest(BaseAuthTokenMiddlewareTest):
+    def setUp(self):
+        super(CoalescingTest, self).setUp()
+        SlowHTTPConnection.requests = []
+        self.middleware.http_client_class = SlowHTTPConnection
+
+    def validate_concurrently(self, token_id, count=5):
+        pool = eventlet.GreenPool()
+        results = []
+
+        def validate():
+            try:
+                results.append(self.middleware._validate_user_token(token_id))
+            except auth_token.InvalidUserToken, e:
+                results.append(e)
+
+        for i in range(count):
+            pool.spawn(validate)
+        pool.waitall()
+        return results
+
+    def test_concurrent_validations_share_request(self):
+        results = self.validate_concurrently('valid-token')
+        self.assertEqual(len(results), 5)
+        self.assertEqual(results, [TOKEN_RESPONSES['valid-token']] * 5)
+        self.assertEqual(SlowHTTPConnection.requests,
+                         [('GET', '/v2.0/tokens/valid-token')])
+        self.assertEqual(self.middleware.coalescer.stats(),
+                         {'calls': 1, 'coalesced': 4, 'in_flight': 0})
+
+    def test_concurrent_failures_share_request(self):
+        results = self.validate_concurrently('invalid-token')
+        self.assertEqual(len(results), 5)
+        for result in results:
+            self.assertTrue(isinstance(result, auth_token.InvalidUserToken))
+        self.assertEqual(len(SlowHTTPConnection.requests), 1)
+
+    def test_concurrent_admin_token_requests_share_request(self):
+        self.middleware.admin_token = None
+        pool = eventlet.GreenPool()
+        results = []
+        for i in range(3):
+            pool.spawn(lambda: results.append(
+                    self.middleware.get_admin_token()))
+        pool.waitall()
+        self.assertEqual(results, ['admin_token2'] * 3)
+        self.assertEqual(SlowHTTPConnection.requests,
+                         [('POST', '/v2.0/tokens')])
+
+
+class BatchingTest(BaseAuthTokenMiddlewareTest):
+    def setUp(self):
+        super(BatchingTest, self).setUp()
+        SlowHTTPConnection.requests = []
+        self.middleware.http_client_class = SlowHTTPConnection
+        self.middleware.token_batcher = auth_token.RequestBatcher(
+                self.middleware._validate_token_batch, max_size=10)
+
+    def validate_concurrently(self, token_ids):
+        pool = eventlet.GreenPool()
+        results = {}
+
+        def validate(token_id):
+            try:
+                results[token_id] = self.middleware._validate_user_token(
+                        token_id)
+            except auth_token.InvalidUserToken, e:
+                results[token_id] = e
+
+        for token_id in token_ids:
+            pool.spawn(validate, token_id)
+        pool.waitall()
+        return results
+
+    def test_concurrent_validations_are_batched(self):
+        results = self.validate_concurrently(['valid-token',
+                                              'unscoped-token',
+                                              'invalid-token'])
+        self.assertEqual(results['valid-token'],
+                         TOKEN_RESPONSES['valid-token'])
+        self.assertEqual(results['unscoped-token'],
+                         TOKEN_RESPONSES['unscoped-token'])
+        self.assertTrue(isinstance(results['invalid-token'],
+                                   auth_token.InvalidUserToken))
+        self.assertEqual(SlowHTTPConnection.requests,
+                         [('POST', '/v2.0/tokens/validate')])
+        self.assertEqual(self.middleware.token_batcher.stats(),
+                         {'calls': 1, 'batched': 2})
+
+    def test_full_batch_is_sent(self):
+        self.middleware.token_batcher.max_size = 2
+        self.middleware.token_batcher.delay = 60
+        results = self.validate_concurrently(['valid-token',
+                                              'unscoped-token'])
+        self.assertEqual(len(results), 2)
+        self.assertEqual(SlowHTTPConnection.requests,
+                         [('POST', '/v2.0/tokens/validate')])
+
+    def test_not_supported_validates_singly(self):
+        def request(conn, method, path, **kwargs):
+            conn.requests.append((method, path))
+            if path == '/v2.0/tokens/validate':
+                conn.resp = FakeHTTPResponse(404, '')
+            else:
+                FakeHTTPConnection.request(conn, method, path, **kwargs)
+
+        self.middleware.http_client_class = type(
+                'NoBatchConnection', (SlowHTTPConnection,),
+                {'request': request})
+        results = self.validate_concurrently(['valid-token'])
+        self.assertEqual(results['valid-token'],
+                         TOKEN_RESPONSES['valid-token'])
+        self.assertEqual(SlowHTTPConnection.requests,
+                         [('POST', '/v2.0/tokens/validate'),
+                          ('GET', '/v2.0/tokens/valid-token')])
+        self.assertEqual(self.middleware.token_batcher, None)
+
+
+class HTTPConnectionPoolTest(test.TestCase):
+    def test_idle_connections_are_bounded(self):
+        pool = auth_token.HTTPConnectionPool(FakeHTTPConnection, max_size=1)
+        conn1, reused = pool.get()
+        self.assertFalse(reused)
+        conn2, reused = pool.get()
+        self.assertFalse(reused)
+        pool.put(conn1)
+        pool.put(conn2)
+        self.assertEqual(pool.stats(),
+                         {'created': 2, 'reused': 0, 'idle': 1})
+        conn, reused = pool.get()
+        self.assertTrue(reused)
+        self.assertTrue(conn is conn1)
+
+    def test_idle_timeout(self):
+        pool = auth_token.HTTPConnectionPool(FakeHTTPConnection,
+                                             idle_timeout=-1)
+        conn, _reused = pool.get()
+        pool.put(conn)
+        conn, reused = pool.get()
+        self.assertFalse(reused)
+        self.assertEqual(pool.stats(),
+                         {'created': 2, 'reused': 0, 'idle': 0})
+
+    def test_disabled(self):
+        pool = auth_token.HTTPConnectionPool(FakeHTTPConnection, max_size=0)
+        conn, _reused = pool.get()
+        pool.put(conn)
+        self.assertEqual(pool.stats()['idle'], 0)
+
 if __name__ == '__main__':
     import unittest
     unittest.main()
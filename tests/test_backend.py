@@ -82,6 +82,80 @@ class IdentityTests(object):
         self.assertDictEqual(user_ref, user)
         self.assertDictEqual(tenant_ref, tenant)
 
+    def test_authenticate_by_name(self):
+        self.identity_api.add_role_to_user_and_tenant(
+                self.user_foo['id'], self.tenant_bar['id'], 'useless')
+        auth_info = self.identity_api.authenticate_by_name(
+                user_name=self.user_foo['name'],
+                tenant_name=self.tenant_bar['name'],
+                password=self.user_foo['password'])
+        user_ref, tenant_ref, metadata_ref, roles_ref = auth_info
+        self.user_foo.pop('password')
+        self.assertDictEqual(user_ref, self.user_foo)
+        self.assertDictEqual(tenant_ref, self.tenant_bar)
+        self.assertEquals(metadata_ref['roles'], ['useless'])
+        self.assertEquals([x['id'] for x in roles_ref], ['useless'])
+
+    def test_authenticate_by_name_falls_back_to_ids(self):
+        auth_info = self.identity_api.authenticate_by_name(
+                user_name=self.user_foo['name'] + 'WRONG',
+                user_id=self.user_foo['id'],
+                tenant_name=self.tenant_bar['name'] + 'WRONG',
+                tenant_id=self.tenant_bar['id'],
+                password=self.user_foo['password'])
+        user_ref, tenant_ref, metadata_ref, roles_ref = auth_info
+        self.assertEquals(user_ref['id'], self.user_foo['id'])
+        self.assertDictEqual(tenant_ref, self.tenant_bar)
+
+    def test_authenticate_by_name_unknown_tenant_name(self):
+        auth_info = self.identity_api.authenticate_by_name(
+                user_name=self.user_foo['name'],
+                tenant_name=self.tenant_bar['name'] + 'WRONG',
+                password=self.user_foo['password'])
+        user_ref, tenant_ref, metadata_ref, roles_ref = auth_info
+        self.assertEquals(user_ref['id'], self.user_foo['id'])
+        self.assert_(tenant_ref is None)
+        self.assert_(not metadata_ref)
+        self.assertEquals(roles_ref, [])
+
+    def test_authenticate_by_name_no_metadata(self):
+        user = self.user_no_meta
+        auth_info = self.identity_api.authenticate_by_name(
+                user_name=user['name'],
+                tenant_name=self.tenant_baz['name'],
+                password=user['password'])
+        user_ref, tenant_ref, metadata_ref, roles_ref = auth_info
+        self.assertDictEqual(tenant_ref, self.tenant_baz)
+        self.assertEquals(metadata_ref, {})
+        self.assertEquals(roles_ref, [])
+
+    def test_authenticate_by_name_bad_user(self):
+        self.assertRaises(AssertionError,
+                          self.identity_api.authenticate_by_name,
+                          user_name=self.user_foo['name'] + 'WRONG',
+                          tenant_name=self.tenant_bar['name'],
+                          password=self.user_foo['password'])
+
+    def test_authenticate_by_name_bad_password(self):
+        self.assertRaises(AssertionError,
+                          self.identity_api.authenticate_by_name,
+                          user_name=self.user_foo['name'],
+                          tenant_name=self.tenant_bar['name'],
+                          password=self.user_foo['password'] + 'WRONG')
+
+    def test_authenticate_by_name_invalid_tenant(self):
+        # foo is not a member of baz
+        self.assertRaises(AssertionError,
+                          self.identity_api.authenticate_by_name,
+                          user_name=self.user_foo['name'],
+                          tenant_name=self.tenant_baz['name'],
+                          password=self.user_foo['password'])
+        self.assertRaises(AssertionError,
+                          self.identity_api.authenticate_by_name,
+                          user_name=self.user_foo['name'],
+                          tenant_id=self.tenant_bar['id'] + 'WRONG',
+                          password=self.user_foo['password'])
+
     def test_password_hashed(self):
         user_ref = self.identity_api._get_user(self.user_foo['id'])
         self.assertNotEqual(user_ref['password'], self.user_foo['password'])
@@ -152,6 +226,17 @@ class IdentityTests(object):
         role_ref_dict = dict((x, role_ref[x]) for x in role_ref)
         self.assertDictEqual(role_ref_dict, self.role_keystone_admin)
 
+    def test_get_roles(self):
+        role_refs = self.identity_api.get_roles(
+                [self.role_useless['id'],
+                 'WRONG',
+                 self.role_keystone_admin['id']])
+        self.assertEquals([x['id'] for x in role_refs],
+                          [self.role_useless['id'],
+                           self.role_keystone_admin['id']])
+        self.assertEquals(role_refs[0]['name'], self.role_useless['name'])
+        self.assertEquals(self.identity_api.get_roles([]), [])
+
     def test_create_duplicate_role_name_fails(self):
         role = {'id': 'fake1',
                 'name': 'fake1name'}
@@ -303,17 +388,32 @@ class IdentityTests(object):
         tenants = self.identity_api.get_tenants_for_user('foo')
         self.assertIn(tenant_id, tenants)
 
+    def test_get_tenants(self):
+        tenant_ids = set([x['id'] for x in self.identity_api.get_tenants()])
+        self.assertEquals(tenant_ids, set(['bar', 'baz', 'tenent4add']))
+
+    def test_get_tenant_users(self):
+        user_ids = set([x['id'] for x in
+                        self.identity_api.get_tenant_users('baz')])
+        self.assertEquals(user_ids, set(['two', 'no_meta']))
+
+        self.identity_api.add_user_to_tenant('baz', 'foo')
+        self.identity_api.remove_user_from_tenant('baz', 'two')
+        user_ids = set([x['id'] for x in
+                        self.identity_api.get_tenant_users('baz')])
+        self.assertEquals(user_ids, set(['foo', 'no_meta']))
+
 
 class TokenTests(object):
     def test_token_crud(self):
         token_id = uuid.uuid4().hex
         data = {'id': token_id, 'a': 'b'}
-        data_ref = self.token_api.create_token(token_id, data)
+        data_ref = dict(self.token_api.create_token(token_id, data))
         expires = data_ref.pop('expires')
         self.assertTrue(isinstance(expires, datetime.datetime))
         self.assertDictEqual(data_ref, data)
 
-        new_data_ref = self.token_api.get_token(token_id)
+        new_data_ref = dict(self.token_api.get_token(token_id))
         expires = new_data_ref.pop('expires')
         self.assertTrue(isinstance(expires, datetime.datetime))
         self.assertEquals(new_data_ref, data)
@@ -341,6 +441,123 @@ class TokenTests(object):
         new_data_ref = self.token_api.get_token(token_id)
         self.assertEqual(data_ref, new_data_ref)
 
+    def test_flush_expired_tokens(self):
+        expire_time = (datetime.datetime.utcnow() -
+                       datetime.timedelta(minutes=1))
+        for i in range(3):
+            token_id = uuid.uuid4().hex
+            data = {'id': token_id, 'a': 'b', 'expires': expire_time}
+            self.token_api.create_token(token_id, data)
+        valid_id = uuid.uuid4().hex
+        self.token_api.create_token(valid_id, {'id': valid_id, 'a': 'b'})
+        forever_id = uuid.uuid4().hex
+        self.token_api.create_token(forever_id, {'id': forever_id,
+                                                 'expires': None})
+
+        count = self.token_api.flush_expired_tokens(batch_size=2,
+                                                    batch_delay=0)
+        self.assertEquals(count, 3)
+        self.token_api.get_token(valid_id)
+        self.token_api.get_token(forever_id)
+        self.assertEquals(self.token_api.flush_expired_tokens(), 0)
+
+    def _create_owned_token(self, user_id, tenant_id=None):
+        token_id = uuid.uuid4().hex
+        data = {'id': token_id,
+                'user': {'id': user_id},
+                'tenant': tenant_id and {'id': tenant_id}}
+        self.token_api.create_token(token_id, data)
+        return token_id
+
+    def test_delete_tokens(self):
+        user_token = self._create_owned_token('user1')
+        user_tenant_token = self._create_owned_token('user1', 'tenant1')
+        other_user_token = self._create_owned_token('user2', 'tenant1')
+        other_tenant_token = self._create_owned_token('user1', 'tenant2')
+        unrelated_token = self._create_owned_token('user3', 'tenant3')
+
+        deleted = self.token_api.delete_tokens(user_id='user1',
+                                               tenant_id='tenant1')
+        self.assertEquals(deleted, [user_tenant_token])
+        self.assertRaises(exception.TokenNotFound,
+                self.token_api.get_token, user_tenant_token)
+
+        deleted = self.token_api.delete_tokens(tenant_id='tenant1')
+        self.assertEquals(deleted, [other_user_token])
+
+        deleted = self.token_api.delete_tokens(user_id='user1')
+        self.assertEquals(sorted(deleted),
+                          sorted([user_token, other_tenant_token]))
+        for token_id in (user_token, other_user_token, other_tenant_token):
+            self.assertRaises(exception.TokenNotFound,
+                    self.token_api.get_token, token_id)
+
+        self.assertEquals(self.token_api.delete_tokens(user_id='user1'), [])
+        self.token_api.get_token(unrelated_token)
+
+    def test_delete_tokens_requires_owner(self):
+        token_id = self._create_owned_token('user1', 'tenant1')
+        self.assertRaises(ValueError, self.token_api.delete_tokens)
+        self.token_api.get_token(token_id)
+
+    def test_get_tokens(self):
+        valid_id = self._create_owned_token('user1')
+        expired_id = uuid.uuid4().hex
+        expire_time = datetime.datetime.utcnow() - datetime.timedelta(1)
+        self.token_api.create_token(expired_id, {'id': expired_id,
+                                                 'expires': expire_time})
+
+        token_refs = self.token_api.get_tokens([valid_id, expired_id,
+                                                uuid.uuid4().hex])
+        self.assertEquals(token_refs.keys(), [valid_id])
+        self.assertEquals(token_refs[valid_id],
+                          self.token_api.get_token(valid_id))
+        self.assertEquals(self.token_api.get_tokens([]), {})
+
+    def test_list_revocations(self):
+        cursor, revocations = self.token_api.list_revocations()
+        self.assertEquals(revocations, [])
+
+        self.token_api.add_revocations(['token1', 'token2'])
+        cursor, revocations = self.token_api.list_revocations(since=cursor)
+        self.assertEquals([x['id'] for x in revocations],
+                          ['token1', 'token2'])
+        for revocation in revocations:
+            self.assertTrue(isinstance(revocation['revoked'],
+                                       datetime.datetime))
+
+        self.token_api.add_revocations(['token3'])
+        new_cursor, revocations = self.token_api.list_revocations(
+                since=cursor)
+        self.assertEquals([x['id'] for x in revocations], ['token3'])
+        self.assertEquals(self.token_api.list_revocations(since=new_cursor),
+                          (new_cursor, []))
+
+        cursor, revocations = self.token_api.list_revocations()
+        self.assertEquals([x['id'] for x in revocations],
+                          ['token1', 'token2', 'token3'])
+        self.assertEquals(cursor, new_cursor)
+
+    def test_list_revocations_after_flush(self):
+        self.token_api.add_revocations(['token1'])
+        cursor, revocations = self.token_api.list_revocations()
+        self.opt_in_group('token', expiration=-1)
+        self.token_api.flush_expired_tokens()
+        self.opt_in_group('token', expiration=86400)
+
+        self.token_api.add_revocations(['token2'])
+        cursor, revocations = self.token_api.list_revocations(since=cursor)
+        self.assertEquals([x['id'] for x in revocations], ['token2'])
+
+    def test_flush_expired_revocations(self):
+        self.token_api.add_revocations(['token1'])
+        # revocations outlive the tokens they revoke, then are discarded
+        self.token_api.flush_expired_tokens()
+        self.assertEquals(len(self.token_api.list_revocations()[1]), 1)
+        self.opt_in_group('token', expiration=-1)
+        self.token_api.flush_expired_tokens()
+        self.assertEquals(self.token_api.list_revocations()[1], [])
+
 
 class CatalogTests(object):
 
@@ -13,6 +13,13 @@
 # WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 # License for the specific language governing permissions and limitations
 # under the License.
+import copy
+import datetime
+import uuid
+
+import eventlet
+
+from keystone import exception
 from keystone import test
 from keystone.identity.backends import kvs as identity_kvs
 from keystone.token.backends import kvs as token_kvs
@@ -28,12 +35,85 @@ class KvsIdentity(test.TestCase, test_backend.IdentityTests):
         self.identity_api = identity_kvs.Identity(db={})
         self.load_fixtures(default_fixtures)
 
+    def test_tenant_indexes_ignore_other_keys(self):
+        self.identity_api.db.set('token-tenant-bar', {'id': 'tenant-bar'})
+        self.identity_api.db.set('user-tenant', {'id': 'user-tenant',
+                                                 'tenants': ['bar']})
+        tenant_ids = [x['id'] for x in self.identity_api.get_tenants()]
+        self.assertEquals(sorted(tenant_ids), ['bar', 'baz', 'tenent4add'])
+        user_ids = [x['id'] for x in self.identity_api.get_tenant_users('bar')]
+        self.assertEquals(user_ids, ['foo'])
+
+    def test_tenant_indexes_follow_deletes(self):
+        self.identity_api.delete_user('foo')
+        self.assertEquals(self.identity_api.get_tenant_users('bar'), [])
+        self.identity_api.delete_tenant('bar')
+        tenant_ids = [x['id'] for x in self.identity_api.get_tenants()]
+        self.assertEquals(sorted(tenant_ids), ['baz', 'tenent4add'])
+
 
 class KvsToken(test.TestCase, test_backend.TokenTests):
     def setUp(self):
         super(KvsToken, self).setUp()
         self.token_api = token_kvs.Token(db={})
 
+    def _create_token(self, expires_in):
+        token_id = uuid.uuid4().hex
+        expires = datetime.datetime.utcnow() + datetime.timedelta(
+                seconds=expires_in)
+        self.token_api.create_token(token_id, {'id': token_id,
+                                               'expires': expires})
+        return token_id
+
+    def test_token_is_shared_and_read_only(self):
+        token_id = uuid.uuid4().hex
+        data = {'id': token_id,
+                'user': {'id': 'foo'},
+                'metadata': {'roles': ['admin']}}
+        data_ref = self.token_api.create_token(token_id, data)
+        self.assertTrue(self.token_api.get_token(token_id) is data_ref)
+        self.assertRaises(TypeError, data_ref.__setitem__, 'id', 'bar')
+        self.assertRaises(TypeError, data_ref['user'].update, {'id': 'bar'})
+        self.assertRaises(TypeError,
+                          data_ref['metadata']['roles'].append, 'member')
+
+        # the caller's data is left alone, and copies can be changed
+        data['metadata']['roles'].append('member')
+        self.assertEquals(data_ref['metadata']['roles'], ['admin'])
+        data_copy = copy.deepcopy(data_ref)
+        data_copy['metadata']['roles'].append('member')
+        self.assertEquals(type(data_copy['metadata']), dict)
+
+    def test_max_tokens_evicts_soonest_to_expire(self):
+        self.opt_in_group('token', kvs_max_tokens=2)
+        late = self._create_token(300)
+        soon = self._create_token(100)
+        later = self._create_token(400)
+        self.token_api.get_token(late)
+        self.token_api.get_token(later)
+        self.assertRaises(exception.TokenNotFound,
+                          self.token_api.get_token, soon)
+        self.assertEquals(self.token_api.get_stats(),
+                          {'tokens': 2, 'expired': 0, 'evicted': 1})
+
+    def test_flush_uses_expiry_index(self):
+        expired = self._create_token(-10)
+        deleted = self._create_token(-5)
+        valid = self._create_token(300)
+        self.token_api.delete_token(deleted)
+        self.assertEquals(self.token_api.flush_expired_tokens(), 1)
+        self.assertFalse('token-%s' % expired in self.token_api.db)
+        self.token_api.get_token(valid)
+        self.assertEquals(self.token_api.get_stats(),
+                          {'tokens': 1, 'expired': 1, 'evicted': 0})
+
+    def test_reaper_removes_expired_tokens(self):
+        self.opt_in_group('token', kvs_reap_interval=0.01)
+        expired = self._create_token(-10)
+        eventlet.sleep(0.05)
+        self.assertFalse('token-%s' % expired in self.token_api.db)
+        self.assertEquals(self.token_api.get_stats()['expired'], 1)
+
 
 class KvsCatalog(test.TestCase, test_backend.CatalogTests):
     def setUp(self):
@@ -22,6 +22,7 @@ import memcache
 
 from keystone import exception
 from keystone import test
+from keystone.common import utils
 from keystone.token.backends import memcache as token_memcache
 
 import test_backend
@@ -45,8 +46,6 @@ class MemcacheClient(object):
         now = time.mktime(datetime.datetime.utcnow().utctimetuple())
         if obj and (obj[1] == 0 or obj[1] > now):
             return obj[0]
-        else:
-            raise exception.TokenNotFound(token_id=key)
 
     def set(self, key, value, time=0):
         """Sets the value for a key."""
@@ -54,13 +53,66 @@ class MemcacheClient(object):
         self.cache[key] = (value, time)
         return True
 
+    def add(self, key, value, time=0):
+        """Sets the value for a key if it isn't already set."""
+        if self.get(key) is not None:
+            return False
+        return self.set(key, value, time=time)
+
+    def append(self, key, value):
+        """Appends to the value of an existing key."""
+        obj = self.cache.get(key)
+        if self.get(key) is None:
+            return False
+        self.cache[key] = (obj[0] + value, obj[1])
+        return True
+
+    def touch(self, key, time=0):
+        """Changes when an existing key expires."""
+        if self.get(key) is None:
+            return False
+        self.cache[key] = (self.cache[key][0], time)
+        return True
+
+    def get_multi(self, keys):
+        """Retrieves the values that are set for a list of keys."""
+        values = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                values[key] = value
+        return values
+
+    def incr(self, key, delta=1):
+        """Increments an existing integer value."""
+        value = self.get(key)
+        if value is None:
+            return None
+        value = int(value) + delta
+        self.cache[key] = (str(value), self.cache[key][1])
+        return value
+
+    def set_multi(self, mapping, time=0):
+        """Sets the values for several keys."""
+        for key, value in mapping.iteritems():
+            self.set(key, value, time=time)
+        return []
+
     def delete(self, key):
+        """Deletes a key, returning whether it existed.
+
+        Like token_memcache.Client, rather than python-memcached which
+        always returns the same value.
+
+        """
         self.check_key(key)
-        try:
-            del self.cache[key]
-        except KeyError:
-            #NOTE(bcwaldon): python-memcached always returns the same value
-            pass
+        return self.cache.pop(key, None) is not None
+
+    def delete_multi(self, keys):
+        """Deletes several keys."""
+        for key in keys:
+            self.delete(key)
+        return True
 
 
 class MemcacheToken(test.TestCase, test_backend.TokenTests):
@@ -74,3 +126,274 @@ class MemcacheToken(test.TestCase, test_backend.TokenTests):
         data = {'id': token_id, 'a': 'b'}
         self.token_api.create_token(token_id, data)
         self.token_api.get_token(token_id)
+
+    def test_flush_expired_revocations(self):
+        # memcached expires revocations on its own too
+        self.opt_in_group('token', expiration=60)
+        self.token_api.add_revocations(['token1'])
+        value, expires = self.token_api.client.cache['token_revocation-1']
+        self.assertTrue(time.time() < expires <= time.time() + 60)
+
+    def test_flush_expired_tokens(self):
+        # memcached expires tokens on its own, so there is nothing to flush
+        self.assertEquals(self.token_api.flush_expired_tokens(), 0)
+
+    def _compact_token_api(self):
+        self.opt_in_group('memcache', token_format='compact')
+        return token_memcache.Token(client=self.token_api.client)
+
+    def test_compact_format(self):
+        token_api = self._compact_token_api()
+        token_id = uuid.uuid4().hex
+        expires = datetime.datetime(2030, 1, 2, 3, 4, 5, 678901)
+        data = {'id': token_id,
+                'expires': expires,
+                'user': {'id': 'foo', 'name': 'x' * 4000},
+                'metadata': {'roles': ['admin']}}
+        token_api.create_token(token_id, data)
+
+        value = token_api.client.cache['token-%s' % token_id][0]
+        self.assertTrue(isinstance(value, str))
+        self.assertTrue(len(value) < 1000)
+        self.assertEquals(token_api.get_token(token_id), data)
+        # entries written in either format can be read by both
+        self.assertEquals(self.token_api.get_token(token_id), data)
+
+    def test_values_json_cannot_encode_are_pickled(self):
+        token_api = self._compact_token_api()
+        token_id = uuid.uuid4().hex
+        data = {'id': token_id, 'created': datetime.datetime.utcnow()}
+        token_api.create_token(token_id, data)
+
+        value = token_api.client.cache['token-%s' % token_id][0]
+        self.assertTrue(isinstance(value, dict))
+        self.assertEquals(token_api.get_token(token_id)['created'],
+                          data['created'])
+
+    def test_pickle_format(self):
+        # the default, which servers older than the compact format can read
+        token_id = uuid.uuid4().hex
+        self.token_api.create_token(token_id, {'id': token_id, 'a': 'b'})
+
+        value = self.token_api.client.cache['token-%s' % token_id][0]
+        self.assertTrue(isinstance(value, dict))
+        # entries written in either format can be read by both
+        token_api = self._compact_token_api()
+        self.assertEquals(token_api.get_token(token_id)['a'], 'b')
+
+    def test_unknown_format(self):
+        self.opt_in_group('memcache', token_format='unknown')
+        self.assertRaises(ValueError, token_memcache.Token)
+
+    def test_unknown_version_is_not_found(self):
+        token_id = uuid.uuid4().hex
+        self.token_api.client.set('token-%s' % token_id, '\xff{}')
+        self.assertRaises(exception.TokenNotFound,
+                          self.token_api.get_token, token_id)
+
+    def test_delete_token_is_one_round_trip(self):
+        token_id = uuid.uuid4().hex
+        self.token_api.create_token(token_id, {'id': token_id})
+
+        def get(key):
+            self.fail('get called for %s' % key)
+        self.token_api.client.get = get
+        self.token_api.delete_token(token_id)
+        self.assertRaises(exception.TokenNotFound,
+                          self.token_api.delete_token, token_id)
+
+    def test_token_index_expires_with_tokens(self):
+        expires = datetime.datetime.utcnow() + datetime.timedelta(days=2)
+        token_id = uuid.uuid4().hex
+        self.token_api.create_token(token_id, {'id': token_id,
+                                               'expires': expires,
+                                               'user': {'id': 'user1'}})
+        index_time = self.token_api.client.cache['user_tokens-user1'][1]
+        self.assertEquals(index_time, int(utils.unixtime(expires)))
+
+        # appending to the index pushes its expiry back
+        expires += datetime.timedelta(days=1)
+        token_id = uuid.uuid4().hex
+        self.token_api.create_token(token_id, {'id': token_id,
+                                               'expires': expires,
+                                               'user': {'id': 'user1'}})
+        index_time = self.token_api.client.cache['user_tokens-user1'][1]
+        self.assertEquals(index_time, int(utils.unixtime(expires)))
+
+    def test_full_token_index_is_rewritten(self):
+        token_id = self._create_owned_token('user1')
+        self.token_api.client.append('user_tokens-user1', ',expired')
+        # memcached refuses to append beyond its item size limit
+        self.token_api.client.append = lambda key, value: False
+
+        new_token_id = self._create_owned_token('user1')
+        index = self.token_api.client.get('user_tokens-user1')
+        self.assertEquals(sorted(index.split(',')),
+                          sorted([token_id, new_token_id]))
+        self.assertEquals(sorted(self.token_api.delete_tokens('user1')),
+                          sorted([token_id, new_token_id]))
+
+    def test_add_revocations_without_memcached(self):
+        errors = []
+        self.stubs.Set(token_memcache.LOG, 'error',
+                       lambda *args: errors.append(args))
+        # as python-memcache does when the server can't be reached
+        self.token_api.client.incr = lambda key, delta=1: None
+        self.token_api.client.add = lambda key, value, time=0: False
+        self.token_api.add_revocations(['token1'])
+        self.assertEquals(len(errors), 1)
+
+    def test_failed_token_index_write_is_logged(self):
+        errors = []
+        self.stubs.Set(token_memcache.LOG, 'error',
+                       lambda *args: errors.append(args))
+        self.token_api.client.append = lambda key, value: False
+        self.token_api.client.add = lambda key, value, time=0: False
+        self.token_api.client.set = lambda key, value, time=0: False
+        self._create_owned_token('user1')
+        self.assertEquals(len(errors), 1)
+
+
+class FakeServer(object):
+    def __init__(self, reply):
+        self.reply = reply
+        self.sent = []
+
+    def send_cmd(self, cmd):
+        self.sent.append(cmd)
+
+    def readline(self):
+        return self.reply
+
+
+class ClientTest(test.TestCase):
+    def client(self, server):
+        client = token_memcache.Client(['localhost:11211'])
+        client._get_server = lambda key: (server, key)
+        return client
+
+    def test_delete_reports_missing_keys(self):
+        server = FakeServer('DELETED')
+        self.assertTrue(self.client(server).delete('token-a'))
+        self.assertEquals(server.sent, ['delete token-a'])
+        self.assertFalse(self.client(FakeServer('NOT_FOUND')).delete('a'))
+
+    def test_delete_without_server(self):
+        self.assertFalse(self.client(None).delete('token-a'))
+
+
+class FakeHost(object):
+    def __init__(self):
+        self.live = True
+
+    def connect(self):
+        return self.live
+
+
+class RingMemberClient(MemcacheClient):
+    """A fake client for one of a RingClient's servers."""
+
+    def __init__(self, server):
+        super(RingMemberClient, self).__init__()
+        self.server = server
+        self.servers = [FakeHost()]
+
+
+SERVERS = ['10.0.0.1:11211', '10.0.0.2:11211', '10.0.0.3:11211']
+
+
+class MemcacheRingToken(test.TestCase, test_backend.TokenTests):
+    def setUp(self):
+        super(MemcacheRingToken, self).setUp()
+        client = token_memcache.RingClient(SERVERS, replicas=2,
+                                           client_factory=RingMemberClient)
+        self.token_api = token_memcache.Token(client=client)
+
+    def test_flush_expired_revocations(self):
+        # memcached expires revocations on its own
+        pass
+
+    def test_flush_expired_tokens(self):
+        # memcached expires tokens on its own, so there is nothing to flush
+        self.assertEquals(self.token_api.flush_expired_tokens(), 0)
+
+
+class RingClientTest(test.TestCase):
+    def ring(self, servers=SERVERS, replicas=1):
+        return token_memcache.RingClient(servers, replicas=replicas,
+                                         client_factory=RingMemberClient)
+
+    def owners(self, ring, keys):
+        return dict((key, [c.server for c in ring._get_clients(key)])
+                    for key in keys)
+
+    def test_keys_are_spread(self):
+        keys = ['token-%d' % i for i in range(3000)]
+        owners = self.owners(self.ring(), keys)
+        for server in SERVERS:
+            share = len([k for k in keys if owners[k] == [server]])
+            self.assertTrue(700 < share < 1300, share)
+
+    def test_removing_server_only_moves_its_keys(self):
+        keys = ['token-%d' % i for i in range(1000)]
+        before = self.owners(self.ring(), keys)
+        after = self.owners(self.ring(SERVERS[:2]), keys)
+        for key in keys:
+            if before[key] != [SERVERS[2]]:
+                self.assertEquals(after[key], before[key])
+
+    def test_dead_server_is_skipped(self):
+        ring = self.ring()
+        primary = ring._get_clients('token-a')[0]
+        primary.servers[0].live = False
+        self.assertTrue(ring.set('token-a', 'value'))
+        self.assertEquals(ring.get('token-a'), 'value')
+        self.assertFalse('token-a' in primary.cache)
+
+    def test_replicas_survive_dead_server(self):
+        ring = self.ring(replicas=2)
+        clients = ring._get_clients('token-a')
+        self.assertEquals(len(set(clients)), 2)
+        ring.set('token-a', 'value')
+        ring.set_multi({'token-b': 'b', 'token-c': 'c'})
+        for client in clients:
+            self.assertEquals(client.get('token-a'), 'value')
+
+        clients[0].servers[0].live = False
+        self.assertEquals(ring.get('token-a'), 'value')
+        self.assertEquals(ring.get_multi(['token-a', 'token-b', 'token-c']),
+                          {'token-a': 'value', 'token-b': 'b',
+                           'token-c': 'c'})
+
+    def test_get_multi_reads_other_replicas(self):
+        ring = self.ring(replicas=2)
+        ring.set('token-a', 'value')
+        # as if the primary had restarted and lost the key
+        del ring._get_clients('token-a')[0].cache['token-a']
+        self.assertEquals(ring.get_multi(['token-a']), {'token-a': 'value'})
+
+    def test_delete(self):
+        ring = self.ring(replicas=2)
+        ring.set('token-a', 'value')
+        self.assertTrue(ring.delete('token-a'))
+        self.assertEquals(ring.get('token-a'), None)
+        self.assertFalse(ring.delete('token-a'))
+
+    def test_no_live_servers(self):
+        ring = self.ring()
+        for client in ring.clients:
+            client.servers[0].live = False
+        self.assertFalse(ring.set('token-a', 'value'))
+        self.assertEquals(ring.get('token-a'), None)
+        self.assertEquals(ring.set_multi({'token-a': 'value'}), ['token-a'])
+
+    def test_hashing_option(self):
+        self.opt_in_group('memcache', hashing='ketama', replicas=2,
+                          servers='10.0.0.1:11211,10.0.0.2:11211')
+        client = token_memcache.Token().client
+        self.assertTrue(isinstance(client, token_memcache.RingClient))
+        self.assertEquals(client.replicas, 2)
+        self.assertEquals(len(client.clients), 2)
+
+        self.opt_in_group('memcache', hashing='unknown')
+        self.assertRaises(ValueError, lambda: token_memcache.Token().client)
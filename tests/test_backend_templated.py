@@ -15,6 +15,8 @@
 # under the License.
 
 import os
+import shutil
+import tempfile
 
 from keystone import test
 from keystone.catalog.backends import templated as catalog_templated
@@ -55,3 +57,56 @@ class TestTemplatedCatalog(test.TestCase, test_backend.CatalogTests):
     def test_get_catalog(self):
         catalog_ref = self.catalog_api.get_catalog('foo', 'bar')
         self.assertDictEqual(catalog_ref, self.DEFAULT_FIXTURE)
+
+    def test_get_catalog_returns_new_dicts(self):
+        catalog_ref = self.catalog_api.get_catalog('foo', 'bar')
+        catalog_ref['RegionOne']['identity']['publicURL'] = 'mangled'
+        catalog_ref = self.catalog_api.get_catalog('foo', 'baz')
+        self.assertEquals(
+                catalog_ref['RegionOne']['identity']['publicURL'],
+                'http://localhost:5000/v2.0')
+        self.assertEquals(
+                catalog_ref['RegionOne']['compute']['publicURL'],
+                'http://localhost:8774/v1.1/baz')
+
+    def test_config_change_recompiles(self):
+        self.catalog_api.get_catalog('foo', 'bar')
+        self.opt(compute_port=9774)
+        catalog_ref = self.catalog_api.get_catalog('foo', 'bar')
+        self.assertEquals(
+                catalog_ref['RegionOne']['compute']['publicURL'],
+                'http://localhost:9774/v1.1/bar')
+
+    def test_modified_template_file_reloads(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            self._test_modified_template_file_reloads(tmpdir)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def _test_modified_template_file_reloads(self, tmpdir):
+        template_file = os.path.join(tmpdir, 'catalog.templates')
+        shutil.copy(DEFAULT_CATALOG_TEMPLATES, template_file)
+        self.opt_in_group('catalog', template_file=template_file,
+                          template_check_interval=3600)
+        catalog_api = catalog_templated.TemplatedCatalog()
+        self.assertDictEqual(catalog_api.get_catalog('foo', 'bar'),
+                             self.DEFAULT_FIXTURE)
+
+        with open(template_file, 'a') as f:
+            f.write('catalog.RegionTwo.identity.publicURL = '
+                    'http://remote:$(public_port)s/v2.0\n')
+        # make sure the change is noticed without having to sleep(1)
+        mtime = os.path.getmtime(template_file)
+        os.utime(template_file, (mtime + 1, mtime + 1))
+
+        # the file isn't looked at again until template_check_interval passes
+        self.assertDictEqual(catalog_api.get_catalog('foo', 'bar'),
+                             self.DEFAULT_FIXTURE)
+        catalog_api._template_cache['checked_at'] = 0
+        catalog_ref = catalog_api.get_catalog('foo', 'bar')
+        self.assertEquals(catalog_ref['RegionTwo'],
+                          {'identity': {
+                              'publicURL': 'http://remote:5000/v2.0'}})
+        self.assertEquals(catalog_ref['RegionOne'],
+                          self.DEFAULT_FIXTURE['RegionOne'])
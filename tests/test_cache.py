@@ -0,0 +1,74 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import time
+
+from keystone import test
+from keystone.common import cache
+
+
+class LRUCacheTestCase(test.TestCase):
+    def test_get_set(self):
+        c = cache.LRUCache(max_size=10)
+        self.assertIsNone(c.get('a'))
+        c.set('a', 1)
+        self.assertEquals(c.get('a'), 1)
+        self.assertEquals(c.stats()['hits'], 1)
+        self.assertEquals(c.stats()['misses'], 1)
+
+    def test_peek(self):
+        c = cache.LRUCache(max_size=2)
+        self.assertIsNone(c.peek('a'))
+        c.set('a', 1)
+        c.set('b', 2)
+        self.assertEquals(c.peek('a'), 1)
+        c.set('c', 3)
+        self.assertNotIn('a', c)
+        self.assertEquals(c.stats()['hits'], 0)
+        self.assertEquals(c.stats()['misses'], 0)
+
+    def test_evicts_least_recently_used(self):
+        c = cache.LRUCache(max_size=2)
+        c.set('a', 1)
+        c.set('b', 2)
+        c.get('a')
+        c.set('c', 3)
+        self.assertIn('a', c)
+        self.assertNotIn('b', c)
+        self.assertIn('c', c)
+        self.assertEquals(c.stats()['evictions'], 1)
+
+    def test_ttl(self):
+        c = cache.LRUCache(max_size=10, ttl=60)
+        c.set('a', 1)
+        c.set('b', 2, ttl=-1)
+        self.assertNotIn('b', c)
+
+        self.stubs.Set(time, 'time', lambda: 2 ** 40)
+        self.assertIsNone(c.get('a'))
+        self.assertEquals(len(c), 0)
+
+    def test_delete(self):
+        c = cache.LRUCache(max_size=10)
+        c.set('a', 1)
+        c.delete('a')
+        c.delete('missing')
+        self.assertNotIn('a', c)
+
+    def test_disabled(self):
+        c = cache.LRUCache(max_size=0)
+        c.set('a', 1)
+        self.assertIsNone(c.get('a'))
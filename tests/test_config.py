@@ -0,0 +1,64 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import shutil
+import tempfile
+
+from keystone import config
+from keystone import test
+from keystone.openstack.common import cfg
+
+
+class ConfigReloadTest(test.TestCase):
+    def setUp(self):
+        super(ConfigReloadTest, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.conf = config.Config(project='keystone', default_config_files=[])
+        self.conf.register_group(cfg.OptGroup('sql'))
+        self.conf.register_opt(cfg.StrOpt('connection'), group='sql')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        super(ConfigReloadTest, self).tearDown()
+
+    def _write(self, name, data):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'w') as f:
+            f.write(data)
+        return path
+
+    def test_reload(self):
+        self.conf(config_files=[self._write('a.conf',
+                                            '[sql]\nconnection = a\n')])
+        self.conf.reload(config_files=[self._write('b.conf',
+                                                   '[sql]\nconnection = b\n')])
+        self.assertEquals(self.conf.sql.connection, 'b')
+
+    def test_failed_reload_keeps_values(self):
+        good = self._write('good.conf', '[sql]\nconnection = a\n')
+        self.conf(config_files=[good])
+        self._write('good.conf', '[sql\nconnection = b\n')
+        self.assertRaises(cfg.ConfigFileParseError,
+                          self.conf.reload,
+                          config_files=[good])
+        self.assertEquals(self.conf.sql.connection, 'a')
+
+        self.assertRaises(cfg.ConfigFilesNotFoundError,
+                          self.conf.reload,
+                          config_files=[good + '.missing'])
+        self.assertEquals(self.conf.sql.connection, 'a')
+        self.assertEquals(self.conf.config_file, [good])
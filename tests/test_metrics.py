@@ -0,0 +1,151 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import socket
+import time
+
+import webob
+
+from keystone import test
+from keystone import token
+from keystone.common import metrics
+from keystone.common import wsgi
+
+
+class FakeEmitter(object):
+    def __init__(self):
+        self.sent = []
+
+    def timing(self, name, ms):
+        self.sent.append(('timing', name, ms))
+
+    def histogram(self, name, value):
+        self.sent.append(('histogram', name, value))
+
+    def incr(self, name, count):
+        self.sent.append(('incr', name, count))
+
+
+class MetricsTest(test.TestCase):
+    def setUp(self):
+        super(MetricsTest, self).setUp()
+        metrics.reset()
+
+    def tearDown(self):
+        metrics.reset()
+        metrics._sources.pop('test', None)
+        super(MetricsTest, self).tearDown()
+
+    def test_histogram(self):
+        histogram = metrics.Histogram()
+        for value in (0.5, 3, 3, 7000):
+            histogram.add(value)
+        histogram_ref = histogram.to_dict()
+        self.assertEquals(histogram_ref['count'], 4)
+        self.assertEquals(histogram_ref['max'], 7000)
+        self.assertEquals(histogram_ref['mean'], 7006.5 / 4)
+        self.assertEquals(histogram_ref['buckets']['1'], 1)
+        self.assertEquals(histogram_ref['buckets']['5'], 2)
+        self.assertEquals(histogram_ref['buckets']['inf'], 1)
+
+    def test_emitters(self):
+        emitter = FakeEmitter()
+        collector = metrics.Metrics([emitter])
+        collector.timing('a', 12)
+        collector.histogram('b', 3)
+        collector.incr('c')
+        collector.incr('c', 2)
+        self.assertEquals(emitter.sent, [('timing', 'a', 12),
+                                         ('histogram', 'b', 3),
+                                         ('incr', 'c', 1),
+                                         ('incr', 'c', 2)])
+        report = collector.report()
+        self.assertEquals(report['histograms']['a']['count'], 1)
+        self.assertEquals(report['counters'], {'c': 3})
+
+    def test_timing(self):
+        metrics.timing('a', time.time() - 0.01)
+        histogram_ref = metrics.report()['histograms']['a']
+        self.assertEquals(histogram_ref['count'], 1)
+        self.assert_(histogram_ref['total'] >= 10)
+
+    def test_disabled(self):
+        self.opt_in_group('metrics', enabled=False)
+        metrics.timing('a', time.time())
+        self.assert_(metrics.get_metrics() is None)
+        self.assertNotIn('histograms', metrics.report())
+
+    def test_statsd(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server.bind(('127.0.0.1', 0))
+        self.opt_in_group('metrics',
+                          emitters='statsd',
+                          statsd_host='127.0.0.1',
+                          statsd_port=server.getsockname()[1])
+        metrics.incr('tokens')
+        self.assertEquals(server.recv(1024), 'keystone.tokens:1|c')
+        metrics.histogram('queries', 3)
+        self.assertEquals(server.recv(1024), 'keystone.queries:3|h')
+
+    def test_sources(self):
+        metrics.register_source('test', lambda: {'hits': 3, 'misses': 1})
+        self.assertEquals(metrics.report()['sources']['test'],
+                          {'hits': 3, 'misses': 1, 'hit_rate': 0.75})
+
+    def test_failing_source(self):
+        metrics.register_source('test', lambda: 1 / 0)
+        self.assertNotIn('test', metrics.report()['sources'])
+
+    def test_db_queries(self):
+        metrics.start_request()
+        metrics.count_db_query()
+        metrics.count_db_query()
+        self.assertEquals(metrics.finish_request(), 2)
+        self.assertEquals(metrics.finish_request(), 0)
+
+    def test_manager_records_driver_calls(self):
+        token.Manager().get_tokens({}, ['invalid'])
+        histograms = metrics.report()['histograms']
+        self.assertEquals(histograms['driver.Token.get_tokens']['count'], 1)
+
+    def test_application_records_routes(self):
+        class FakeApp(wsgi.Application):
+            def index(self, context):
+                metrics.count_db_query()
+                return {}
+
+        req = webob.Request.blank('/')
+        req.environ['wsgiorg.routing_args'] = [None, {'action': 'index',
+                                                      'controller': None}]
+        req.get_response(FakeApp())
+        histograms = metrics.report()['histograms']
+        self.assertEquals(histograms['route.FakeApp.index']['count'], 1)
+        self.assertEquals(
+                histograms['route.FakeApp.index.db_queries']['total'], 1)
+
+    def test_middleware_records_its_own_time(self):
+        class SlowApp(wsgi.Application):
+            def index(self, context):
+                time.sleep(0.05)
+
+        app = wsgi.Middleware(SlowApp())
+        req = webob.Request.blank('/')
+        req.environ['wsgiorg.routing_args'] = [None, {'action': 'index',
+                                                      'controller': None}]
+        req.get_response(app)
+        histograms = metrics.report()['histograms']
+        self.assert_(histograms['route.SlowApp.index']['total'] >= 50)
+        self.assert_(histograms['middleware.Middleware']['total'] < 50)
@@ -54,6 +54,22 @@ class PolicyFileTestCase(test.TestCase):
         self.assertRaises(exception.Forbidden, rules.enforce,
                           empty_credentials, action, self.target)
 
+    def test_policy_file_checks_are_throttled(self):
+        action = "example:test"
+        empty_credentials = {}
+        with open(self.tmpfilename, "w") as policyfile:
+            policyfile.write("""{"example:test": []}""")
+        self.opt(policy_check_interval=3600)
+        rules.enforce(empty_credentials, action, self.target)
+        with open(self.tmpfilename, "w") as policyfile:
+            policyfile.write("""{"example:test": ["false:false"]}""")
+        rules._POLICY_CACHE['mtime'] = None
+        rules.enforce(empty_credentials, action, self.target)
+
+        rules._POLICY_CACHE['checked_at'] = 0
+        self.assertRaises(exception.Forbidden, rules.enforce,
+                          empty_credentials, action, self.target)
+
 
 class PolicyTestCase(test.TestCase):
     def setUp(self):
@@ -178,3 +194,64 @@ class DefaultPolicyTestCase(test.TestCase):
         self._set_brain("default_noexist")
         self.assertRaises(exception.Forbidden, rules.enforce,
                           self.credentials, "example:noexist", {})
+
+
+class CompiledBrainTestCase(test.TestCase):
+    rules = {
+        "default": [["role:member"]],
+        "true": [],
+        "false": [["false:false"]],
+        "admin": [["role:admin"], ["role:SysAdmin"], ["is_admin:1"]],
+        "owner": [["tenant_id:%(tenant_id)s", "role:member"]],
+        "admin_or_owner": [["rule:admin"], ["rule:owner"]],
+        "templated_key": [["%(kind)s:%(value)s"]],
+        "bad_match": [["nokind"]],
+        "empty_and": [["false:false"], []],
+    }
+
+    credentials = [
+        {'roles': []},
+        {'roles': ['Admin']},
+        {'roles': ['sysadmin']},
+        {'roles': ['Member'], 'tenant_id': 'a'},
+        {'roles': ['member'], 'tenant_id': 'b'},
+        {'roles': [], 'is_admin': '1'},
+        {'roles': [], 'is_admin': 1},
+    ]
+
+    targets = [
+        {'tenant_id': 'a', 'kind': 'tenant_id', 'value': 'a'},
+        {'tenant_id': 'b', 'kind': 'is_admin', 'value': '1'},
+    ]
+
+    def test_matches_brain(self):
+        for default_rule in (None, 'default', 'noexist'):
+            brain = common_policy.Brain(self.rules, default_rule)
+            compiled = common_policy.CompiledBrain(self.rules, default_rule)
+            for rule in self.rules.keys() + ['noexist']:
+                if rule == 'bad_match':
+                    continue
+                match_list = ('rule:%s' % rule,)
+                for credentials in self.credentials:
+                    for target in self.targets:
+                        self.assertEqual(
+                            compiled.check(match_list, target, credentials),
+                            brain.check(match_list, target, credentials),
+                            (rule, default_rule, credentials, target))
+
+    def test_match_without_kind_fails(self):
+        compiled = common_policy.CompiledBrain(self.rules)
+        self.assertFalse(compiled.check(('rule:bad_match',), {}, {}))
+
+    def test_roles_are_merged(self):
+        compiled = common_policy.CompiledBrain(self.rules)
+        check = compiled.compile(self.rules['admin'])
+        self.assertEqual(check.checks[0].roles,
+                         frozenset(['admin', 'sysadmin']))
+
+    def test_add_rule_recompiles(self):
+        compiled = common_policy.CompiledBrain(dict(self.rules), 'default')
+        credentials = {'roles': ['member']}
+        self.assertTrue(compiled.check(('rule:new',), {}, credentials))
+        compiled.add_rule('new', [['role:admin']])
+        self.assertFalse(compiled.check(('rule:new',), {}, credentials))
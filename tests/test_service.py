@@ -0,0 +1,182 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import uuid
+
+from keystone import exception
+from keystone import identity
+from keystone import service
+from keystone import test
+
+import default_fixtures
+
+
+class TokenControllerTestCase(test.TestCase):
+    def setUp(self):
+        super(TokenControllerTestCase, self).setUp()
+        self.opt_in_group('token', validation_cache_size=1000)
+        self.load_backends()
+        self.load_fixtures(default_fixtures)
+        self.controller = service.TokenController()
+        self.context = {'is_admin': True, 'query_string': {}}
+
+    def _create_token(self):
+        token_id = uuid.uuid4().hex
+        self.controller.token_api.create_token(
+                self.context, token_id, {'id': token_id,
+                                         'user': self.user_foo,
+                                         'tenant': self.tenant_bar,
+                                         'metadata': self.metadata_foobar})
+        return token_id
+
+    def test_validate_token_cached(self):
+        token_id = self._create_token()
+        validation_cache = self.controller.token_api.validation_cache
+        hits = validation_cache.hits
+        misses = validation_cache.misses
+
+        token_data = self.controller.validate_token(self.context, token_id)
+        self.assertEquals(token_data['access']['token']['id'], token_id)
+        self.assertEquals(validation_cache.hits, hits)
+        self.assertEquals(validation_cache.misses, misses + 1)
+
+        self.assertEquals(
+                self.controller.validate_token(self.context, token_id),
+                token_data)
+        self.assertEquals(validation_cache.hits, hits + 1)
+
+    def test_validation_cache_size_zero(self):
+        self.opt_in_group('token', validation_cache_size=0)
+        token_id = self._create_token()
+        self.controller.validate_token(self.context, token_id)
+        self.controller.validate_token(self.context, token_id)
+        self.assertEquals(self.controller.token_api.validation_cache.hits, 0)
+
+    def test_delete_token_invalidates_cache(self):
+        token_id = self._create_token()
+        self.controller.validate_token(self.context, token_id)
+        self.controller.delete_token(self.context, token_id)
+        self.assertRaises(exception.TokenNotFound,
+                          self.controller.validate_token,
+                          self.context,
+                          token_id)
+        self.assertRaises(exception.TokenNotFound,
+                          self.controller.validate_token_head,
+                          self.context,
+                          token_id)
+
+    def test_disable_user_revokes_tokens(self):
+        token_id = self._create_token()
+        self.controller.validate_token(self.context, token_id)
+        identity.UserController().set_user_enabled(
+                self.context, self.user_foo['id'], {'enabled': False})
+        self.assertRaises(exception.TokenNotFound,
+                          self.controller.validate_token,
+                          self.context,
+                          token_id)
+
+    def test_delete_tenant_revokes_tokens(self):
+        token_id = self._create_token()
+        self.controller.validate_token(self.context, token_id)
+        identity.TenantController().delete_tenant(self.context,
+                                                  self.tenant_bar['id'])
+        self.assertRaises(exception.TokenNotFound,
+                          self.controller.validate_token,
+                          self.context,
+                          token_id)
+
+    def test_get_revoked_tokens(self):
+        token_id = self._create_token()
+        self.controller.delete_token(self.context, token_id)
+        revoked = self.controller.get_revoked_tokens(self.context)
+        self.assertEquals([x['id'] for x in revoked['revoked']], [token_id])
+
+        context = {'is_admin': True,
+                   'query_string': {'since': str(revoked['cursor'])}}
+        self.assertEquals(self.controller.get_revoked_tokens(context),
+                          {'revoked': [], 'cursor': revoked['cursor']})
+
+    def test_get_revoked_tokens_invalid_since(self):
+        context = {'is_admin': True, 'query_string': {'since': 'x'}}
+        self.assertRaises(exception.ValidationError,
+                          self.controller.get_revoked_tokens,
+                          context)
+
+    def test_revoked_tokens_route(self):
+        mapper = service.AdminRouter().map
+        match = mapper.match('/tokens/revoked',
+                             environ={'REQUEST_METHOD': 'GET'})
+        self.assertEquals(match['action'], 'get_revoked_tokens')
+
+    def test_validate_tokens(self):
+        token_id = self._create_token()
+        token_data = self.controller.validate_token(self.context, token_id)
+        other_id = self._create_token()
+        self.controller.token_api.validation_cache.delete(other_id)
+
+        results = self.controller.validate_tokens(
+                self.context, [token_id, other_id, 'invalid'])['tokens']
+        self.assertEquals(results[token_id], token_data)
+        self.assertEquals(results[other_id]['access']['token']['id'],
+                          other_id)
+        self.assertEquals(results['invalid'], None)
+
+    def test_validate_tokens_belongs_to(self):
+        token_id = self._create_token()
+        context = {'is_admin': True,
+                   'query_string': {'belongsTo': 'other-tenant'}}
+        results = self.controller.validate_tokens(context, [token_id])
+        self.assertEquals(results, {'tokens': {token_id: None}})
+
+    def test_validate_tokens_limit(self):
+        self.opt_in_group('token', max_bulk_validation=1)
+        self.assertRaises(exception.ValidationError,
+                          self.controller.validate_tokens,
+                          self.context,
+                          ['token1', 'token2'])
+
+    def test_validate_tokens_not_strings(self):
+        for tokens in ('token1', [None], ['token1', {'id': 'token2'}]):
+            self.assertRaises(exception.ValidationError,
+                              self.controller.validate_tokens,
+                              self.context,
+                              tokens)
+
+    def test_get_metrics(self):
+        controller = service.MetricsController()
+        token_id = self._create_token()
+        self.controller.validate_token(self.context, token_id)
+        report = controller.get_metrics(self.context)['metrics']
+        self.assertIn('token_validation_cache', report['sources'])
+        self.assertIn('password_cache', report['sources'])
+
+    def test_get_metrics_requires_admin(self):
+        controller = service.MetricsController()
+        context = {'is_admin': False, 'token_id': 'invalid'}
+        self.assertRaises(exception.Unauthorized,
+                          controller.get_metrics,
+                          context)
+
+    def test_metrics_route(self):
+        mapper = service.AdminRouter().map
+        match = mapper.match('/metrics', environ={'REQUEST_METHOD': 'GET'})
+        self.assertEquals(match['action'], 'get_metrics')
+
+    def test_validate_tokens_route(self):
+        mapper = service.AdminRouter().map
+        match = mapper.match('/tokens/validate',
+                             environ={'REQUEST_METHOD': 'POST'})
+        self.assertEquals(match['action'], 'validate_tokens')
@@ -30,6 +30,7 @@
 #    under the License.
 
 import datetime
+import os
 
 from keystone import test
 from keystone.common import utils
@@ -60,6 +61,56 @@ class UtilsTestCase(test.TestCase):
         self.assertTrue(utils.check_password(password, hashed))
         self.assertFalse(utils.check_password(wrong, hashed))
 
+    def test_password_cache(self):
+        self.opt(password_cache_size=10)
+        verify = utils.passlib.hash.sha512_crypt.verify
+        calls = []
+
+        def counting_verify(*args, **kw):
+            calls.append(args)
+            return verify(*args, **kw)
+
+        self.stubs.Set(utils.passlib.hash.sha512_crypt, 'verify',
+                       staticmethod(counting_verify))
+        hashed = utils.hash_password('right')
+        self.assertTrue(utils.check_password('right', hashed, 'foo'))
+        self.assertTrue(utils.check_password('right', hashed, 'foo'))
+        self.assertEquals(len(calls), 1)
+        self.assertEquals(utils.password_cache_stats()['hashes_avoided'], 1)
+
+        # failures aren't cached, and neither are other users or hashes
+        self.assertFalse(utils.check_password('wrong', hashed, 'foo'))
+        self.assertFalse(utils.check_password('wrong', hashed, 'foo'))
+        self.assertTrue(utils.check_password('right', hashed, 'bar'))
+        rehashed = utils.hash_password('right')
+        self.assertTrue(utils.check_password('right', rehashed, 'foo'))
+        self.assertEquals(len(calls), 5)
+
+    def test_password_cache_expires(self):
+        self.opt(password_cache_size=10, password_cache_time=0)
+        hashed = utils.hash_password('right')
+        self.assertTrue(utils.check_password('right', hashed, 'foo'))
+        self.assertTrue(utils.check_password('right', hashed, 'foo'))
+        self.assertEquals(utils.password_cache_stats()['hashes_avoided'], 0)
+
+    def test_password_cache_disabled(self):
+        hashed = utils.hash_password('right')
+        self.assertTrue(utils.check_password('right', hashed, 'foo'))
+        self.assertTrue(utils.check_password('right', hashed, 'foo'))
+        self.assertEquals(utils.password_cache_stats()['size'], 0)
+
+    def test_password_hash_workers(self):
+        self.opt(password_hash_workers=1)
+        try:
+            self.assertNotEqual(utils._run_password_hash(os.getpid),
+                                os.getpid())
+            hashed = utils.hash_password('right')
+            self.assertTrue(utils.check_password('right', hashed))
+            self.assertFalse(utils.check_password('wrong', hashed))
+        finally:
+            self.opt(password_hash_workers=0)
+            self.assert_(utils._get_password_hash_pool() is None)
+
     def test_isotime(self):
         dt = datetime.datetime(year=1987, month=10, day=13,
                                hour=1, minute=2, second=3)
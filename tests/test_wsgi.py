@@ -14,8 +14,14 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import httplib
 import json
+import os
+import signal
+import socket
+import time
 
+import eventlet
 import webob
 
 from keystone import test
@@ -48,3 +54,222 @@ class ApplicationTest(test.TestCase):
         req = self._make_request(url='/?1=2')
         resp = req.get_response(app)
         self.assertEqual(json.loads(resp.body), {'1': '2'})
+
+
+def pid_app(environ, start_response):
+    """Answers with the worker's pid, slowly if asked to."""
+    eventlet.sleep(float(environ['QUERY_STRING'] or 0))
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [str(os.getpid())]
+
+
+def reloaded_app(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return ['reloaded']
+
+
+def get(port, delay=0):
+    conn = httplib.HTTPConnection('127.0.0.1', port)
+    conn.request('GET', '/?%s' % delay)
+    return conn.getresponse().read()
+
+
+class ServerTest(test.TestCase):
+    def setUp(self):
+        super(ServerTest, self).setUp()
+        self.server = wsgi.Server(pid_app, host='127.0.0.1', port=0)
+        self.server.start(key='socket')
+        self.port = self.server.socket_info['socket'][1]
+
+    def tearDown(self):
+        self.server.kill()
+        super(ServerTest, self).tearDown()
+
+    def test_app_factory(self):
+        server = wsgi.Server(host='127.0.0.1', app_factory=lambda: pid_app)
+        server.start(key='socket')
+        try:
+            self.assertEqual(get(server.socket_info['socket'][1]),
+                             str(os.getpid()))
+        finally:
+            server.kill()
+
+    def test_stop_finishes_in_flight_requests(self):
+        request = eventlet.spawn(get, self.port, 0.2)
+        eventlet.sleep(0.05)
+        self.server.stop()
+        self.assertEqual(request.wait(), str(os.getpid()))
+        self.server.wait()
+        self.assertRaises(socket.error, get, self.port)
+
+    def test_kill_aborts_in_flight_requests(self):
+        request = eventlet.spawn(get, self.port, 0.2)
+        eventlet.sleep(0.05)
+        self.server.kill()
+        self.assertRaises((httplib.HTTPException, socket.error),
+                          request.wait)
+
+    def test_stop_aborts_requests_after_timeout(self):
+        request = eventlet.spawn(get, self.port, 1)
+        eventlet.sleep(0.05)
+        self.server.stop(timeout=0.1)
+        self.assertRaises((httplib.HTTPException, socket.error),
+                          request.wait)
+        self.server.wait()
+
+    def test_reload(self):
+        apps = iter([pid_app, reloaded_app])
+        server = wsgi.Server(host='127.0.0.1', app_factory=apps.next)
+        server.start(key='socket')
+        port = server.socket_info['socket'][1]
+        try:
+            request = eventlet.spawn(get, port, 0.2)
+            eventlet.sleep(0.05)
+            server.reload()
+            self.assertEqual(get(port), 'reloaded')
+            # the request in progress finishes on the old application
+            self.assertEqual(request.wait(), str(os.getpid()))
+        finally:
+            server.kill()
+
+
+class RunServersTest(test.TestCase):
+    def setUp(self):
+        super(RunServersTest, self).setUp()
+        self.handlers = dict((signum, signal.getsignal(signum))
+                             for signum in (signal.SIGTERM, signal.SIGHUP))
+        self.apps = [pid_app, reloaded_app]
+        self.server = wsgi.Server(host='127.0.0.1', port=0,
+                                  app_factory=lambda: self.apps.pop(0))
+        self.port = self.server.listen().getsockname()[1]
+        self.reloads = []
+        self.reload_error = None
+        self.runner = eventlet.spawn(wsgi.run_servers, [self.server],
+                                     self._reload_config,
+                                     stop_signals=(signal.SIGTERM,))
+        eventlet.sleep(0)
+
+    def tearDown(self):
+        self.server.kill()
+        for signum, handler in self.handlers.iteritems():
+            signal.signal(signum, handler)
+        super(RunServersTest, self).tearDown()
+
+    def _reload_config(self):
+        if self.reload_error is not None:
+            raise self.reload_error
+        self.reloads.append(True)
+
+    def test_reload_on_sighup(self):
+        self.assertEqual(get(self.port), str(os.getpid()))
+        os.kill(os.getpid(), signal.SIGHUP)
+        eventlet.sleep(0.6)
+        self.assertEqual(self.reloads, [True])
+        self.assertEqual(get(self.port), 'reloaded')
+
+    def test_failed_reload_keeps_serving(self):
+        # a config file parse error may exit through SystemExit
+        self.reload_error = SystemExit(1)
+        os.kill(os.getpid(), signal.SIGHUP)
+        eventlet.sleep(0.6)
+        self.assertEqual(get(self.port), str(os.getpid()))
+        self.assertFalse(self.runner.dead)
+
+    def test_stop_on_sigterm(self):
+        request = eventlet.spawn(get, self.port, 0.5)
+        eventlet.sleep(0.1)
+        os.kill(os.getpid(), signal.SIGTERM)
+        self.assertEqual(request.wait(), str(os.getpid()))
+        self.runner.wait()
+        self.assertRaises(socket.error, get, self.port)
+
+
+class WorkerSupervisorTest(test.TestCase):
+    def setUp(self):
+        super(WorkerSupervisorTest, self).setUp()
+        server = wsgi.Server(pid_app, host='127.0.0.1', port=0)
+        self.port = server.listen().getsockname()[1]
+        supervisor = wsgi.WorkerSupervisor([server], 2)
+        supervisor.supervisor_check_interval = 0.1
+        self.pid = os.fork()
+        if not self.pid:
+            status = 1
+            try:
+                supervisor.run()
+                status = 0
+            finally:
+                os._exit(status)
+        server.socket.close()
+
+    def tearDown(self):
+        # stopping the supervisor stops its workers too
+        if self.pid:
+            os.kill(self.pid, signal.SIGTERM)
+            try:
+                self._wait_for_exit()
+            finally:
+                if self.pid:
+                    os.kill(self.pid, signal.SIGKILL)
+                    os.waitpid(self.pid, 0)
+        super(WorkerSupervisorTest, self).tearDown()
+
+    def _wait_for_exit(self, timeout=5):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            pid, status = os.waitpid(self.pid, os.WNOHANG)
+            if pid:
+                self.pid = None
+                return status
+            eventlet.sleep(0.05)
+        self.fail('supervisor did not exit')
+
+    def test_serves_from_workers(self):
+        worker_pid = int(get(self.port))
+        self.assertNotEqual(worker_pid, os.getpid())
+        self.assertNotEqual(worker_pid, self.pid)
+
+    def test_respawns_dead_workers(self):
+        pids = set(int(get(self.port)) for i in range(20))
+        for pid in pids:
+            os.kill(pid, signal.SIGKILL)
+        # the listening socket queues connections until workers are back
+        new_pids = set(int(get(self.port)) for i in range(20))
+        self.assertFalse(pids & new_pids)
+
+    def test_stop_finishes_in_flight_requests(self):
+        request = eventlet.spawn(get, self.port, 0.5)
+        eventlet.sleep(0.2)
+        os.kill(self.pid, signal.SIGTERM)
+        self.assert_(int(request.wait()))
+        self.assertEqual(self._wait_for_exit(), 0)
+
+    def test_stop_while_starting_workers(self):
+        # once one worker is serving, the other may still be starting
+        get(self.port)
+        os.kill(self.pid, signal.SIGTERM)
+        self.assertEqual(self._wait_for_exit(), 0)
+        self.assertRaises(socket.error, get, self.port)
+
+    def test_restart_replaces_workers(self):
+        pids = set(int(get(self.port)) for i in range(20))
+        request = eventlet.spawn(get, self.port, 0.5)
+        eventlet.sleep(0.2)
+        os.kill(self.pid, signal.SIGHUP)
+        self.assert_(int(request.wait()) in pids)
+        eventlet.sleep(0.2)
+        new_pids = set(int(get(self.port)) for i in range(20))
+        self.assertFalse(pids & new_pids)
+
+    def test_workers_stop_without_supervisor(self):
+        get(self.port)
+        os.kill(self.pid, signal.SIGKILL)
+        self._wait_for_exit()
+        deadline = time.time() + 5
+        while time.time() < deadline:
+            try:
+                get(self.port)
+            except (socket.error, httplib.HTTPException):
+                # connections queued as the workers stop are closed unread
+                return
+            eventlet.sleep(0.05)
+        self.fail('workers kept serving without the supervisor')
@@ -0,0 +1,91 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+Benchmark listing tenants and tenant users from the kvs identity backend
+while the shared in-memory store also holds a large number of tokens.
+
+Usage: tools/with_venv.sh python tools/bench_kvs_identity.py [tokens]
+"""
+
+import os
+import sys
+import time
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+
+from keystone.identity.backends import kvs
+
+
+TENANTS = 100
+USERS_PER_TENANT = 10
+
+
+def scan_get_tenants(identity):
+    """The full keyspace scan the backend used before it kept indexes."""
+    tenant_keys = filter(lambda x: x.startswith('tenant-'), identity.db.keys())
+    return [identity.db.get(key) for key in tenant_keys]
+
+
+def scan_get_tenant_users(identity, tenant_id):
+    user_keys = filter(lambda x: x.startswith('user-'), identity.db.keys())
+    user_refs = [identity.db.get(key) for key in user_keys]
+    return filter(lambda x: tenant_id in x['tenants'], user_refs)
+
+
+def populate(identity, tokens):
+    for i in xrange(TENANTS):
+        tenant_id = 't%d' % i
+        identity.create_tenant(tenant_id, {'id': tenant_id,
+                                           'name': tenant_id})
+        for j in xrange(USERS_PER_TENANT):
+            user_id = 'u%d-%d' % (i, j)
+            # skip password hashing, it isn't what is being measured
+            identity.create_user(user_id, {'id': user_id,
+                                           'name': user_id,
+                                           'tenants': [tenant_id]})
+    for i in xrange(tokens):
+        identity.db.set('token-%032x' % i, {'id': '%032x' % i,
+                                            'expires': None})
+
+
+def timed(func, number):
+    return min(timeit.repeat(func, number=number, repeat=3)) / number
+
+
+def main(tokens=1000000):
+    identity = kvs.Identity(db={})
+    start = time.time()
+    populate(identity, tokens)
+    print 'populated %d tokens in %.1fs' % (tokens, time.time() - start)
+
+    number = 3
+    print '%-18s %12s %12s' % ('operation', 'scan', 'indexed')
+    print '%-18s %10.2fms %10.4fms' % (
+            'get_tenants',
+            timed(lambda: scan_get_tenants(identity), number) * 1e3,
+            timed(lambda: identity.get_tenants(), number) * 1e3)
+    print '%-18s %10.2fms %10.4fms' % (
+            'get_tenant_users',
+            timed(lambda: scan_get_tenant_users(identity, 't0'),
+                  number) * 1e3,
+            timed(lambda: identity.get_tenant_users('t0'), number) * 1e3)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
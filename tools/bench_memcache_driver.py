@@ -0,0 +1,200 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+Measure the latency of memcache token driver operations that used to take
+one round trip per token against the batched versions.
+
+Runs against a small memcached stand-in on the loopback interface, which
+speaks enough of the text protocol for the token driver. Every command it
+answers pays a real round trip through the kernel, like memcached would.
+
+Usage: tools/with_venv.sh python tools/bench_memcache_driver.py [iterations]
+"""
+
+import os
+import SocketServer
+import sys
+import threading
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+
+from keystone import config
+from keystone.token.backends import memcache
+
+
+CONF = config.CONF
+BATCH = 20
+
+
+class MemcachedStandIn(SocketServer.StreamRequestHandler):
+    """Just enough of the memcached text protocol for the token driver."""
+
+    # like memcached, so replies aren't held back waiting for acks
+    disable_nagle_algorithm = True
+    data = {}
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            args = line.split()
+            handler = getattr(self, 'do_%s' % args[0], None)
+            if handler is None:
+                self.wfile.write('ERROR\r\n')
+            else:
+                handler(*args[1:])
+
+    def do_get(self, *keys):
+        for key in keys:
+            if key in self.data:
+                flags, value = self.data[key]
+                self.wfile.write('VALUE %s %s %d\r\n%s\r\n'
+                                 % (key, flags, len(value), value))
+        self.wfile.write('END\r\n')
+
+    def _store(self, key, flags, exptime, length, noreply=None):
+        value = self.rfile.read(int(length) + 2)[:-2]
+        return key, flags, value, noreply
+
+    def _reply(self, noreply, reply):
+        if noreply is None:
+            self.wfile.write('%s\r\n' % reply)
+
+    def do_set(self, *args):
+        key, flags, value, noreply = self._store(*args)
+        self.data[key] = (flags, value)
+        self._reply(noreply, 'STORED')
+
+    def do_add(self, *args):
+        key, flags, value, noreply = self._store(*args)
+        if key in self.data:
+            self._reply(noreply, 'NOT_STORED')
+        else:
+            self.data[key] = (flags, value)
+            self._reply(noreply, 'STORED')
+
+    def do_append(self, *args):
+        key, flags, value, noreply = self._store(*args)
+        if key in self.data:
+            flags, old_value = self.data[key]
+            self.data[key] = (flags, old_value + value)
+            self._reply(noreply, 'STORED')
+        else:
+            self._reply(noreply, 'NOT_STORED')
+
+    def do_incr(self, key, delta, noreply=None):
+        if key in self.data:
+            flags, value = self.data[key]
+            value = str(int(value) + int(delta))
+            self.data[key] = (flags, value)
+            self._reply(noreply, value)
+        else:
+            self._reply(noreply, 'NOT_FOUND')
+
+    def do_delete(self, key, *args):
+        noreply = 'noreply' if 'noreply' in args else None
+        if self.data.pop(key, None) is None:
+            self._reply(noreply, 'NOT_FOUND')
+        else:
+            self._reply(noreply, 'DELETED')
+
+
+class PreviousToken(memcache.Token):
+    """The driver as it was, checking for the token before deleting it and
+    reading and writing one key per round trip."""
+
+    def delete_token(self, token_id):
+        self.get_token(token_id)
+        self.client.delete(self._prefix_token_id(token_id))
+
+    def get_tokens(self, token_ids):
+        token_refs = {}
+        for token_id in token_ids:
+            try:
+                token_refs[token_id] = self.get_token(token_id)
+            except Exception:
+                pass
+        return token_refs
+
+    def add_revocations(self, token_ids):
+        for token_id in token_ids:
+            seq = self.client.incr('token_revocation_seq')
+            if seq is None:
+                self.client.add('token_revocation_seq', '0')
+                seq = self.client.incr('token_revocation_seq')
+            self.client.set('token_revocation-%d' % seq,
+                            {'id': token_id, 'revoked': None})
+
+
+def start_stand_in():
+    SocketServer.ThreadingTCPServer.allow_reuse_address = True
+    SocketServer.ThreadingTCPServer.daemon_threads = True
+    server = SocketServer.ThreadingTCPServer(('127.0.0.1', 0),
+                                             MemcachedStandIn)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return '127.0.0.1:%d' % server.server_address[1]
+
+
+def create_tokens(driver, count):
+    token_ids = [uuid.uuid4().hex for i in range(count)]
+    for token_id in token_ids:
+        driver.create_token(token_id, {'id': token_id,
+                                       'user': {'id': 'bench-user'},
+                                       'metadata': {'roles': []}})
+    return token_ids
+
+
+def timed(func, iterations):
+    start = time.time()
+    for i in xrange(iterations):
+        func()
+    return (time.time() - start) / iterations * 1e3
+
+
+def bench(driver, iterations):
+    results = {}
+    token_ids = iter(create_tokens(driver, iterations))
+    results['delete_token'] = timed(
+            lambda: driver.delete_token(token_ids.next()), iterations)
+
+    token_ids = create_tokens(driver, BATCH)
+    results['get_tokens x%d' % BATCH] = timed(
+            lambda: driver.get_tokens(token_ids), iterations)
+    results['add_revocations x%d' % BATCH] = timed(
+            lambda: driver.add_revocations(token_ids), iterations)
+    return results
+
+
+def main(iterations=200):
+    CONF.set_override('servers', start_stand_in(), group='memcache')
+
+    previous = bench(PreviousToken(), iterations)
+    batched = bench(memcache.Token(), iterations)
+    print '%-20s %12s %12s' % ('operation', 'previous', 'batched')
+    for name in sorted(batched):
+        print '%-20s %10.3fms %10.3fms' % (name, previous[name],
+                                           batched[name])
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,80 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+Compare the size and encode/decode time of memcache token formats.
+
+The pickle format is measured the way python-memcache stores it, with
+cPickle and the client's default protocol 0.
+
+Usage: tools/with_venv.sh python tools/bench_memcache_token.py [iterations]
+"""
+
+import cPickle
+import datetime
+import os
+import sys
+import timeit
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+
+from keystone.token.backends import memcache
+
+
+def token_data(roles):
+    return {'id': uuid.uuid4().hex,
+            'expires': datetime.datetime.utcnow(),
+            'user': {'id': uuid.uuid4().hex,
+                     'name': 'demo',
+                     'email': 'demo@example.com',
+                     'enabled': True},
+            'tenant': {'id': uuid.uuid4().hex,
+                       'name': 'demo',
+                       'description': 'A tenant for benchmarking',
+                       'enabled': True},
+            'metadata': {'roles': [uuid.uuid4().hex for i in range(roles)]}}
+
+
+def timed(func, number):
+    return min(timeit.repeat(func, number=number, repeat=3)) / number * 1e6
+
+
+def main(iterations=20000):
+    compact = memcache.CompactFormat()
+
+    print '%-6s %-8s %8s %12s %12s' % ('roles', 'format', 'bytes',
+                                       'encode', 'decode')
+    for roles in (2, 20):
+        data = token_data(roles)
+
+        pickled = cPickle.dumps(data, 0)
+        encoded = compact.encode(data)
+        assert compact.decode(encoded) == data
+
+        print '%-6d %-8s %8d %10.2fus %10.2fus' % (
+                roles, 'pickle', len(pickled),
+                timed(lambda: cPickle.dumps(data, 0), iterations),
+                timed(lambda: cPickle.loads(pickled), iterations))
+        print '%-6d %-8s %8d %10.2fus %10.2fus' % (
+                roles, 'compact', len(encoded),
+                timed(lambda: compact.encode(data), iterations),
+                timed(lambda: compact.decode(encoded), iterations))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
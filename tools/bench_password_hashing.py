@@ -0,0 +1,104 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+Measure token validation latency in a greenthread while other greenthreads
+authenticate with passwords, with password hashing done in the server
+process and in a pool of password_hash_workers processes.
+
+Each validation is due a short interval after the previous one finished
+and its latency is measured from then, so time spent waiting for the hub
+to get back to it counts against it.
+
+Usage: tools/with_venv.sh python tools/bench_password_hashing.py [workers]
+"""
+
+import os
+import sys
+import time
+import uuid
+
+import eventlet
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+
+from keystone import config
+from keystone.common import utils
+from keystone.token.backends import kvs
+
+
+CONF = config.CONF
+AUTHENTICATORS = 4
+DURATION = 5.0
+VALIDATION_INTERVAL = 0.005
+
+
+def authenticate(hashed, deadline):
+    while time.time() < deadline:
+        utils.check_password('secret', hashed)
+        eventlet.sleep(0)
+
+
+def validate(token_api, token_id, deadline):
+    latencies = []
+    while time.time() < deadline:
+        due = time.time() + VALIDATION_INTERVAL
+        eventlet.sleep(VALIDATION_INTERVAL)
+        token_api.get_token(token_id)
+        # reading the request and writing the response would yield too
+        eventlet.sleep(0)
+        latencies.append(time.time() - due)
+    return latencies
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(int(len(values) * percent / 100.0), len(values) - 1)]
+
+
+def bench(workers):
+    CONF.set_override('password_hash_workers', workers)
+    hashed = utils.hash_password('secret')
+    token_api = kvs.Token(db={})
+    token_id = uuid.uuid4().hex
+    token_api.create_token(token_id, {'id': token_id})
+
+    deadline = time.time() + DURATION
+    pool = eventlet.GreenPool()
+    for i in range(AUTHENTICATORS):
+        pool.spawn(authenticate, hashed, deadline)
+    latencies = pool.spawn(validate, token_api, token_id, deadline).wait()
+    pool.waitall()
+    return latencies
+
+
+def main(workers=AUTHENTICATORS):
+    # keep the reaper greenthread out of the measurements
+    CONF.set_override('kvs_reap_interval', 0, group='token')
+
+    print '%-10s %10s %10s %10s' % ('workers', 'p50', 'p99', 'max')
+    for count in (0, workers):
+        latencies = [x * 1e3 for x in bench(count)]
+        print '%-10d %8.2fms %8.2fms %8.2fms' % (
+                count, percentile(latencies, 50),
+                percentile(latencies, 99), max(latencies))
+    CONF.set_override('password_hash_workers', 0)
+    utils._get_password_hash_pool()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,78 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+Micro-benchmark comparing the interpreted and compiled policy brains.
+
+Usage: tools/with_venv.sh python tools/bench_policy.py [iterations]
+"""
+
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+
+from keystone.common import policy
+
+
+RULES = {
+    'default': [['role:member']],
+    'admin_required': [['role:admin'], ['role:KeystoneAdmin'],
+                       ['is_admin:1']],
+    'owner': [['user_id:%(user_id)s']],
+    'admin_or_owner': [['rule:admin_required'], ['rule:owner']],
+    'tenant_member': [['tenant_id:%(tenant_id)s', 'role:member']],
+    'compute:get': [['rule:admin_or_owner'], ['rule:tenant_member']],
+}
+
+CASES = [
+    ('admin', ('rule:admin_required',),
+     {}, {'roles': ['Member', 'Admin'], 'is_admin': 0}),
+    ('denied', ('rule:admin_required',),
+     {}, {'roles': ['a', 'b', 'c', 'd', 'member'], 'is_admin': 0}),
+    ('nested', ('rule:compute:get',),
+     {'user_id': 'other', 'tenant_id': 'tenant'},
+     {'roles': ['member'], 'user_id': 'me', 'tenant_id': 'tenant'}),
+    ('default', ('rule:missing',), {}, {'roles': ['member']}),
+]
+
+
+def bench(brain_cls, match_list, target, creds, iterations):
+    brain = brain_cls(dict(RULES), 'default')
+
+    def run():
+        brain.check(match_list, target, creds)
+
+    return min(timeit.repeat(run, number=iterations, repeat=3))
+
+
+def main(iterations=100000):
+    print '%-10s %12s %12s %8s' % ('case', 'Brain', 'Compiled', 'speedup')
+    for name, match_list, target, creds in CASES:
+        t_brain = bench(policy.Brain, match_list, target, creds, iterations)
+        t_compiled = bench(policy.CompiledBrain, match_list, target, creds,
+                           iterations)
+        print '%-10s %10.2fus %10.2fus %7.1fx' % (
+                name,
+                t_brain / iterations * 1e6,
+                t_compiled / iterations * 1e6,
+                t_brain / t_compiled)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
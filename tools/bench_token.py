@@ -0,0 +1,110 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+Benchmark token create/get throughput of the kvs token driver, comparing
+frozen token records with the deep copies the driver used to make.
+
+Usage: tools/with_venv.sh python tools/bench_token.py [iterations]
+"""
+
+import copy
+import gc
+import os
+import sys
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+
+from keystone import config
+from keystone.token.backends import kvs
+
+
+CONF = config.CONF
+
+
+class DeepCopyToken(kvs.Token):
+    """The kvs driver as it was, copying tokens on the way in and out."""
+
+    def create_token(self, token_id, data):
+        data_copy = copy.deepcopy(data)
+        if 'expires' not in data:
+            data_copy['expires'] = self._get_default_expire_time()
+        self.db[self._key(token_id)] = data_copy.copy()
+        return copy.deepcopy(data_copy)
+
+    def _key(self, token_id):
+        return 'token-%s' % token_id
+
+
+def token_data(token_id):
+    return {'id': token_id,
+            'user': {'id': uuid.uuid4().hex,
+                     'name': 'demo',
+                     'email': 'demo@example.com',
+                     'enabled': True,
+                     'tenants': [uuid.uuid4().hex for i in range(3)]},
+            'tenant': {'id': uuid.uuid4().hex,
+                       'name': 'demo',
+                       'description': 'A tenant for benchmarking',
+                       'enabled': True},
+            'metadata': {'roles': [uuid.uuid4().hex for i in range(4)]}}
+
+
+def bench(driver_cls, iterations):
+    driver = driver_cls(db={})
+    ids = [uuid.uuid4().hex for i in xrange(iterations)]
+    payloads = [token_data(token_id) for token_id in ids]
+
+    # like timeit, keep the garbage collector out of the measurements
+    gc.collect()
+    gc.disable()
+    try:
+        return _bench(driver, ids, payloads)
+    finally:
+        gc.enable()
+
+
+def _bench(driver, ids, payloads):
+    iterations = len(ids)
+    start = time.time()
+    for token_id, data in zip(ids, payloads):
+        driver.create_token(token_id, data)
+    create_time = time.time() - start
+
+    start = time.time()
+    for token_id in ids:
+        driver.get_token(token_id)
+    get_time = time.time() - start
+
+    return iterations / create_time, iterations / get_time
+
+
+def main(iterations=20000):
+    # keep the reaper greenthread out of the measurements
+    CONF.set_override('kvs_reap_interval', 0, group='token')
+
+    print '%-10s %14s %14s' % ('', 'create/s', 'get/s')
+    for name, driver_cls in (('deepcopy', DeepCopyToken),
+                             ('frozen', kvs.Token)):
+        creates, gets = bench(driver_cls, iterations)
+        print '%-10s %14d %14d' % (name, creates, gets)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])